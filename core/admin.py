@@ -24,4 +24,33 @@ admin.site.register(Category)
 admin.site.register(Color)
 admin.site.register(Size)
 admin.site.register(Review)
-admin.site.register(Order)
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+
+class OrderAdmin(admin.ModelAdmin):
+    inlines = (OrderLineInline,)
+
+admin.site.register(Order, OrderAdmin)
+
+
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'status', 'attempts', 'received_at')
+    list_filter = ('status', 'event_type')
+    readonly_fields = ('event_id', 'event_type', 'payload', 'received_at', 'processed_at')
+
+admin.site.register(PaymentEvent, PaymentEventAdmin)
+
+
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
+
+
+class ImageVariantJobAdmin(admin.ModelAdmin):
+    list_display = ('content_type', 'object_id', 'status', 'attempts', 'next_attempt_at', 'processed_at')
+    list_filter = ('status', 'content_type')
+
+admin.site.register(ImageVariantJob, ImageVariantJobAdmin)
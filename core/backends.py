@@ -0,0 +1,144 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model, user_login_failed
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import make_password, verify_password
+from django.core.exceptions import PermissionDenied
+from django.db.models import Case, Q, Value, When
+
+from . import throttle
+
+EMAIL_OR_USERNAME_BACKEND = 'core.backends.EmailOrUsernameBackend'
+
+
+class ProfileBackend(ModelBackend):
+    """
+    ModelBackend that loads the user together with their UserProfile, so
+    `request.user.userprofile` costs no extra query for the rest of the
+    request.
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('userprofile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+def account_throttle_key(identifier):
+    digest = hashlib.sha256(identifier.strip().lower().encode()).hexdigest()
+    return f'login:account:{digest}'
+
+
+def client_ip(request):
+    """
+    The address the IP bucket is keyed on: REMOTE_ADDR, or the entry
+    LOGIN_THROTTLE_TRUSTED_PROXIES hops from the right of
+    LOGIN_THROTTLE_IP_HEADER when the site runs behind proxies.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR')
+    if not settings.LOGIN_THROTTLE_IP_HEADER:
+        return remote_addr
+    hops = [hop.strip() for hop in request.headers.get(settings.LOGIN_THROTTLE_IP_HEADER, '').split(',') if hop.strip()]
+    trusted = settings.LOGIN_THROTTLE_TRUSTED_PROXIES
+    # Fewer entries than proxies means the request skipped one of them.
+    return hops[-trusted] if trusted and len(hops) >= trusted else remote_addr
+
+
+def throttles(request, identifier):
+    """(cache key, capacity, period) buckets one login attempt spends from."""
+    buckets = [(account_throttle_key(identifier), *settings.LOGIN_THROTTLE_PER_ACCOUNT)]
+    ip = client_ip(request) if request is not None else None
+    if ip:
+        buckets.insert(0, (f'login:ip:{ip}', *settings.LOGIN_THROTTLE_PER_IP))
+    return buckets
+
+
+def deny(request):
+    # Lets the login view tell a throttled attempt from a wrong password.
+    if request is not None:
+        request.login_throttled = True
+    raise PermissionDenied
+
+
+class EmailOrUsernameBackend(ProfileBackend):
+    """
+    Accepts a username or an email address. The account is resolved in one
+    query over the username and email indexes, and every attempt spends a
+    token from per-IP and per-account buckets before any password is hashed.
+    """
+
+    def lookup(self, identifier):
+        UserModel = get_user_model()
+        # An exact username match wins over an email that happens to equal it.
+        return (
+            UserModel._default_manager.select_related('userprofile')
+            .filter(Q(username=identifier) | Q(email=identifier))
+            .order_by(Case(When(username=identifier, then=Value(0)), default=Value(1)), 'pk')[:2]
+        )
+
+    def resolve(self, users, identifier):
+        if users and users[0].username == identifier:
+            return users[0]
+        # Two accounts sharing an email address are ambiguous.
+        return users[0] if len(users) == 1 else None
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(get_user_model().USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        if not all([throttle.consume(*bucket) for bucket in throttles(request, username)]):
+            deny(request)
+        user = self.resolve(list(self.lookup(username)), username)
+        if user is None:
+            # Hash anyway so unknown accounts take as long as wrong passwords.
+            make_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            throttle.reset(account_throttle_key(username))
+            return user
+        return None
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(get_user_model().USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        if not all([await throttle.aconsume(*bucket) for bucket in throttles(request, username)]):
+            deny(request)
+        user = self.resolve([user async for user in self.lookup(username)], username)
+        # Hashing is CPU-bound; run it on a worker thread, off the event loop
+        # and off the shared thread that runs sync views.
+        if user is None:
+            await sync_to_async(make_password, thread_sensitive=False)(password)
+            return None
+        is_correct, must_update = await sync_to_async(verify_password, thread_sensitive=False)(password, user.password)
+        if not (is_correct and self.user_can_authenticate(user)):
+            return None
+        if must_update:
+            user.password = await sync_to_async(make_password, thread_sensitive=False)(password)
+            await user.asave(update_fields=['password'])
+        await throttle.areset(account_throttle_key(username))
+        return user
+
+
+async def aauthenticate(request=None, username=None, password=None):
+    """
+    Async counterpart of django.contrib.auth.authenticate() for
+    EmailOrUsernameBackend. Django's own aauthenticate() runs the sync
+    backend on the shared sync thread, hashing included.
+    """
+    try:
+        user = await EmailOrUsernameBackend().aauthenticate(request, username=username, password=password)
+    except PermissionDenied:
+        user = None
+    if user is None:
+        await user_login_failed.asend(sender=__name__, credentials={'username': username}, request=request)
+        return None
+    user.backend = EMAIL_OR_USERNAME_BACKEND
+    return user
@@ -0,0 +1,75 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cart import SESSION_KEY as CART_SESSION_KEY
+
+CATALOG_VERSION_KEY = 'catalog:version'
+FACET_VERSION_KEY = 'facets:version'
+
+
+def current_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(key):
+    # Bumping the version orphans every entry keyed on it at once, which
+    # works on backends that cannot delete by prefix (locmem, file).
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def catalog_version():
+    return current_version(CATALOG_VERSION_KEY)
+
+
+def invalidate_catalog():
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def facet_version():
+    return current_version(FACET_VERSION_KEY)
+
+
+def invalidate_facets():
+    bump_version(FACET_VERSION_KEY)
+
+
+def page_cache_key(request, prefix):
+    query = hashlib.md5(request.META.get('QUERY_STRING', '').encode()).hexdigest()
+    return f'page:{prefix}:{catalog_version()}:{query}'
+
+
+def cache_anonymous_page(prefix, timeout=None):
+    if timeout is None:
+        timeout = settings.PAGE_CACHE_TIMEOUT
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Visitors with a session cart see their own cart badge.
+            if (
+                request.method not in ('GET', 'HEAD') or request.user.is_authenticated
+                or request.session.get(CART_SESSION_KEY)
+            ):
+                return view(request, *args, **kwargs)
+
+            key = page_cache_key(request, prefix)
+            response = cache.get(key)
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                cache.set(key, response, timeout)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,195 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.http import Http404
+
+from .models import CartItem, Product
+
+MAX_QUANTITY = 100
+SESSION_KEY = 'cart'
+EMPTY_SUMMARY = {'count': 0, 'items': 0, 'total': 0}
+
+
+def line_total():
+    return F('quantity') * F('product__price')
+
+
+def cart_items(user_profile):
+    return (
+        CartItem.objects.filter(user=user_profile)
+        .select_related('product', 'color', 'size')
+        .prefetch_related('product__image_set')
+        .annotate(line_total=line_total())
+        .order_by('id')
+    )
+
+
+def cart_summary(user_profile):
+    summary = CartItem.objects.filter(user=user_profile).aggregate(
+        count=Count('id'), items=Sum('quantity'), total=Sum(line_total()),
+    )
+    summary['items'] = summary['items'] or 0
+    summary['total'] = summary['total'] or 0
+    return summary
+
+
+def summary_key(user_profile_id):
+    return f'cart:summary:{user_profile_id}'
+
+
+def cached_summary(user_profile):
+    """
+    Line count, item count and total for one cart. Computed once and kept
+    in the cache until a CartItem of that user or the price of a product in
+    the cart changes.
+    """
+    key = summary_key(getattr(user_profile, 'pk', user_profile))
+    summary = cache.get(key)
+    if summary is None:
+        summary = cart_summary(user_profile)
+        cache.set(key, summary, settings.CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_summaries(user_profile_ids):
+    keys = [summary_key(user_profile_id) for user_profile_id in set(user_profile_ids)]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    # A request that read the old rows before this transaction commits could
+    # store them again; drop the keys once more after the commit.
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def cart_total(user_profile):
+    return cached_summary(user_profile)['total']
+
+
+def add_item(user_profile, product, color, size=None, quantity=1):
+    with transaction.atomic():
+        item, created = CartItem.objects.select_for_update().get_or_create(
+            user=user_profile, product=product, color=color, defaults={'quantity': 0},
+        )
+        item.quantity = min(MAX_QUANTITY, item.quantity + quantity)
+        if size is not None:
+            item.size = size
+        item.save()
+    return item
+
+
+def parse_quantity(value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f'"{value}" is not a valid quantity.')
+    if not 1 <= quantity <= MAX_QUANTITY:
+        raise ValidationError(f'Quantity must be between 1 and {MAX_QUANTITY}.')
+    return quantity
+
+
+def update_quantities(user_profile, quantities):
+    """
+    Apply {item_id: quantity} for one user's cart. Every id must belong to the
+    user; ownership is checked in one query and the change is one bulk UPDATE.
+    """
+    try:
+        quantities = {int(item_id): parse_quantity(quantity) for item_id, quantity in quantities.items()}
+    except ValueError:
+        raise Http404('No CartItem matches the given query.')
+    if not quantities:
+        return 0
+    with transaction.atomic():
+        items = list(
+            CartItem.objects.select_for_update()
+            .filter(user=user_profile, id__in=quantities)
+            .only('id', 'quantity')
+        )
+        if len(items) != len(quantities):
+            raise Http404('No CartItem matches the given query.')
+        for item in items:
+            item.quantity = quantities[item.id]
+        CartItem.objects.bulk_update(items, ['quantity'])
+    invalidate_summaries([user_profile.pk])
+    return len(items)
+
+
+def remove_item(user_profile, item_id):
+    try:
+        item_id = int(item_id)
+    except (TypeError, ValueError):
+        raise Http404('No CartItem matches the given query.')
+    deleted, _ = CartItem.objects.filter(user=user_profile, id=item_id).delete()
+    if not deleted:
+        raise Http404('No CartItem matches the given query.')
+
+
+def session_lines(session):
+    return session.get(SESSION_KEY, {})
+
+
+def add_session_item(session, product, color, size=None, quantity=1):
+    """
+    Add to an anonymous visitor's cart, kept in the session as
+    {"product:color": line}. The price is the one seen when adding; the
+    database cart takes over with current prices at login.
+    """
+    lines = session_lines(session)
+    line = lines.setdefault(f'{product.pk}:{color.pk}', {'product': product.pk, 'color': color.pk, 'size': None, 'quantity': 0})
+    line['quantity'] = min(MAX_QUANTITY, line['quantity'] + quantity)
+    line['price'] = product.price
+    if size is not None:
+        line['size'] = size.pk
+    session[SESSION_KEY] = lines
+
+
+def session_summary(session):
+    lines = session_lines(session).values()
+    if not lines:
+        return EMPTY_SUMMARY
+    return {
+        'count': len(lines),
+        'items': sum(line['quantity'] for line in lines),
+        'total': sum(line['quantity'] * line['price'] for line in lines),
+    }
+
+
+def merge_session_cart(user_profile, session):
+    """
+    Move a session cart into the user's cart at login. Lines for a product and
+    colour the user already has add to that row's quantity, so the merge never
+    creates a second row for the same (user, product, colour). Products or
+    colours removed since are dropped. At most four queries however long the
+    cart is.
+    """
+    lines = session.pop(SESSION_KEY, None)
+    if not lines:
+        return 0
+    product_ids = {line['product'] for line in lines.values()}
+    offered = set(
+        Product.color.through.objects.filter(product_id__in=product_ids).values_list('product_id', 'color_id')
+    )
+    with transaction.atomic():
+        existing = {
+            (item.product_id, item.color_id): item
+            for item in CartItem.objects.select_for_update().filter(user=user_profile, product_id__in=product_ids)
+        }
+        changed, created = [], []
+        for line in lines.values():
+            key = (line['product'], line['color'])
+            if key not in offered:
+                continue
+            item = existing.get(key)
+            if item is None:
+                item = CartItem(user=user_profile, product_id=line['product'], color_id=line['color'], quantity=0)
+                created.append(item)
+            else:
+                changed.append(item)
+            item.quantity = min(MAX_QUANTITY, item.quantity + line['quantity'])
+            if line['size'] is not None:
+                item.size_id = line['size']
+        CartItem.objects.bulk_update(changed, ['quantity', 'size'])
+        CartItem.objects.bulk_create(created)
+    invalidate_summaries([user_profile.pk])
+    return len(changed) + len(created)
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.urls import reverse
+
+from .models import CartItem, Order, OrderLine
+
+
+class EmptyCartError(Exception):
+    pass
+
+
+def create_order(user_profile, billing_address=None, order_note=None):
+    """Snapshot the whole cart into one Order with one OrderLine per item."""
+    with transaction.atomic():
+        items = list(
+            CartItem.objects.select_for_update()
+            .filter(user=user_profile)
+            .select_related('product')
+            .order_by('id')
+        )
+        if not items:
+            raise EmptyCartError
+        order = Order.objects.create(
+            user=user_profile,
+            billing_address=billing_address,
+            order_note=order_note,
+            total_price=sum(item.product.price * item.quantity for item in items),
+        )
+        OrderLine.objects.bulk_create(
+            OrderLine(
+                order=order, cart_item=item, product=item.product, title=item.product.title,
+                unit_price=item.product.price, quantity=item.quantity,
+                color_id=item.color_id, size_id=item.size_id,
+            )
+            for item in items
+        )
+    return order
+
+
+def payment_line_items(order):
+    return [
+        {
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {'name': line.title},
+                'unit_amount': int(line.unit_price * 100),
+            },
+            'quantity': line.quantity,
+        }
+        for line in order.lines.all()
+    ]
+
+
+def payment_session_params(request, order, payment_method):
+    return {
+        'payment_method_types': [payment_method],
+        'line_items': payment_line_items(order),
+        'customer_email': request.user.email,
+        'mode': 'payment',
+        'client_reference_id': str(order.id),
+        'metadata': {
+            'order_id': order.id,
+            'user_id': order.user_id,
+            'payment_method': payment_method,
+        },
+        'success_url': request.build_absolute_uri(reverse('core:success')) + '?session_id={CHECKOUT_SESSION_ID}',
+        'cancel_url': request.build_absolute_uri(reverse('core:cancel')),
+    }
+
@@ -0,0 +1,18 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import cart
+
+
+def cart_summary(request):
+    """
+    `cart_summary` with the line count, item count and total of the visitor's cart,
+    read from the cache (or the session for anonymous visitors) only when a
+    template uses it.
+    """
+    def summary():
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return cart.cached_summary(user.userprofile)
+        return cart.session_summary(request.session)
+
+    return {'cart_summary': SimpleLazyObject(summary)}
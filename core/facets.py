@@ -0,0 +1,248 @@
+import hashlib
+import json
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils.functional import cached_property
+from taggit.models import Tag
+
+from .cache import facet_version, invalidate_catalog, invalidate_facets
+from .models import Product, ProductFacet, FacetCount, Category, Color, Size
+
+# (key, label, min, max) with max exclusive; None means open-ended.
+PRICE_BUCKETS = (
+    ('0-10', 'Less than $10', 0, 10),
+    ('10-20', '$10 - $20', 10, 20),
+    ('20-30', '$20 - $30', 20, 30),
+    ('30-40', '$30 - $40', 30, 40),
+    ('40-50', '$40 - $50', 40, 50),
+    ('50-', '$50 and above', 50, None),
+)
+
+# Query-string parameter for each facet; price keeps the existing name.
+FACET_PARAMS = (
+    (ProductFacet.PRICE, 'price_range'),
+    (ProductFacet.CATEGORY, 'category'),
+    (ProductFacet.COLOR, 'color'),
+    (ProductFacet.SIZE, 'size'),
+    (ProductFacet.TAG, 'tag'),
+)
+
+LABEL_MODELS = {
+    ProductFacet.CATEGORY: Category,
+    ProductFacet.COLOR: Color,
+    ProductFacet.SIZE: Size,
+    ProductFacet.TAG: Tag,
+}
+
+
+def price_bucket(price):
+    for key, _, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return key
+    return None
+
+
+def product_facet_values(product):
+    values = set()
+    bucket = price_bucket(product.price)
+    if bucket:
+        values.add((ProductFacet.PRICE, bucket))
+    if product.category_id:
+        values.add((ProductFacet.CATEGORY, str(product.category_id)))
+    values.update((ProductFacet.COLOR, str(color.pk)) for color in product.color.all())
+    values.update((ProductFacet.SIZE, str(size.pk)) for size in product.sizes.all())
+    values.update((ProductFacet.TAG, str(tag.pk)) for tag in product.tags.all())
+    return values
+
+
+def adjust_counts(deltas):
+    by_delta = defaultdict(list)
+    for key, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(key)
+    if not by_delta:
+        return
+    transaction.on_commit(invalidate_facets)
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value) for keys in by_delta.values() for facet, value in keys],
+        ignore_conflicts=True,
+    )
+    for delta, keys in by_delta.items():
+        match = reduce(or_, (Q(facet=facet, value=value) for facet, value in keys))
+        FacetCount.objects.filter(match).update(count=F('count') + delta)
+
+
+def reindex_product(product_id):
+    with transaction.atomic():
+        product = Product.objects.filter(pk=product_id).prefetch_related('color', 'sizes', 'tags').first()
+        new = product_facet_values(product) if product else set()
+        old = set(ProductFacet.objects.filter(product_id=product_id).values_list('facet', 'value'))
+        added, removed = new - old, old - new
+        if removed:
+            ProductFacet.objects.filter(
+                reduce(or_, (Q(facet=facet, value=value) for facet, value in removed)),
+                product_id=product_id,
+            ).delete()
+        if added:
+            ProductFacet.objects.bulk_create(
+                ProductFacet(product_id=product_id, facet=facet, value=value) for facet, value in added
+            )
+        deltas = Counter(added)
+        deltas.subtract(Counter(removed))
+        adjust_counts(deltas)
+
+
+def remove_product(product_id):
+    with transaction.atomic():
+        rows = ProductFacet.objects.filter(product_id=product_id)
+        deltas = Counter({key: -1 for key in rows.values_list('facet', 'value')})
+        rows.delete()
+        adjust_counts(deltas)
+
+
+def rebuild(batch_size=1000):
+    with transaction.atomic():
+        ProductFacet.objects.all().delete()
+        FacetCount.objects.all().delete()
+        batch = []
+        products = Product.objects.order_by('pk').prefetch_related('color', 'sizes', 'tags')
+        for product in products.iterator(chunk_size=batch_size):
+            batch.extend(
+                ProductFacet(product_id=product.pk, facet=facet, value=value)
+                for facet, value in product_facet_values(product)
+            )
+            if len(batch) >= batch_size:
+                ProductFacet.objects.bulk_create(batch)
+                batch = []
+        ProductFacet.objects.bulk_create(batch)
+        counts = ProductFacet.objects.values('facet', 'value').annotate(n=Count('id')).order_by()
+        FacetCount.objects.bulk_create(
+            FacetCount(facet=row['facet'], value=row['value'], count=row['n']) for row in counts
+        )
+    invalidate_facets()
+    invalidate_catalog()
+
+
+def parse_selection(params):
+    selection = {}
+    valid_buckets = {key for key, *_ in PRICE_BUCKETS}
+    for facet, param in FACET_PARAMS:
+        values = [value for value in params.getlist(param) if value]
+        if facet == ProductFacet.PRICE:
+            values = [value for value in values if value in valid_buckets]
+        else:
+            values = [value for value in values if value.isdigit()]
+        if values:
+            selection[facet] = values
+    return selection
+
+
+def filter_products(queryset, selection, exclude=None):
+    for facet, values in selection.items():
+        if facet == exclude:
+            continue
+        queryset = queryset.filter(
+            pk__in=ProductFacet.objects.filter(facet=facet, value__in=values).values('product_id')
+        )
+    return queryset
+
+
+def selection_cache_key(selection):
+    canonical = json.dumps({facet: sorted(values) for facet, values in selection.items()}, sort_keys=True)
+    return f'facet-counts:{facet_version()}:{hashlib.md5(canonical.encode()).hexdigest()}'
+
+
+def count_selection(selection):
+    counts = {}
+    for facet, _ in FACET_PARAMS:
+        matching = filter_products(Product.objects.all(), selection, exclude=facet)
+        rows = ProductFacet.objects.filter(facet=facet, product__in=matching).values('value').annotate(n=Count('id')).order_by()
+        counts[facet] = {row['value']: row['n'] for row in rows}
+    return counts
+
+
+def facet_counts(selection):
+    """
+    Counts per facet value. Unfiltered counts come straight from FacetCount;
+    with a selection, each facet is counted over the products matching the
+    other facets only, so options within a facet stay combinable. Those
+    GROUP BYs read every matching product, so their result is cached per
+    selection under a version that only moves when the facet index itself
+    changes; reviews, images and edits that keep a product's facets leave
+    it warm.
+    """
+    if not selection:
+        counts = {facet: {} for facet, _ in FACET_PARAMS}
+        for row in FacetCount.objects.filter(count__gt=0).values('facet', 'value', 'count'):
+            counts[row['facet']][row['value']] = row['count']
+        return counts
+
+    key = selection_cache_key(selection)
+    counts = cache.get(key)
+    if counts is None:
+        counts = count_selection(selection)
+        cache.set(key, counts, settings.FACET_COUNTS_TIMEOUT)
+    return counts
+
+
+def facet_labels(counts):
+    labels = {ProductFacet.PRICE: {key: label for key, label, *_ in PRICE_BUCKETS}}
+    for facet, model in LABEL_MODELS.items():
+        ids = [int(value) for value in counts[facet]]
+        labels[facet] = {str(pk): str(obj) for pk, obj in model.objects.in_bulk(ids).items()} if ids else {}
+    return labels
+
+
+class FacetedResult:
+    def __init__(self, queryset, selection, counts, params):
+        self.queryset = queryset
+        self.selection = selection
+        self.counts = counts
+        self.params = params
+
+    @cached_property
+    def facets(self):
+        labels = facet_labels(self.counts)
+        order = {key: index for index, (key, *_) in enumerate(PRICE_BUCKETS)}
+        facets = []
+        for facet, param in FACET_PARAMS:
+            options = []
+            selected = self.selection.get(facet, [])
+            for value, count in self.counts[facet].items():
+                if value not in labels[facet]:
+                    continue
+                params = self.params.copy()
+                params.pop('cursor', None)
+                chosen = [v for v in selected if v != value] if value in selected else selected + [value]
+                params.setlist(param, chosen)
+                options.append({
+                    'value': value,
+                    'label': labels[facet][value],
+                    'count': count,
+                    'selected': value in selected,
+                    'query': params.urlencode(),
+                })
+            if facet == ProductFacet.PRICE:
+                options.sort(key=lambda option: order[option['value']])
+            else:
+                options.sort(key=lambda option: (-option['count'], option['label']))
+            if options:
+                facets.append({'name': facet, 'label': dict(ProductFacet.FACET_CHOICES)[facet], 'options': options})
+        return facets
+
+
+def faceted_search(queryset, params):
+    selection = parse_selection(params)
+    return FacetedResult(filter_products(queryset, selection), selection, facet_counts(selection), params)
+
+
+def remove_value(facet, value):
+    ProductFacet.objects.filter(facet=facet, value=value).delete()
+    FacetCount.objects.filter(facet=facet, value=value).delete()
+    transaction.on_commit(invalidate_facets)
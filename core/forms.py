@@ -1,9 +1,11 @@
 from django import forms
 from django.contrib.auth.models import User
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import PasswordResetForm, UserCreationForm
+from django.template import loader
 from django.core.exceptions import ValidationError
 from django_countries.fields import CountryField
 from .models import *
+from .outbox import enqueue
 
 
 class CustomAuthenticationForm(forms.Form):
@@ -165,3 +167,10 @@ class CheckoutForm(forms.Form):
             field = self.fields[field_name]
             field.widget.attrs.update({'class': 'form-control'})
 
+
+class OutboxPasswordResetForm(PasswordResetForm):
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email, html_email_template_name=None):
+        subject = ''.join(loader.render_to_string(subject_template_name, context).splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = loader.render_to_string(html_email_template_name, context) if html_email_template_name else ''
+        enqueue(subject, body, [to_email], from_email=from_email, html_body=html_body)
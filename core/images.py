@@ -0,0 +1,249 @@
+"""
+Resized WebP/JPEG variants for uploaded images.
+
+Each image model keeps a `variants` JSON field describing the files made
+from its current upload, so templates can build a srcset without touching
+storage:
+
+    {'source': 'product-images/a.jpg', 'width': 700, 'height': 900,
+     'webp': [[320, 'variants/product-images/a-320w.webp'], ...],
+     'jpeg': [[320, 'variants/product-images/a-320w.jpg'], ...]}
+
+Saving an upload only queues an ImageVariantJob; `python manage.py
+process_image_variants` does the Pillow work. Until then templates fall back
+to the original file.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image as PILImage, ImageOps
+
+from .cache import invalidate_catalog
+from .models import Image, ImageVariantJob, Slideshow, UserProfile
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'variants'
+
+# model -> (image field, widths to generate)
+VARIANT_SPECS = {
+    Image: ('images', (160, 320, 480, 640)),
+    Slideshow: ('background_image', (480, 768, 1280, 1920)),
+    UserProfile: ('profile_picture', (48, 96, 150, 300)),
+}
+
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 60
+# A claimed batch is hidden from other workers for this long; if the worker
+# dies mid-batch the jobs become due again once it expires.
+CLAIM_TIMEOUT = 600
+
+FORMATS = (
+    ('webp', 'WEBP', '.webp', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', '.jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def variant_name(source, width, extension):
+    stem, _ = os.path.splitext(source)
+    return f'{VARIANT_DIR}/{stem}-{width}w{extension}'
+
+
+def flatten(image):
+    """JPEG has no alpha channel; composite transparent images onto white."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = PILImage.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def target_widths(original_width, widths):
+    chosen = [width for width in widths if width < original_width]
+    return chosen + [original_width] if len(chosen) < len(widths) else chosen
+
+
+def generate(source, widths, storage=None):
+    """Write every variant of `source` and return its variants description."""
+    storage = storage or default_storage
+    with storage.open(source, 'rb') as f:
+        original = ImageOps.exif_transpose(PILImage.open(f))
+        original.load()
+    description = {'source': source, 'width': original.width, 'height': original.height}
+
+    rgb = flatten(original)
+    for key, pil_format, extension, options in FORMATS:
+        base = original if pil_format == 'WEBP' and original.mode in ('RGBA', 'RGB') else rgb
+        files = []
+        for width in target_widths(original.width, widths):
+            height = max(1, round(original.height * width / original.width))
+            resized = base if width == original.width else base.resize((width, height), PILImage.LANCZOS, reducing_gap=3.0)
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            name = variant_name(source, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            files.append([width, storage.save(name, ContentFile(buffer.getvalue()))])
+        description[key] = files
+    return description
+
+
+def variant_files(variants):
+    return {name for key, _, _, _ in FORMATS for _, name in variants.get(key, ())}
+
+
+def delete_variants(variants, keep=(), storage=None):
+    storage = storage or default_storage
+    for name in variant_files(variants) - set(keep):
+        storage.delete(name)
+
+
+def is_current(instance):
+    field_name, _ = VARIANT_SPECS[type(instance)]
+    field = getattr(instance, field_name)
+    # The shared default avatar is small and never re-encoded per profile.
+    if not field.name or field.name == field.field.default:
+        return True
+    return instance.variants.get('source') == field.name
+
+
+def shared_variants(instance):
+    """Variants already made for the same stored file by another row."""
+    model = type(instance)
+    field_name, _ = VARIANT_SPECS[model]
+    source = getattr(instance, field_name).name
+    sibling = (
+        model.objects.filter(**{field_name: source, 'variants__source': source})
+        .exclude(pk=instance.pk).values_list('variants', flat=True).first()
+    )
+    return sibling
+
+
+def is_referenced(model, source):
+    field_name, _ = VARIANT_SPECS[model]
+    return model.objects.filter(**{field_name: source}).exists()
+
+
+def release(model, variants):
+    """Delete variant files unless another row still uses the same source."""
+    if variants and not is_referenced(model, variants.get('source')):
+        delete_variants(variants)
+
+
+def refresh(instance):
+    """Regenerate variants if the upload changed since they were last made."""
+    if is_current(instance):
+        return False
+    model = type(instance)
+    field_name, widths = VARIANT_SPECS[model]
+    previous = instance.variants
+    instance.variants = shared_variants(instance) or generate(getattr(instance, field_name).name, widths)
+    model.objects.filter(pk=instance.pk).update(variants=instance.variants)
+    if previous and not is_referenced(model, previous.get('source')):
+        delete_variants(previous, keep=variant_files(instance.variants))
+    return True
+
+
+def enqueue(instance):
+    """Queue variant generation for the worker. Commits with the caller's transaction."""
+    return ImageVariantJob.objects.create(
+        content_type=ContentType.objects.get_for_model(instance), object_id=instance.pk,
+    )
+
+
+def claim_batch(batch_size, now):
+    with transaction.atomic():
+        ids = list(
+            ImageVariantJob.objects.select_for_update(skip_locked=True)
+            .filter(status=ImageVariantJob.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        ImageVariantJob.objects.filter(id__in=ids).update(next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT))
+    return list(ImageVariantJob.objects.filter(id__in=ids).select_related('content_type').order_by('id'))
+
+
+def run_job(job):
+    """Refresh the job's image; a row deleted since it was queued needs nothing."""
+    instance = job.content_type.model_class().objects.filter(pk=job.object_id).first()
+    return instance is not None and refresh(instance)
+
+
+def process_pending(batch_size=20, now=None):
+    """
+    Generate variants for queued uploads, one claimed batch at a time. Failed
+    jobs are retried with linear backoff until MAX_ATTEMPTS. Returns the
+    number of images whose variants changed.
+    """
+    now = now or timezone.now()
+    refreshed = 0
+    while True:
+        jobs = claim_batch(batch_size, now)
+        if not jobs:
+            return refreshed
+        changed = 0
+        for job in jobs:
+            job.attempts += 1
+            try:
+                changed += run_job(job)
+            except Exception as e:
+                logger.exception('Could not generate image variants for %s', job)
+                job.last_error = repr(e)
+                if job.attempts >= MAX_ATTEMPTS:
+                    job.status = ImageVariantJob.FAILED
+                else:
+                    job.next_attempt_at = now + timedelta(seconds=RETRY_BACKOFF * job.attempts)
+            else:
+                job.status = ImageVariantJob.PROCESSED
+                job.processed_at = now
+        ImageVariantJob.objects.bulk_update(
+            jobs, ['status', 'attempts', 'last_error', 'next_attempt_at', 'processed_at']
+        )
+        if changed:
+            invalidate_catalog()
+        refreshed += changed
+
+
+def _generate_job(job):
+    pk, source, widths = job
+    try:
+        return pk, generate(source, widths), None
+    except Exception as e:
+        return pk, None, repr(e)
+
+
+def backfill(model, force=False, workers=None, batch_size=200):
+    """
+    Regenerate variants for every stored image of `model` on a process pool.
+    Returns (updated, errors) where errors is a list of (pk, message).
+    """
+    field_name, widths = VARIANT_SPECS[model]
+    rows = model.objects.exclude(**{field_name: ''}).only('pk', field_name, 'variants').order_by('pk')
+    jobs = [
+        (row.pk, getattr(row, field_name).name, widths)
+        for row in rows.iterator(chunk_size=batch_size)
+        if force or not is_current(row)
+    ]
+    if not jobs:
+        return 0, []
+
+    # Workers only do file and image work; the parent writes to the database.
+    updated, errors = [], []
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        for pk, variants, error in pool.map(_generate_job, jobs, chunksize=8):
+            if error:
+                errors.append((pk, error))
+            else:
+                updated.append(model(pk=pk, variants=variants))
+    model.objects.bulk_update(updated, ['variants'], batch_size=batch_size)
+    return len(updated), errors
@@ -0,0 +1,218 @@
+"""
+Per-request measurements: query count and time, duplicate queries, template
+render time and view time. Collected into a RequestMetrics object held in a
+context variable, so they follow a request across sync_to_async hops.
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+request_logger = logging.getLogger('core.requests')
+slow_query_logger = logging.getLogger('core.slow_queries')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def current_metrics():
+    return _current.get()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_name = None
+        self.view_started = None
+        self.view_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.templates = Counter()
+        self.lock = threading.Lock()
+
+    def add_query(self, alias, sql, params, duration):
+        with self.lock:
+            self.queries += 1
+            self.sql_time += duration
+            self.templates[sql] += 1
+            try:
+                self.statements[(alias, sql, repr(params))] += 1
+            except Exception:
+                pass
+        if duration * 1000 >= settings.SLOW_QUERY_MS:
+            slow_query_logger.warning(json.dumps({
+                'event': 'slow_query',
+                'view': self.view_name,
+                'alias': alias,
+                'duration_ms': round(duration * 1000, 2),
+                'sql': sql,
+            }))
+
+    @property
+    def duplicate_queries(self):
+        """Statements repeated with identical parameters."""
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    @property
+    def similar_queries(self):
+        """Statements repeated with different parameters, the usual N+1 shape."""
+        return sum(count - 1 for count in self.templates.values() if count > 1) - self.duplicate_queries
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(context['connection'].alias, sql, params, time.perf_counter() - started)
+
+
+def install_query_hook(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        # Only the outermost render is timed; includes are part of it.
+        if metrics is None or metrics.rendering:
+            return self.template.render(context, request)
+        metrics.rendering = True
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+            metrics.rendering = False
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+METRICS = (
+    ('core_request_duration_seconds', 'Time spent handling the request.', DURATION_BUCKETS),
+    ('core_request_db_seconds', 'Time spent in SQL per request.', DURATION_BUCKETS),
+    ('core_request_template_seconds', 'Time spent rendering templates per request.', DURATION_BUCKETS),
+    ('core_request_queries', 'SQL queries per request.', QUERY_BUCKETS),
+)
+
+
+class Registry:
+    """In-process histograms per view name, exported in Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.responses = Counter()
+
+    def observe(self, view, status, metrics, duration):
+        values = (duration, metrics.sql_time, metrics.template_time, metrics.queries)
+        with self.lock:
+            if view not in self.histograms:
+                self.histograms[view] = [Histogram(buckets) for _, _, buckets in METRICS]
+            for histogram, value in zip(self.histograms[view], values):
+                histogram.observe(value)
+            self.responses[(view, status)] += 1
+
+    def export(self):
+        lines = []
+        with self.lock:
+            for index, (name, help_text, buckets) in enumerate(METRICS):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for view, histograms in sorted(self.histograms.items()):
+                    histogram = histograms[index]
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ['+Inf'], histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+            lines += ['# HELP core_responses_total Responses by view and status.', '# TYPE core_responses_total counter']
+            for (view, status), count in sorted(self.responses.items()):
+                lines.append(f'core_responses_total{{view="{view}",status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def server_timing(metrics, duration):
+    entries = [
+        f'total;dur={duration * 1000:.1f}',
+        f'view;dur={metrics.view_time * 1000:.1f}',
+        f'db;dur={metrics.sql_time * 1000:.1f};desc="{metrics.queries} queries"',
+        f'tpl;dur={metrics.template_time * 1000:.1f}',
+    ]
+    if metrics.duplicate_queries or metrics.similar_queries:
+        entries.append(f'dupes;desc="{metrics.duplicate_queries} duplicate, {metrics.similar_queries} similar"')
+    return ', '.join(entries)
+
+
+def log_request(request, response, metrics, duration):
+    record = {
+        'event': 'request',
+        'method': request.method,
+        'path': request.path,
+        'view': metrics.view_name,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'view_ms': round(metrics.view_time * 1000, 2),
+        'db_ms': round(metrics.sql_time * 1000, 2),
+        'template_ms': round(metrics.template_time * 1000, 2),
+        'queries': metrics.queries,
+        'duplicate_queries': metrics.duplicate_queries,
+        'similar_queries': metrics.similar_queries,
+    }
+    level = logging.WARNING if duration * 1000 >= settings.SLOW_REQUEST_MS else logging.INFO
+    request_logger.log(level, json.dumps(record))
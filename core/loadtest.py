@@ -0,0 +1,273 @@
+"""
+End-to-end load benchmark: seeds a catalog, then drives every shop route
+with test clients on a pool of threads and reports latency percentiles,
+throughput and queries per request. Used by `python manage.py benchmark_load`.
+"""
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.urls import reverse
+
+from . import payments
+from .models import Product
+from .payment_stub import start_in_thread
+from .seeding import Seeder
+
+# Routes the journeys do not request, and why.
+UNMEASURED = {
+    'logout': 'ends the session mid-journey',
+    'password_reset_done': 'static confirmation page',
+    'password_reset_confirm': 'needs a one-off token',
+    'password_reset_complete': 'static confirmation page',
+    'edit-product': 'owner-only form',
+    'stripe-webhook': 'covered by process_payment_events',
+    'metrics': 'monitoring endpoint',
+}
+
+SEARCH_TERMS = ('shirt', 'leather', 'cotton jacket', 'denim', 'vintage wool', 'boots')
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+PERCENTILES = (50, 95, 99)
+
+
+def seed_catalog(products=200, shoppers=20, seed=0):
+    """Seed a synthetic catalog and return the shopper accounts."""
+    seeder = Seeder(seed)
+    seeder.run(products=products, users=shoppers, sellers=max(1, shoppers // 4))
+    return list(User.objects.filter(username__startswith=f'{seeder.prefix}-').order_by('pk'))
+
+
+def shopper_journey(products, rng):
+    """
+    One visit through the shop. Yields (route, method, url, data) and receives
+    each response, so later steps can follow redirects such as the payment URL.
+    """
+    product = rng.choice(products)
+    color = product.color.all()[0]
+    detail = reverse('core:product-details', kwargs={'product_slug': product.slug})
+    add = reverse('core:add-to-cart', kwargs={'product_slug': product.slug})
+
+    yield 'home', 'get', reverse('core:home'), None
+    yield 'products', 'get', reverse('core:products'), None
+    yield 'search', 'get', reverse('core:search'), {'q': rng.choice(SEARCH_TERMS)}
+    yield 'product-details', 'get', detail, None
+    yield 'add-to-cart', 'get', add, None
+    yield 'add-to-cart', 'post', add, {'quantity': rng.randint(1, 3), 'color': color.id}
+    yield 'view-cart', 'get', reverse('core:view-cart'), None
+    yield 'product_list', 'get', reverse('core:product_list'), None
+    yield 'create-product', 'get', reverse('core:create-product'), None
+    yield 'checkout', 'get', reverse('core:checkout'), None
+    response = yield 'checkout', 'post', reverse('core:checkout'), {
+        'street_address': '1 Main St', 'zip_code': '12345', 'country': 'US', 'payment_method': 'CreditCard',
+    }
+    if response.status_code == 302:
+        yield 'payment', 'get', response['Location'], None
+    yield 'success', 'get', reverse('core:success'), None
+    yield 'cancel', 'get', reverse('core:cancel'), None
+
+
+def visitor_journey(products, rng):
+    """Anonymous browsing, served mostly from the page cache."""
+    product = rng.choice(products)
+    yield 'home', 'get', reverse('core:home'), None
+    yield 'products', 'get', reverse('core:products'), None
+    yield 'product-details', 'get', reverse('core:product-details', kwargs={'product_slug': product.slug}), None
+    yield 'login_register', 'get', reverse('core:login_register'), None
+    yield 'password_reset', 'get', reverse('core:password_reset'), None
+
+
+class Samples:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, label, latency, queries, failed):
+        with self.lock:
+            self.latencies[label].append(latency)
+            self.queries[label].append(queries)
+            if failed:
+                self.errors[label] += 1
+
+
+def run_journey(journey, client, samples):
+    response = None
+    while True:
+        try:
+            route, method, url, data = journey.send(response)
+        except StopIteration:
+            return
+        started = time.perf_counter()
+        response = getattr(client, method)(url, data)
+        latency = time.perf_counter() - started
+        match = SERVER_TIMING_QUERIES.search(response.get('Server-Timing', ''))
+        samples.add(f'{method.upper()} {route}', latency, int(match.group(1)) if match else 0, response.status_code >= 400)
+
+
+def virtual_user(user, products, iterations, seed, samples):
+    rng = random.Random(seed)
+    # Server errors are counted per route instead of aborting the run.
+    shopper = Client(raise_request_exception=False)
+    shopper.force_login(user)
+    visitor = Client(raise_request_exception=False)
+    for _ in range(iterations):
+        run_journey(shopper_journey(products, rng), shopper, samples)
+        run_journey(visitor_journey(products, rng), visitor, samples)
+
+
+def pooled_virtual_user(*args):
+    try:
+        virtual_user(*args)
+    finally:
+        # Worker threads open their own connections; close them before exit.
+        connections.close_all()
+
+
+def percentile(values, p):
+    """Linear interpolation between closest ranks."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples, elapsed):
+    routes = {}
+    for label, latencies in sorted(samples.latencies.items()):
+        routes[label] = {
+            'requests': len(latencies),
+            **{f'p{p}': round(percentile(latencies, p) * 1000, 2) for p in PERCENTILES},
+            'queries': round(sum(samples.queries[label]) / len(latencies), 2),
+            'errors': samples.errors[label],
+        }
+    total = sum(route['requests'] for route in routes.values())
+    return {'requests': total, 'throughput': round(total / elapsed, 2) if elapsed else 0.0, 'routes': routes}
+
+
+def run(users, concurrency=8, iterations=5, seed=0, warmup=1):
+    """
+    Run `concurrency` virtual users, each doing `iterations` shopper and
+    visitor journeys, and return the summary. With a concurrency of one the
+    journeys run on the calling thread and share its database connection.
+    """
+    products = list(Product.objects.order_by('id').prefetch_related('color'))
+    cache.clear()
+    if warmup:
+        virtual_user(users[0], products, warmup, seed, Samples())
+
+    samples = Samples()
+    started = time.perf_counter()
+    if concurrency == 1:
+        virtual_user(users[0], products, iterations, seed, samples)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(pooled_virtual_user, users[i % len(users)], products, iterations, seed + i, samples)
+                for i in range(concurrency)
+            ]
+            for future in futures:
+                future.result()
+    return summarize(samples, time.perf_counter() - started)
+
+
+def compare(result, baseline, tolerance=0.2):
+    """
+    Compare a run with a stored one. Returns a list of (label, metric, before,
+    after, regressed) for every route present in both.
+    """
+    rows = []
+    for label, route in result['routes'].items():
+        before = baseline.get('routes', {}).get(label)
+        if not before:
+            continue
+        for metric in ('p50', 'p95', 'p99'):
+            rows.append((label, metric, before[metric], route[metric], route[metric] > before[metric] * (1 + tolerance)))
+        rows.append((label, 'queries', before['queries'], route['queries'], route['queries'] > before['queries']))
+    if baseline.get('throughput'):
+        rows.append((
+            'all', 'throughput', baseline['throughput'], result['throughput'],
+            result['throughput'] < baseline['throughput'] * (1 - tolerance),
+        ))
+    return rows
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, result):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+@contextmanager
+def scratch_database():
+    """Migrate a throwaway SQLite file (WAL, like production) and drop it afterwards."""
+    directory = tempfile.mkdtemp(prefix='load-bench-')
+    test_settings = connections['default'].settings_dict.setdefault('TEST', {})
+    previous = test_settings.get('NAME')
+    test_settings['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    try:
+        old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+        try:
+            yield
+        finally:
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+    finally:
+        test_settings['NAME'] = previous
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+@contextmanager
+def quiet_request_logs():
+    """Keep per-request log lines and error tracebacks out of the report."""
+    loggers = {'core.requests': logging.ERROR, 'core.slow_queries': logging.ERROR, 'django.request': logging.CRITICAL}
+    previous = {name: logging.getLogger(name).level for name in loggers}
+    for name, level in loggers.items():
+        logging.getLogger(name).setLevel(level)
+    try:
+        yield
+    finally:
+        for name, level in previous.items():
+            logging.getLogger(name).setLevel(level)
+
+
+@contextmanager
+def payment_stub(latency=0.0):
+    """Point the payment client at an in-process stub of the provider."""
+    server = start_in_thread(latency=latency)
+    try:
+        with override_settings(STRIPE_API_BASE=server.base_url, STRIPE_SECRET_KEY='sk_test_benchmark'):
+            payments.reset_client()
+            yield server
+    finally:
+        payments.reset_client()
+        server.shutdown()
+        server.server_close()
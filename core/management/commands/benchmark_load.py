@@ -0,0 +1,70 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from core import loadtest
+from core.staticfiles import unhashed_storages
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'load-baseline.json')
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a scratch database and drive every shop route concurrently against a stub payment '
+        'provider. Reports p50/p95/p99 latency, throughput and queries per request.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200, help='Products to seed.')
+        parser.add_argument('--users', type=int, default=20, help='Shopper accounts to seed.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Virtual users running at once.')
+        parser.add_argument('--iterations', type=int, default=5, help='Journeys per virtual user.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--payment-latency', type=float, default=50, help='Stub provider latency in milliseconds.')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare against.')
+        parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline.')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before flagging, as a fraction.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        # Production-like settings: no query log kept in memory. Pages link
+        # static files without the collectstatic manifest.
+        with override_settings(DEBUG=False, STORAGES=unhashed_storages()), loadtest.scratch_database():
+            started = time.perf_counter()
+            users = loadtest.seed_catalog(options['products'], options['users'], options['seed'])
+            self.stdout.write(f'Seeded {options["products"]} products in {time.perf_counter() - started:.1f}s')
+            with loadtest.payment_stub(options['payment_latency'] / 1000), loadtest.quiet_request_logs():
+                result = loadtest.run(users, options['concurrency'], options['iterations'], options['seed'])
+        result['config'] = {key: options[key] for key in ('products', 'users', 'concurrency', 'iterations', 'seed', 'payment_latency')}
+
+        self.report(result)
+        baseline = loadtest.load_baseline(options['baseline'])
+        regressions = self.compare(result, baseline, options['tolerance']) if baseline else []
+        if options['save_baseline']:
+            loadtest.save_baseline(options['baseline'], result)
+            self.stdout.write(f'Baseline written to {options["baseline"]}')
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} metric(s) regressed beyond the baseline.')
+
+    def report(self, result):
+        self.stdout.write(f'\n{"route":<26} {"reqs":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"errors":>7}')
+        for label, route in result['routes'].items():
+            self.stdout.write(
+                f'{label:<26} {route["requests"]:>6} {route["p50"]:>8.2f} {route["p95"]:>8.2f} '
+                f'{route["p99"]:>8.2f} {route["queries"]:>8.2f} {route["errors"]:>7}'
+            )
+        self.stdout.write(f'\n{result["requests"]} requests, {result["throughput"]:.1f} req/s')
+
+    def compare(self, result, baseline, tolerance):
+        if baseline.get('config') != result['config']:
+            self.stdout.write(self.style.WARNING('Baseline was recorded with different options; comparing anyway.'))
+        rows = loadtest.compare(result, baseline, tolerance)
+        self.stdout.write(f'\n{"route":<26} {"metric":<10} {"baseline":>9} {"now":>9} {"change":>8}')
+        for label, metric, before, after, regressed in rows:
+            change = f'{(after - before) / before * 100:+.0f}%' if before else 'n/a'
+            line = f'{label:<26} {metric:<10} {before:>9.2f} {after:>9.2f} {change:>8}'
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+        return [row for row in rows if row[-1]]
@@ -0,0 +1,89 @@
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+PROFILE_BACKEND = 'core.backends.ProfileBackend'
+DB_SESSIONS = 'django.contrib.sessions.backends.db'
+CACHED_DB_SESSIONS = 'django.contrib.sessions.backends.cached_db'
+PAGES = ('core:home', 'core:products', 'core:view-cart', 'core:checkout')
+
+
+def configurations(cache_dir):
+    locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}
+    filebased = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir}
+    return [
+        ('db sessions, plain auth', locmem, DB_SESSIONS, MODEL_BACKEND),
+        ('cached_db + locmem', locmem, CACHED_DB_SESSIONS, PROFILE_BACKEND),
+        ('cached_db + file', filebased, CACHED_DB_SESSIONS, PROFILE_BACKEND),
+    ]
+
+
+def classify(queries):
+    counts = {'session': 0, 'profile': 0}
+    for query in queries:
+        sql = query['sql']
+        if '"django_session"' in sql:
+            counts['session'] += 1
+        elif sql.startswith('SELECT') and 'FROM "core_userprofile"' in sql:
+            counts['profile'] += 1
+    return counts
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request session and profile queries across session and cache backends.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Requests per page and configuration.')
+
+    def handle(self, *args, **options):
+        cache_dir = tempfile.mkdtemp(prefix='session-bench-')
+        try:
+            results = [self.run(config, options['requests']) for config in configurations(cache_dir)]
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        self.stdout.write(f'{"configuration":<26} {"ms/req":>8} {"queries":>8} {"session":>8} {"profile":>8}')
+        for name, ms, queries, session, profile in results:
+            self.stdout.write(f'{name:<26} {ms:>8.2f} {queries:>8.2f} {session:>8.2f} {profile:>8.2f}')
+
+    def run(self, config, requests):
+        name, cache, session_engine, auth_backend = config
+        settings = override_settings(
+            CACHES={'default': cache},
+            SESSION_ENGINE=session_engine,
+            AUTHENTICATION_BACKENDS=[auth_backend],
+        )
+        # Everything the benchmark writes is rolled back afterwards.
+        with settings, transaction.atomic():
+            caches['default'].clear()
+            user = User.objects.create_user('session-benchmark', 'bench@example.com', 'bench-pass-1')
+            client = Client()
+            client.force_login(user, backend=auth_backend)
+            urls = [reverse(page) for page in PAGES]
+            for url in urls:
+                client.get(url)
+
+            total = session = profile = 0
+            started = time.perf_counter()
+            for _ in range(requests):
+                for url in urls:
+                    with CaptureQueriesContext(connection) as ctx:
+                        client.get(url)
+                    counts = classify(ctx.captured_queries)
+                    total += len(ctx)
+                    session += counts['session']
+                    profile += counts['profile']
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        count = requests * len(urls)
+        return name, elapsed * 1000 / count, total / count, session / count, profile / count
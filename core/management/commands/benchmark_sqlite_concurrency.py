@@ -0,0 +1,147 @@
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SCHEMA = '''
+CREATE TABLE product (id INTEGER PRIMARY KEY, title TEXT, price INTEGER, created_at REAL);
+CREATE INDEX product_newest ON product (created_at DESC, id DESC);
+CREATE TABLE cart_item (id INTEGER PRIMARY KEY, user_id INTEGER, product_id INTEGER, quantity INTEGER);
+CREATE INDEX cart_item_user ON cart_item (user_id);
+'''
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Workload:
+    """Catalog readers and cart writers hammering one SQLite file."""
+
+    def __init__(self, path, pragmas, immediate, busy_timeout):
+        self.path = path
+        self.pragmas = pragmas
+        self.immediate = immediate
+        self.busy_timeout = busy_timeout
+        self.lock = threading.Lock()
+        self.latencies = {'read': [], 'write': []}
+        self.errors = {'read': 0, 'write': 0}
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        if self.pragmas:
+            connection.executescript(self.pragmas)
+        return connection
+
+    def seed(self, products):
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO product (title, price, created_at) VALUES (?, ?, ?)',
+            ((f'Product {n}', n % 100, n) for n in range(products)),
+        )
+        connection.execute('COMMIT')
+        connection.close()
+
+    def read(self, connection, rng):
+        offset = rng.randrange(0, 50) * 12
+        connection.execute('BEGIN')
+        connection.execute('SELECT id, title, price FROM product ORDER BY created_at DESC, id DESC LIMIT 12 OFFSET ?', (offset,)).fetchall()
+        connection.execute('SELECT COUNT(*) FROM product').fetchone()
+        connection.execute('COMMIT')
+
+    def write(self, connection, rng):
+        user_id = rng.randrange(1, 500)
+        connection.execute('BEGIN IMMEDIATE' if self.immediate else 'BEGIN')
+        # Read-then-write inside one transaction, like the cart service.
+        connection.execute('SELECT COUNT(*) FROM cart_item WHERE user_id = ?', (user_id,)).fetchone()
+        connection.execute(
+            'INSERT INTO cart_item (user_id, product_id, quantity) VALUES (?, ?, 1)', (user_id, rng.randrange(1, 1000)),
+        )
+        connection.execute('UPDATE cart_item SET quantity = quantity + 1 WHERE user_id = ?', (user_id,))
+        connection.execute('COMMIT')
+
+    def worker(self, kind, deadline, seed):
+        rng = random.Random(seed)
+        connection = self.connect()
+        operation = self.read if kind == 'read' else self.write
+        latencies, errors = [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                operation(connection, rng)
+            except sqlite3.OperationalError:
+                if connection.in_transaction:
+                    connection.execute('ROLLBACK')
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+        connection.close()
+        with self.lock:
+            self.latencies[kind].extend(latencies)
+            self.errors[kind] += errors
+
+    def run(self, readers, writers, duration):
+        deadline = time.perf_counter() + duration
+        threads = [
+            threading.Thread(target=self.worker, args=(kind, deadline, n))
+            for n, kind in enumerate(['read'] * readers + ['write'] * writers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            kind: {
+                'ops': len(self.latencies[kind]) / duration,
+                'p50': statistics.median(self.latencies[kind]) * 1000 if self.latencies[kind] else 0.0,
+                'p95': percentile(self.latencies[kind], 0.95) * 1000,
+                'errors': self.errors[kind],
+            }
+            for kind in ('read', 'write')
+        }
+
+
+class Command(BaseCommand):
+    help = 'Measure catalog reads and cart writes running concurrently on SQLite, before and after tuning.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5, help='Seconds per configuration.')
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--busy-timeout', type=float, default=1, help='Seconds a connection waits on a lock.')
+
+    def handle(self, *args, **options):
+        configurations = [
+            ('rollback journal', '', False),
+            ('WAL + tuned pragmas', settings.SQLITE_PRAGMAS, True),
+        ]
+        directory = tempfile.mkdtemp(prefix='sqlite-bench-')
+        try:
+            self.stdout.write(
+                f'{"configuration":<22} {"reads/s":>9} {"read p95":>9} {"read err":>9} '
+                f'{"writes/s":>9} {"write p95":>10} {"write err":>10}'
+            )
+            for name, pragmas, immediate in configurations:
+                workload = Workload(os.path.join(directory, f'{len(name)}.sqlite3'), pragmas, immediate, options['busy_timeout'])
+                workload.seed(options['products'])
+                result = workload.run(options['readers'], options['writers'], options['duration'])
+                read, write = result['read'], result['write']
+                self.stdout.write(
+                    f'{name:<22} {read["ops"]:>9.0f} {read["p95"]:>7.2f}ms {read["errors"]:>9} '
+                    f'{write["ops"]:>9.0f} {write["p95"]:>8.2f}ms {write["errors"]:>10}'
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
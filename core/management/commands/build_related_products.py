@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from core.recommendations import CHUNK_SIZE, TOP_K, build, changed_since
+
+
+class Command(BaseCommand):
+    help = 'Precompute related products from tag and co-purchase similarity.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products', default=[],
+                            help='Refresh around this product id, e.g. after editing its tags; repeatable.')
+        parser.add_argument('--since', help='Refresh around products added, or in orders completed, since this ISO 8601 time.')
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        changed = None
+        if options['products'] or options['since']:
+            changed = set(options['products'])
+            if options['since']:
+                since = parse_datetime(options['since'])
+                if since is None:
+                    raise CommandError(f'"{options["since"]}" is not an ISO 8601 date and time.')
+                changed |= changed_since(since)
+        refreshed, written = build(changed, top_k=options['top_k'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Stored {written} related products for {refreshed} products.'))
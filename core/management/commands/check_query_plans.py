@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import queryplans
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN every hot-path query and fail if any of them falls back to a full table scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only failing ones.')
+
+    def handle(self, *args, **options):
+        if not queryplans.supported():
+            raise CommandError('Query plans can only be checked on SQLite and PostgreSQL.')
+        failures = 0
+        for name, plan, scans in queryplans.check():
+            if scans:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'FAIL {name}: full scan of {", ".join(scans)}'))
+            else:
+                self.stdout.write(f'ok   {name}')
+            if scans or options['verbose_plans']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'       {line}')
+        if failures:
+            raise CommandError(f'{failures} hot quer{"y" if failures == 1 else "ies"} scan a whole table.')
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index.'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.images import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG variants for queued uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new uploads.')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            refreshed = process_pending(options['batch_size'])
+            if refreshed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Generated variants for {refreshed} images.'))
+            if not options['loop']:
+                return
+            if not refreshed:
+                time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.webhooks import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Complete orders from stored payment webhook events.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events.')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            handled = process_pending(options['batch_size'])
+            if handled or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Handled {handled} payment events.'))
+            if not options['loop']:
+                return
+            if not handled:
+                time.sleep(options['interval'])
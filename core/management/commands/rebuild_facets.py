@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import facets
+from core.models import FacetCount, ProductFacet
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product facet index and its precomputed counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        facets.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {ProductFacet.objects.count()} facet values '
+            f'across {FacetCount.objects.count()} counts.'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.cache import invalidate_catalog
+from core.images import VARIANT_SPECS, backfill
+
+MODELS = {model._meta.model_name: model for model in VARIANT_SPECS}
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG variants for uploaded images on a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', choices=sorted(MODELS), help='Limit to these models.')
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that are already current.')
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (defaults to CPU count).')
+
+    def handle(self, *args, **options):
+        for name in options['models'] or sorted(MODELS):
+            updated, errors = backfill(MODELS[name], force=options['force'], workers=options['workers'])
+            for pk, error in errors:
+                self.stderr.write(f'{name} {pk}: {error}')
+            self.stdout.write(self.style.SUCCESS(f'Generated variants for {updated} {name} rows.'))
+        invalidate_catalog()
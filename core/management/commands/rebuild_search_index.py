@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Product
+from core.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        batch_size = options['batch_size']
+        products = Product.objects.order_by('pk').prefetch_related('tags')
+        indexed = 0
+        with transaction.atomic():
+            backend.clear()
+            batch = []
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(product)
+                if len(batch) >= batch_size:
+                    backend.index(batch)
+                    indexed += len(batch)
+                    batch = []
+            backend.index(batch)
+            indexed += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.tags import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recount tag usage and fix any drift in the tag popularity table.'
+
+    def handle(self, *args, **options):
+        fixed = reconcile()
+        self.stdout.write(self.style.SUCCESS(f'Fixed {fixed} tag counts.'))
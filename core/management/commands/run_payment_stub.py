@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.payment_stub import PaymentStubServer
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the payment provider checkout session API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0, help='Simulated provider latency in milliseconds.')
+
+    def handle(self, *args, **options):
+        server = PaymentStubServer((options['host'], options['port']), options['latency'] / 1000)
+        self.stdout.write(self.style.SUCCESS(f'Payment stub listening on {server.base_url}'))
+        self.stdout.write(f'Set STRIPE_API_BASE = "{server.base_url}" to use it.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
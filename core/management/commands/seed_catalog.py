@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.seeding import Seeder
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a synthetic catalog, users, reviews, carts and orders using batched '
+        'bulk inserts. The same --seed on the same database produces the same rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--sellers', type=int, default=50, help='How many of the users own products.')
+        parser.add_argument('--categories', type=int, default=40)
+        parser.add_argument('--tags', type=int, default=400)
+        parser.add_argument('--reviews', type=float, default=3.0, help='Average reviews per product.')
+        parser.add_argument('--carts', type=int, help='Users with a non-empty cart (default: a fifth of the users).')
+        parser.add_argument('--orders', type=int, help='Orders to create (default: half the product count).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--now', help='ISO 8601 time the seeded timestamps count back from (default: fixed per seed).',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Do not refresh tag counts, facets and the search index afterwards.',
+        )
+
+    def handle(self, *args, **options):
+        now = None
+        if options['now']:
+            now = parse_datetime(options['now'])
+            if now is None:
+                raise CommandError(f'"{options["now"]}" is not an ISO 8601 date and time.')
+            if timezone.is_naive(now):
+                now = timezone.make_aware(now)
+        seeder = Seeder(options['seed'], options['batch_size'], log=self.stdout.write, now=now)
+        try:
+            rows = seeder.run(
+                products=options['products'], users=options['users'], sellers=options['sellers'],
+                categories=options['categories'], tag_count=options['tags'], reviews=options['reviews'],
+                carts=options['carts'], orders=options['orders'], derived=not options['skip_derived'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write('')
+        for label, count in sorted(rows.items()):
+            self.stdout.write(f'{label:<28} {count:>10}')
+        total = sum(rows.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {total} rows in {seeder.elapsed:.1f}s ({total / seeder.elapsed if seeder.elapsed else 0:.0f} rows/s).'
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import send_pending
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails in batches over one mail connection per batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new emails.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = send_pending(options['batch_size'])
+            if sent or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails.'))
+            if not options['loop']:
+                return
+            if not sent:
+                time.sleep(options['interval'])
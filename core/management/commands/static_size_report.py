@@ -0,0 +1,55 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.middleware import ENCODINGS
+
+
+def collect_sizes(root):
+    rows = []
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            if any(filename.endswith(extension) for _, extension in ENCODINGS):
+                continue
+            row = {'name': os.path.relpath(path, root).replace(os.sep, '/'), 'size': os.path.getsize(path)}
+            for coding, extension in ENCODINGS:
+                if os.path.exists(path + extension):
+                    row[coding] = os.path.getsize(path + extension)
+            if len(row) > 2:
+                rows.append(row)
+    for row in rows:
+        smallest = min(row.get(coding, row['size']) for coding, _ in ENCODINGS)
+        row['saved'] = row['size'] - smallest
+    return sorted(rows, key=lambda row: row['saved'], reverse=True)
+
+
+class Command(BaseCommand):
+    help = 'Report the size saved by each precompressed static asset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=25, help='Rows to show (0 for all).')
+        parser.add_argument('--json', action='store_true', help='Print the full report as JSON.')
+
+    def handle(self, *args, **options):
+        rows = collect_sizes(settings.STATIC_ROOT)
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+
+        total = sum(row['size'] for row in rows)
+        saved = sum(row['saved'] for row in rows)
+        self.stdout.write(f'{"asset":<60} {"original":>10} {"gzip":>10} {"br":>10} {"saved":>7}')
+        for row in rows[:options['limit'] or None]:
+            self.stdout.write(
+                f'{row["name"][-60:]:<60} {row["size"]:>10} {row.get("gzip", "-"):>10} {row.get("br", "-"):>10} '
+                f'{row["saved"] / row["size"]:>7.0%}'
+            )
+        if total:
+            self.stdout.write(self.style.SUCCESS(
+                f'{len(rows)} compressed assets: {total} bytes -> {total - saved} bytes ({saved / total:.0%} saved).'
+            ))
+        else:
+            self.stdout.write('No compressed assets found; run collectstatic first.')
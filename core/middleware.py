@@ -0,0 +1,188 @@
+import mimetypes
+import os
+import re
+import time
+from functools import cached_property
+from urllib.parse import unquote, urlparse
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .instrumentation import RequestMetrics, current_metrics, log_request, registry, server_timing
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = re.search(r'q=([\d.]+)', params)
+        if coding and not (quality and float(quality.group(1)) == 0):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+async def read_blocks(file, block_size):
+    read = sync_to_async(file.read, thread_sensitive=False)
+    while block := await read(block_size):
+        yield block
+
+
+class StaticAssetMiddleware:
+    """
+    Serve collected files from STATIC_ROOT before the rest of the stack runs.
+    Picks a precompressed .br/.gz sibling when the client accepts it and
+    marks content-hashed names as immutable.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    @cached_property
+    def prefix(self):
+        return urlparse(settings.STATIC_URL or '').path
+
+    @cached_property
+    def hashed_names(self):
+        return set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def asset_name(self, request):
+        if (
+            settings.STATIC_ROOT and self.prefix and request.method in ('GET', 'HEAD')
+            and request.path_info.startswith(self.prefix)
+        ):
+            return unquote(request.path_info[len(self.prefix):])
+        return None
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        name = self.asset_name(request)
+        if name is not None:
+            response = self.serve(request, name)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        name = self.asset_name(request)
+        if name is not None:
+            # File system calls run on a worker thread, off the event loop.
+            response = await sync_to_async(self.serve, thread_sensitive=False)(request, name)
+            if response is not None:
+                if isinstance(response, FileResponse):
+                    response.streaming_content = read_blocks(response.file_to_stream, response.block_size)
+                return response
+        return await self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        siblings = [(coding, path + extension) for coding, extension in ENCODINGS if os.path.isfile(path + extension)]
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding, chosen = next(((coding, sibling) for coding, sibling in siblings if coding in accepted), (None, path))
+
+        stat = os.stat(chosen)
+        etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+        headers = {
+            'Cache-Control': IMMUTABLE if name in self.hashed_names else REVALIDATE,
+            'ETag': etag,
+            'Last-Modified': http_date(stat.st_mtime),
+        }
+        if siblings:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if (if_none_match and etag in if_none_match) or (
+            not if_none_match and not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime)
+        ):
+            response = HttpResponseNotModified()
+        else:
+            content_type, _ = mimetypes.guess_type(path)
+            response = FileResponse(open(chosen, 'rb'), content_type=content_type or 'application/octet-stream')
+            response['Content-Length'] = stat.st_size
+            if encoding:
+                response['Content-Encoding'] = encoding
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+
+class RequestMetricsMiddleware:
+    """
+    Time each request and its SQL and template work. Adds a Server-Timing
+    header, writes one structured log line, and feeds the /metrics/
+    histograms.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Django wraps a sync process_view in sync_to_async, which would
+            # cost a thread hop on every async request.
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = metrics.activate()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = metrics.activate()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        finished = time.perf_counter()
+        duration = finished - metrics.started
+        if metrics.view_started is not None:
+            metrics.view_time = finished - metrics.view_started
+
+        if metrics.view_name != 'core:metrics':
+            registry.observe(metrics.view_name or 'unmatched', response.status_code, metrics, duration)
+        response['Server-Timing'] = server_timing(metrics, duration)
+        log_request(request, response, metrics, duration)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.view_name = request.resolver_match.view_name
+            metrics.view_started = time.perf_counter()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return RequestMetricsMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
@@ -0,0 +1,37 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_product_newest_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('price', 'Price'), ('category', 'Category'), ('color', 'Color'), ('size', 'Size'), ('tag', 'Tag')], max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('facet', 'value'), name='unique_facet_count')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('price', 'Price'), ('category', 'Category'), ('color', 'Color'), ('size', 'Size'), ('tag', 'Tag')], max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='core.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['facet', 'value', 'product'], name='facet_value_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'facet', 'value'), name='unique_product_facet')],
+            },
+        ),
+    ]
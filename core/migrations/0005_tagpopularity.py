@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def populate_tag_popularity(apps, schema_editor):
+    Tag = apps.get_model('taggit', 'Tag')
+    TagPopularity = apps.get_model('core', 'TagPopularity')
+    counts = Tag.objects.annotate(n=Count('taggit_taggeditem_items')).values_list('id', 'n')
+    TagPopularity.objects.bulk_create(
+        (TagPopularity(tag_id=tag_id, count=n) for tag_id, n in counts.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_product_facets'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagPopularity',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='taggit.tag')),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-count', 'tag'], name='tag_popularity_count_idx')],
+            },
+        ),
+        migrations.RunPython(populate_tag_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+def deduplicate_slugs(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    duplicated = (
+        Product.objects.values('slug').annotate(n=models.Count('id')).filter(n__gt=1).values_list('slug', flat=True)
+    )
+    taken = set(Product.objects.values_list('slug', flat=True))
+    for slug in list(duplicated):
+        for product in Product.objects.filter(slug=slug).order_by('id')[1:]:
+            num = 1
+            while f'{slug}-{num}' in taken:
+                num += 1
+            product.slug = f'{slug}-{num}'
+            taken.add(product.slug)
+            product.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_cart_to_lines(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderLine = apps.get_model('core', 'OrderLine')
+    lines = []
+    for order in Order.objects.filter(cart__isnull=False).select_related('cart__product').iterator():
+        item = order.cart
+        lines.append(OrderLine(
+            order=order, cart_item=item, product=item.product, title=item.product.title,
+            unit_price=item.product.price, quantity=item.quantity,
+            color_id=item.color_id, size_id=item.size_id,
+        ))
+        order.total_price = item.product.price * item.quantity
+        order.save(update_fields=['total_price'])
+    OrderLine.objects.bulk_create(lines, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_unique_product_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_session_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('unit_price', models.PositiveIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('cart_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.cartitem')),
+                ('color', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.color')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='core.order')),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.product')),
+                ('size', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.size')),
+            ],
+        ),
+        migrations.RunPython(move_cart_to_lines, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='order',
+            name='cart',
+        ),
+    ]
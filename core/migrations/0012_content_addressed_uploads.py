@@ -0,0 +1,28 @@
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='images',
+            field=models.ImageField(storage=core.storage.ContentAddressedStorage(), upload_to='product-images/', validators=[core.models.validate_product_image_dimensions]),
+        ),
+        migrations.AlterField(
+            model_name='slideshow',
+            name='background_image',
+            field=models.ImageField(storage=core.storage.ContentAddressedStorage(), upload_to='slideshow/', validators=[core.models.validate_slideshow_image_dimensions]),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture',
+            field=models.ImageField(default='profile_pictures/default_pfp.png', storage=core.storage.ContentAddressedStorage(), upload_to='profile_pictures/'),
+        ),
+    ]
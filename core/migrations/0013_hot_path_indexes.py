@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.db import migrations, models
+
+MAX_QUANTITY = 100
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    CartItem = apps.get_model('core', 'CartItem')
+    duplicated = (
+        CartItem.objects.values('user_id', 'product_id', 'color_id')
+        .annotate(n=models.Count('id')).filter(n__gt=1).order_by()
+    )
+    for row in list(duplicated):
+        items = list(CartItem.objects.filter(
+            user_id=row['user_id'], product_id=row['product_id'], color_id=row['color_id'],
+        ).order_by('id'))
+        kept = items[0]
+        kept.quantity = min(MAX_QUANTITY, sum(item.quantity for item in items))
+        kept.save(update_fields=['quantity'])
+        CartItem.objects.filter(pk__in=[item.pk for item in items[1:]]).delete()
+
+
+def keep_latest_review(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    Review = apps.get_model('core', 'Review')
+    duplicated = list(
+        Review.objects.values('product_id', 'user_id').annotate(n=models.Count('id')).filter(n__gt=1).order_by()
+    )
+    for row in duplicated:
+        stale = Review.objects.filter(product_id=row['product_id'], user_id=row['user_id']).order_by('-created_at', '-id')[1:]
+        Review.objects.filter(pk__in=list(stale.values_list('pk', flat=True))).delete()
+    # Removed reviews no longer count towards the stored rating totals.
+    for product_id in {row['product_id'] for row in duplicated}:
+        ratings = list(Review.objects.filter(product_id=product_id).values_list('rating', flat=True))
+        Product.objects.filter(pk=product_id).update(
+            review_count=len(ratings),
+            rating_sum=sum(ratings),
+            rating_average=sum(ratings) / len(ratings) if ratings else 0,
+            **{f'rating_{stars}': ratings.count(stars) for stars in range(1, 6)},
+        )
+
+
+def keep_latest_default_address(apps, schema_editor):
+    Address = apps.get_model('core', 'Address')
+    users = (
+        Address.objects.filter(default=True).values('user_id')
+        .annotate(n=models.Count('id')).filter(n__gt=1).values_list('user_id', flat=True)
+    )
+    for user_id in list(users):
+        latest = Address.objects.filter(user_id=user_id, default=True).order_by('-id').values_list('id', flat=True)[0]
+        Address.objects.filter(user_id=user_id, default=True).exclude(pk=latest).update(default=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0012_content_addressed_uploads'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.RunPython(keep_latest_review, migrations.RunPython.noop),
+        migrations.RunPython(keep_latest_default_address, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=['user', 'product', 'color'], name='unique_cart_item'),
+        ),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.UniqueConstraint(fields=['product', 'user'], name='unique_review_per_user'),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['user', 'default'], name='address_user_default_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='address',
+            constraint=models.UniqueConstraint(
+                fields=['user'], condition=models.Q(default=True), name='one_default_address_per_user',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ),
+        # auth.User belongs to another app, so its email index is created here.
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS auth_user_email_idx ON auth_user (email)',
+            'DROP INDEX IF EXISTS auth_user_email_idx',
+        ),
+    ]
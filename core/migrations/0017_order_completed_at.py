@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+def backfill_completed_at(apps, schema_editor):
+    # Completion time was never recorded; creation time is the closest bound.
+    Order = apps.get_model('core', 'Order')
+    Order.objects.filter(order_status='Completed').update(completed_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_imagevariantjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_completed_at, migrations.RunPython.noop),
+    ]
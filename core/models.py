@@ -1,19 +1,28 @@
-from django.db import models
+import re
+
+from django.db import models, transaction, IntegrityError
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from taggit.managers import TaggableManager
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.core.exceptions import ValidationError
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django_countries.fields import CountryField
+from taggit.models import Tag
+
+from .storage import upload_storage
+from .uploads import image_dimensions
 
 # Create your models here.
 
 
 def validate_pfp_image_dimensions(image):
-    width = image.width
-    height = image.height
+    width, height = image_dimensions(image)
 
     if width != 300 or height != 300:
         raise ValidationError(f"Image dimensions must be 300x300 pixels. Current dimensions: {width}x{height}")
@@ -23,7 +32,8 @@ def validate_pfp_image_dimensions(image):
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    profile_picture = models.ImageField(upload_to='profile_pictures/', default='profile_pictures/default_pfp.png')
+    profile_picture = models.ImageField(upload_to='profile_pictures/', storage=upload_storage, default='profile_pictures/default_pfp.png')
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.user.username
@@ -35,6 +45,11 @@ class CartItem(models.Model):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     size = models.ForeignKey('Size', on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product', 'color'], name='unique_cart_item'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.title} ({self.color})"
 
@@ -42,20 +57,35 @@ class CartItem(models.Model):
         return self.product.price * self.quantity
 
 class Order(models.Model):
-    cart = models.ForeignKey('CartItem', on_delete=models.SET_NULL, null=True)
     user = models.ForeignKey(UserProfile, on_delete=models.SET_NULL, null=True)
     billing_address = models.ForeignKey('Address', related_name='checkout_billing_address', on_delete=models.SET_NULL, null=True)
     payment = models.ForeignKey('Payment', on_delete=models.SET_NULL, null=True)
     order_note = models.TextField(max_length=500, blank=True, null=True)
     order_status = models.CharField(max_length=50, default='Pending')
+    total_price = models.PositiveIntegerField(default=0)
+    payment_session_id = models.CharField(max_length=255, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return f"Order #{self.id} - User: {self.user}, Status: {self.order_status}, Created at: {self.created_at}"
-        
-    def calculate_total_price(self):
-        total_price = sum(item.calculate_item_price() for item in self.cart.all())
-        return total_price
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    cart_item = models.ForeignKey('CartItem', on_delete=models.SET_NULL, null=True, blank=True)
+    product = models.ForeignKey('Product', on_delete=models.SET_NULL, null=True)
+    title = models.CharField(max_length=200)
+    unit_price = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+    color = models.ForeignKey('Color', on_delete=models.SET_NULL, null=True, blank=True)
+    size = models.ForeignKey('Size', on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.title} (Order #{self.order_id})"
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
 
 
 
@@ -67,6 +97,14 @@ class Address(models.Model):
     country = models.CharField(max_length=200, choices=CountryField(multiple=False).choices)
     default = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'default'], name='address_user_default_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(default=True), name='one_default_address_per_user'),
+        ]
+
     def __str__(self):
         return f"Address of {self.user.user.username}"
 
@@ -85,6 +123,95 @@ class Payment(models.Model):
         return f"Payment by {self.user.user.username}"
 
 
+class PaymentEvent(models.Model):
+    """A verified provider webhook event, stored once per event id and processed later."""
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    IGNORED = 'ignored'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSED, 'Processed'),
+        (IGNORED, 'Ignored'),
+        (FAILED, 'Failed'),
+    )
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='payment_event_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
+
+
+class OutboundEmail(models.Model):
+    """An email waiting to be delivered by `python manage.py send_queued_email`."""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
+
+class ImageVariantJob(models.Model):
+    """An upload waiting for `python manage.py process_image_variants` to resize it."""
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSED, 'Processed'),
+        (FAILED, 'Failed'),
+    )
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='image_variant_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type.model} {self.object_id} ({self.status})"
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
@@ -92,13 +219,14 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 def validate_slideshow_image_dimensions(image):
-    width = image.width
+    width, _ = image_dimensions(image)
 
     if width != 1920:
         raise ValidationError(f"Image dimensions must be 1920 pixels. Current dimensions: {width}")
 
 class Slideshow(models.Model):
-    background_image = models.ImageField(upload_to='slideshow/', validators=[validate_slideshow_image_dimensions])
+    background_image = models.ImageField(upload_to='slideshow/', storage=upload_storage, validators=[validate_slideshow_image_dimensions])
+    variants = models.JSONField(default=dict, blank=True, editable=False)
     banner_title = models.CharField(max_length=100)
     brief_description = models.CharField(max_length=110)
     button_text = models.CharField(max_length=50)
@@ -106,9 +234,50 @@ class Slideshow(models.Model):
     def __str__(self):
         return self.banner_title
 
+# SQLite rejects a compound SELECT with more terms than this
+# (SQLITE_MAX_COMPOUND_SELECT).
+MAX_COMPOUND_SELECT = 500
+
+
+class CategoryQuerySet(models.QuerySet):
+    def with_products(self):
+        products = Product.objects.catalog().order_by('-created_at', '-id')
+        return self.prefetch_related(
+            models.Prefetch('product_set', queryset=products, to_attr='catalog_products')
+        )
+
+    def with_newest_products(self, limit):
+        """
+        Evaluate into a list of categories, each with its `limit` newest
+        products in `catalog_products`. A sliced Prefetch would number every
+        product with ROW_NUMBER() and read the whole catalog; instead each
+        category gets a LIMIT subquery that walks product_category_newest_idx,
+        and the subqueries are joined with UNION ALL, one query per
+        MAX_COMPOUND_SELECT categories.
+        """
+        products = Product.objects.catalog().order_by('-created_at', '-id')
+        categories = list(self)
+        by_category = {category.pk: [] for category in categories}
+        for start in range(0, len(categories), MAX_COMPOUND_SELECT):
+            newest = []
+            for index, category in enumerate(categories[start:start + MAX_COMPOUND_SELECT]):
+                sql, params = (
+                    Product.objects.filter(category=category).order_by('-created_at', '-id')
+                    .values('id')[:limit].query.sql_with_params()
+                )
+                newest.append((f'SELECT * FROM ({sql}) AS newest_{index}', params))
+            ids = RawSQL(' UNION ALL '.join(sql for sql, _ in newest), [p for _, params in newest for p in params])
+            for product in products.filter(pk__in=ids):
+                by_category[product.category_id].append(product)
+        for category in categories:
+            category.catalog_products = by_category[category.pk]
+        return categories
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
 
+    objects = CategoryQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -124,6 +293,16 @@ class Size(models.Model):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def with_images(self):
+        return self.prefetch_related('image_set')
+
+    def catalog(self):
+        return self.select_related('user__user', 'category').with_images()
+
+    def detail(self):
+        return self.catalog().prefetch_related('color', 'sizes', 'tags')
+
 class Product(models.Model):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
@@ -140,36 +319,185 @@ class Product(models.Model):
     
     is_clothing = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    slug = models.SlugField(null=False)
+    slug = models.SlugField(null=False, unique=True)
+
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    # Maintained by core.ratings; never written back from a stale instance.
+    RATING_FIELDS = ('review_count', 'rating_sum', 'rating_average', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+    SLUG_ATTEMPTS = 5
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_newest_idx'),
+            models.Index(fields=['-rating_average', '-id'], name='product_top_rated_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_newest_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+    @property
+    def rating_histogram(self):
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}')
+            percent = round(100 * count / self.review_count) if self.review_count else 0
+            histogram.append({'stars': stars, 'count': count, 'percent': percent})
+        return histogram
     
+    @classmethod
+    def slug_family(cls, base_slug):
+        """
+        Slugs equal to `base_slug` or of the form "<base>-<n>", longest and
+        then lexically largest first, so the first row has the largest suffix.
+        The range bounds are what let the unique slug index serve the lookup;
+        startswith compiles to a case-insensitive LIKE that it cannot.
+        """
+        return cls.objects.filter(
+            models.Q(slug=base_slug) | models.Q(slug__gt=f'{base_slug}-', slug__lt=f'{base_slug}.')
+        ).filter(
+            models.Q(slug=base_slug) | models.Q(slug__regex=rf'^{re.escape(base_slug)}-[0-9]+$')
+        ).order_by(Length('slug').desc(), '-slug').values_list('slug', flat=True)
+
+    @classmethod
+    def next_free_slug(cls, base_slug):
+        latest = cls.slug_family(base_slug).first()
+        if latest is None:
+            return base_slug
+        if latest == base_slug:
+            return f"{base_slug}-1"
+        return f"{base_slug}-{int(latest.rsplit('-', 1)[1]) + 1}"
+
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(self.title)
-            unique_slug = base_slug
-            num = 1
-            while Product.objects.filter(slug=unique_slug).exists():
-                unique_slug = f"{base_slug}-{num}"
-                num += 1
-            self.slug = unique_slug
-        super().save(*args, **kwargs)
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_FIELDS
+            ]
+        if self.slug:
+            return super().save(*args, **kwargs)
+
+        max_length = self._meta.get_field('slug').max_length
+        base_slug = slugify(self.title)[:max_length - 8].strip('-') or 'product'
+        for attempt in range(self.SLUG_ATTEMPTS):
+            self.slug = self.next_free_slug(base_slug)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                # A concurrent save took the slug between lookup and insert.
+                if attempt == self.SLUG_ATTEMPTS - 1 or not Product.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
+                    self.slug = ''
+                    raise
+
+
+class ProductFacet(models.Model):
+    PRICE = 'price'
+    CATEGORY = 'category'
+    COLOR = 'color'
+    SIZE = 'size'
+    TAG = 'tag'
+    FACET_CHOICES = (
+        (PRICE, 'Price'),
+        (CATEGORY, 'Category'),
+        (COLOR, 'Color'),
+        (SIZE, 'Size'),
+        (TAG, 'Tag'),
+    )
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='facets')
+    facet = models.CharField(max_length=20, choices=FACET_CHOICES)
+    value = models.CharField(max_length=50)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'facet', 'value'], name='unique_product_facet'),
+        ]
+        indexes = [
+            models.Index(fields=['facet', 'value', 'product'], name='facet_value_product_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.facet}={self.value} for {self.product_id}'
+
+class FacetCount(models.Model):
+    facet = models.CharField(max_length=20, choices=ProductFacet.FACET_CHOICES)
+    value = models.CharField(max_length=50)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='unique_facet_count'),
+        ]
+
+    def __str__(self):
+        return f'{self.facet}={self.value}: {self.count}'
+
+class RelatedProduct(models.Model):
+    # Top-K neighbours of a product, written by core.recommendations. The
+    # unique (product, rank) index serves the detail page's ordered read.
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='neighbours', db_index=False)
+    related = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='related_to')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_related_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.related_id} is #{self.rank} for {self.product_id}'
+
+
+class TagPopularityQuerySet(models.QuerySet):
+    def top(self, limit):
+        return self.select_related('tag').order_by('-count', 'tag_id')[:limit]
+
+class TagPopularity(models.Model):
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    count = models.PositiveIntegerField(default=0)
+
+    objects = TagPopularityQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-count', 'tag'], name='tag_popularity_count_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag}: {self.count}'
 
 
 def validate_product_image_dimensions(image):
-    width = image.width
+    width, _ = image_dimensions(image)
 
     if width < 600 or width > 800:
         raise ValidationError(f"Image dimensions must be 700 pixels. Current dimensions: {width}")
 
 class Image(models.Model):
     product = models.ForeignKey('Product', on_delete=models.CASCADE)
-    images = models.ImageField(upload_to='product-images/', validators=[validate_product_image_dimensions])
+    images = models.ImageField(upload_to='product-images/', storage=upload_storage, validators=[validate_product_image_dimensions])
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f'Image for {self.product_id}'
 
+class ReviewQuerySet(models.QuerySet):
+    def with_authors(self):
+        return self.select_related('user__user')
+
 class Review(models.Model):
     product = models.ForeignKey('Product', on_delete=models.CASCADE)
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
@@ -177,5 +505,12 @@ class Review(models.Model):
     rating = models.IntegerField(validators=[MaxValueValidator(5), MinValueValidator(1),])
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ReviewQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'user'], name='unique_review_per_user'),
+        ]
+
     def __str__(self):
         return f"Review by {self.user.user.username} for {self.product.title}"
@@ -0,0 +1,116 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+RETRY_BACKOFF = 60
+MAX_BACKOFF = 3600
+# A claimed batch is hidden from other workers for this long; if the worker
+# dies mid-batch the emails become due again once it expires.
+CLAIM_TIMEOUT = 300
+
+
+def build(subject, body, to, from_email=None, html_body=''):
+    return OutboundEmail(
+        subject=subject,
+        body=body,
+        html_body=html_body or '',
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+    )
+
+
+def enqueue(subject, body, to, from_email=None, html_body=''):
+    """Queue an email for the outbox worker. Commits with the caller's transaction."""
+    email = build(subject, body, to, from_email, html_body)
+    email.save()
+    return email
+
+
+def enqueue_many(emails):
+    return OutboundEmail.objects.bulk_create(emails)
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(RETRY_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF))
+
+
+def claim_batch(batch_size, now):
+    with transaction.atomic():
+        ids = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=ids).update(next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT))
+    return list(OutboundEmail.objects.filter(id__in=ids).order_by('id'))
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(email.subject, email.body, email.from_email, email.to, connection=connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def mark_failed(email, error, now):
+    email.attempts += 1
+    email.last_error = error
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboundEmail.FAILED
+    else:
+        email.next_attempt_at = now + backoff(email.attempts)
+
+
+def deliver(emails, now):
+    try:
+        connection = get_connection()
+        connection.open()
+    except Exception as e:
+        logger.warning('Could not open the mail connection: %r', e)
+        for email in emails:
+            mark_failed(email, repr(e), now)
+        return 0
+
+    sent = 0
+    try:
+        for email in emails:
+            try:
+                build_message(email, connection).send()
+            except Exception as e:
+                mark_failed(email, repr(e), now)
+            else:
+                email.status = OutboundEmail.SENT
+                email.attempts += 1
+                email.sent_at = now
+                sent += 1
+    finally:
+        connection.close()
+    return sent
+
+
+def send_pending(batch_size=50, now=None):
+    """
+    Deliver due emails in batches, one mail connection per batch. Failed sends
+    are retried with exponential backoff until MAX_ATTEMPTS. Returns the
+    number of emails sent.
+    """
+    now = now or timezone.now()
+    sent = 0
+    while True:
+        emails = claim_batch(batch_size, now)
+        if not emails:
+            return sent
+        sent += deliver(emails, now)
+        OutboundEmail.objects.bulk_update(
+            emails, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at']
+        )
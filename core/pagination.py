@@ -0,0 +1,129 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import QueryDict
+
+PAGE_SIZE = 12
+NEXT, PREVIOUS = 'n', 'p'
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, *values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return NEXT, None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, *values = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError):
+        return NEXT, None
+    if direction not in (NEXT, PREVIOUS) or not values:
+        return NEXT, None
+    return direction, values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, params=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _query(self, cursor):
+        params = self.params.copy() if self.params is not None else QueryDict(mutable=True)
+        params['cursor'] = cursor
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor)
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor)
+
+
+def paginate_rows(fetch, key, token, per_page=PAGE_SIZE):
+    """
+    fetch(direction, values, limit) returns rows after the cursor in page
+    order for NEXT, or before it in reverse page order for PREVIOUS.
+    """
+    direction, values = decode_cursor(token)
+    rows = list(fetch(direction, values, per_page + 1))
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == PREVIOUS:
+        rows.reverse()
+        has_previous, has_next = more, True
+    else:
+        has_previous, has_next = values is not None, more
+
+    next_cursor = encode_cursor(NEXT, key(rows[-1])) if rows and has_next else None
+    previous_cursor = encode_cursor(PREVIOUS, key(rows[0])) if rows and has_previous else None
+    return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def keyset_paginate(queryset, token, per_page=PAGE_SIZE, order=('created_at', 'id')):
+    """Descending pagination on a (column, id) pair without OFFSET scans."""
+    column, tiebreak = order
+    fields = [queryset.model._meta.get_field(name) for name in order]
+
+    def fetch(direction, values, limit):
+        if values is None:
+            return queryset.order_by(f'-{column}', f'-{tiebreak}')[:limit]
+        value, pk = (field.to_python(raw) for field, raw in zip(fields, values))
+        if value is None or pk is None:
+            raise ValueError('Incomplete cursor')
+        if direction == PREVIOUS:
+            # The leading range on the first column lets the composite index seek.
+            rows = queryset.filter(**{f'{column}__gte': value}).filter(
+                Q(**{f'{column}__gt': value}) | Q(**{f'{tiebreak}__gt': pk})
+            ).order_by(column, tiebreak)
+        else:
+            rows = queryset.filter(**{f'{column}__lte': value}).filter(
+                Q(**{f'{column}__lt': value}) | Q(**{f'{tiebreak}__lt': pk})
+            ).order_by(f'-{column}', f'-{tiebreak}')
+        return rows[:limit]
+
+    def key(obj):
+        values = [getattr(obj, name) for name in order]
+        return [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+
+    try:
+        return paginate_rows(fetch, key, token, per_page)
+    except (TypeError, ValueError, ValidationError):
+        # Tampered or stale cursor: fall back to the first page.
+        return paginate_rows(fetch, key, None, per_page)
+
+
+def paginate_request(request, queryset, per_page=PAGE_SIZE, order=('created_at', 'id')):
+    page = keyset_paginate(queryset, request.GET.get('cursor'), per_page, order)
+    page.params = request.GET.copy()
+    return page
@@ -0,0 +1,91 @@
+"""
+A tiny in-memory stand-in for the payment provider's checkout session API.
+Point STRIPE_API_BASE at it to exercise checkout without network access.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+SESSIONS_PATH = '/v1/checkout/sessions'
+
+
+def unflatten(pairs):
+    """Turn form keys like metadata[order_id] back into nested dicts."""
+    data = {}
+    for key, value in pairs:
+        parts = key.replace(']', '').split('[')
+        target = data
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return data
+
+
+class PaymentStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Request-Id', f'req_{uuid.uuid4().hex[:14]}')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def not_found(self, message):
+        self.send_json(404, {'error': {'type': 'invalid_request_error', 'message': message}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode()
+        time.sleep(self.server.latency)
+        if self.path != SESSIONS_PATH:
+            return self.not_found(f'Unrecognized request URL (POST: {self.path})')
+        params = unflatten(parse_qsl(body, keep_blank_values=True))
+        session_id = f'cs_stub_{uuid.uuid4().hex}'
+        line_items = params.get('line_items', {}).values()
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'url': f'http://{self.headers.get("Host")}/pay/{session_id}',
+            'mode': params.get('mode', 'payment'),
+            'client_reference_id': params.get('client_reference_id'),
+            'customer_details': {'email': params.get('customer_email')},
+            'metadata': params.get('metadata', {}),
+            'amount_total': sum(
+                int(item['price_data']['unit_amount']) * int(item.get('quantity', 1)) for item in line_items
+            ),
+            'payment_status': 'paid',
+            'status': 'complete',
+        }
+        with self.server.lock:
+            self.server.sessions[session_id] = session
+        self.send_json(200, session)
+
+
+class PaymentStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0):
+        super().__init__(address, PaymentStubHandler)
+        self.latency = latency
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_in_thread(host='127.0.0.1', port=0, latency=0.0):
+    server = PaymentStubServer((host, port), latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,45 @@
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+_client = None
+
+
+def build_http_session():
+    # One keep-alive pool shared by every worker thread instead of a new
+    # TCP/TLS handshake per provider call.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_client():
+    global _client
+    if _client is None:
+        base_addresses = {'api': settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {}
+        _client = stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY,
+            base_addresses=base_addresses,
+            max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+            http_client=stripe.RequestsClient(timeout=settings.STRIPE_TIMEOUT, session=build_http_session()),
+        )
+    return _client
+
+
+def reset_client():
+    global _client
+    _client = None
+
+
+def create_session(params):
+    return get_client().checkout.sessions.create(params=params)
+
+
+# Provider calls run on a worker thread so async views never block the event
+# loop; thread_sensitive=False lets them run concurrently.
+async def acreate_session(params):
+    return await sync_to_async(create_session, thread_sensitive=False)(params)
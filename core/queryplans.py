@@ -0,0 +1,68 @@
+"""
+EXPLAIN checks for the lookups on hot request paths. Each entry builds its
+queryset the way the view does, with placeholder values, so a missing or
+unusable index shows up as a full table scan in the plan.
+"""
+import re
+from datetime import datetime, timezone
+
+from django.db import connection
+
+from . import cart
+from .backends import EmailOrUsernameBackend
+from .models import Address, CartItem, Order, Product, Review
+from .recommendations import related_products
+
+HOT_QUERIES = (
+    ('add-to-cart lookup', lambda: CartItem.objects.filter(user_id=1, product_id=1, color_id=1)),
+    ('cart contents', lambda: cart.cart_items(1)),
+    ('existing review', lambda: Review.objects.filter(product_id=1, user_id=1)),
+    ('product reviews', lambda: Review.objects.with_authors().filter(product_id=1)),
+    ('default address', lambda: Address.objects.filter(user_id=1, default=True)),
+    ('login by username or email', lambda: EmailOrUsernameBackend().lookup('someone@example.com')),
+    ('newest products', lambda: Product.objects.catalog().order_by('-created_at', '-id')[:12]),
+    ('newest in category', lambda: Product.objects.filter(category_id=1).order_by('-created_at', '-id')[:12]),
+    ('products added since', lambda: Product.objects.filter(created_at__gte=datetime(2024, 1, 1, tzinfo=timezone.utc))),
+    ('products by price', lambda: Product.objects.filter(price__gte=10, price__lt=20).order_by('price', 'id')[:12]),
+    ('product page', lambda: Product.objects.detail().filter(slug='some-product')),
+    ('next free slug', lambda: Product.slug_family('some-product')[:1]),
+    ('related products', lambda: related_products(1)),
+    ('order by payment session', lambda: Order.objects.filter(payment_session_id='cs_test')),
+)
+
+# A table read start to finish: "SCAN core_product" on SQLite, "Seq Scan on
+# ..." on PostgreSQL.
+FULL_SCAN_PATTERNS = (
+    re.compile(r'\bSCAN (?!CONSTANT ROW)(\w+)$'),
+    re.compile(r'\bSeq Scan on (\w+)'),
+)
+# SQLite walking a whole index in order. That is only cheap when a LIMIT stops
+# it early, and a LIMIT cannot while a temp B-tree still has to sort the rows.
+INDEX_SCAN_PATTERN = re.compile(r'\bSCAN (\w+) USING (?:COVERING )?INDEX \w+$')
+SORT_STEP = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def full_scans(plan, limited=False):
+    bounded = limited and SORT_STEP not in plan
+    tables = []
+    for line in plan.splitlines():
+        patterns = FULL_SCAN_PATTERNS if bounded else FULL_SCAN_PATTERNS + (INDEX_SCAN_PATTERN,)
+        for pattern in patterns:
+            match = pattern.search(line.strip())
+            if match:
+                tables.append(match.group(1))
+    return tables
+
+
+def check(queries=None):
+    """Return (name, plan, scanned tables) for every hot query."""
+    results = []
+    for name, build in HOT_QUERIES if queries is None else queries:
+        queryset = build()
+        plan = queryset.explain()
+        results.append((name, plan, full_scans(plan, limited=queryset.query.is_sliced)))
+    return results
+
+
+def supported():
+    return connection.vendor in ('sqlite', 'postgresql')
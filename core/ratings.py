@@ -0,0 +1,52 @@
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import Product, Review
+
+
+def apply_review(product_id, rating, sign):
+    """Add (sign=1) or remove (sign=-1) one review in a single UPDATE."""
+    new_count = F('review_count') + sign
+    new_sum = F('rating_sum') + sign * rating
+    if sign > 0:
+        average = Cast(new_sum, FloatField()) / new_count
+    else:
+        average = Case(
+            When(review_count__lte=1, then=Value(0.0)),
+            default=Cast(new_sum, FloatField()) / new_count,
+            output_field=FloatField(),
+        )
+    Product.objects.filter(pk=product_id).update(**{
+        'review_count': new_count,
+        'rating_sum': new_sum,
+        'rating_average': average,
+        f'rating_{rating}': F(f'rating_{rating}') + sign,
+    })
+
+
+def recompute(product_ids=None, batch_size=1000):
+    reviews = Review.objects.all()
+    products = Product.objects.all()
+    if product_ids is not None:
+        reviews = reviews.filter(product_id__in=product_ids)
+        products = products.filter(pk__in=product_ids)
+
+    aggregates = {
+        row['product_id']: row
+        for row in reviews.values('product_id').annotate(
+            count=Count('id'),
+            total=Sum('rating'),
+            **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)},
+        ).order_by()
+    }
+    updated = []
+    for product in products.only('id').iterator(chunk_size=batch_size):
+        row = aggregates.get(product.pk, {})
+        product.review_count = row.get('count', 0)
+        product.rating_sum = row.get('total') or 0
+        product.rating_average = product.rating_sum / product.review_count if product.review_count else 0
+        for stars in range(1, 6):
+            setattr(product, f'rating_{stars}', row.get(f'stars_{stars}', 0))
+        updated.append(product)
+    Product.objects.bulk_update(updated, Product.RATING_FIELDS, batch_size=batch_size)
+    return len(updated)
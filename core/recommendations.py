@@ -0,0 +1,176 @@
+"""
+Related products from tag and co-purchase similarity. The job builds two
+sparse product-feature matrices, one over tags (IDF-weighted) and one over
+completed orders, with L2-normalised rows. It multiplies them by their
+transposes a chunk of rows at a time to get cosine similarities, and keeps
+the best TOP_K per row in RelatedProduct. The detail page reads them back
+with one indexed query.
+"""
+from itertools import chain
+
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from scipy import sparse
+from taggit.models import TaggedItem
+
+from .models import OrderLine, Product, RelatedProduct
+from .seeding import Table
+
+TOP_K = 8
+CHUNK_SIZE = 1000
+TAG_WEIGHT = 0.4
+PURCHASE_WEIGHT = 0.6
+# A tag on this many products, or an order this long, says little about any
+# one pair and would make most of the catalog candidates of each other.
+MAX_TAG_PRODUCTS = 2000
+MAX_ORDER_PRODUCTS = 50
+
+
+def id_pairs(queryset):
+    """(product id, feature id) rows of a two-column values_list as an n x 2 array."""
+    flat = np.fromiter(chain.from_iterable(queryset.iterator(chunk_size=10000)), dtype=np.int64)
+    return flat.reshape(-1, 2)
+
+
+def feature_matrix(product_ids, pairs, max_products, idf=False):
+    """
+    Products x features CSR matrix with unit-length rows. Features on more
+    than `max_products` products, and under IDF features every product has,
+    get no weight.
+    """
+    pairs = pairs[np.isin(pairs[:, 0], product_ids)]
+    features, columns = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs)), (np.searchsorted(product_ids, pairs[:, 0]), columns)),
+        shape=(len(product_ids), len(features)),
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    products_per_feature = np.bincount(matrix.indices, minlength=len(features))
+    if idf:
+        with_features = np.count_nonzero(np.diff(matrix.indptr)) or 1
+        weights = np.log(with_features / np.maximum(products_per_feature, 1))
+    else:
+        weights = np.ones(len(features))
+    weights[products_per_feature > max_products] = 0.0
+    matrix = (matrix @ sparse.diags(weights)).tocsr()
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return (sparse.diags(scale) @ matrix).tocsr()
+
+
+class Similarity:
+    """Row-chunked cosine similarity over the tag and purchase matrices."""
+
+    def __init__(self, product_ids, tag_pairs, purchase_pairs):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.weighted = [
+            (TAG_WEIGHT, feature_matrix(self.product_ids, tag_pairs, MAX_TAG_PRODUCTS, idf=True)),
+            (PURCHASE_WEIGHT, feature_matrix(self.product_ids, purchase_pairs, MAX_ORDER_PRODUCTS)),
+        ]
+        self.transposed = [matrix.T.tocsr() for _, matrix in self.weighted]
+
+    @classmethod
+    def load(cls):
+        product_ids = np.fromiter(Product.objects.order_by('pk').values_list('pk', flat=True).iterator(), dtype=np.int64)
+        tag_pairs = id_pairs(TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Product),
+        ).values_list('object_id', 'tag_id'))
+        purchase_pairs = id_pairs(OrderLine.objects.filter(
+            order__order_status='Completed', product__isnull=False,
+        ).values_list('product_id', 'order_id'))
+        return cls(product_ids, tag_pairs, purchase_pairs)
+
+    def rows(self, ids):
+        """Row indices of the products in `ids`; ids of deleted products are skipped."""
+        return np.flatnonzero(np.isin(self.product_ids, np.fromiter(ids, dtype=np.int64)))
+
+    def scores(self, rows):
+        """len(rows) x products sparse matrix of combined similarities."""
+        result = sparse.csr_matrix((len(rows), len(self.product_ids)))
+        for (weight, matrix), transposed in zip(self.weighted, self.transposed):
+            result = result + weight * (matrix[rows] @ transposed)
+        return result.tocsr()
+
+    def neighbours(self, ids):
+        """Ids of every product with a non-zero similarity to one of `ids`."""
+        rows = self.rows(ids)
+        if not len(rows):
+            return set()
+        return set(self.product_ids[np.unique(self.scores(rows).indices)].tolist())
+
+    def top_related(self, rows, top_k=TOP_K):
+        """For each row, [(related id, score)] best first; ties go to the older product."""
+        scores = self.scores(rows)
+        for index, row in enumerate(rows):
+            start, end = scores.indptr[index], scores.indptr[index + 1]
+            columns, values = scores.indices[start:end], scores.data[start:end]
+            keep = (columns != row) & (values > 0)
+            columns, values = columns[keep], values[keep]
+            if len(values) > top_k:
+                threshold = np.partition(values, -top_k)[-top_k]
+                candidates = values >= threshold
+                columns, values = columns[candidates], values[candidates]
+            order = np.lexsort((columns, -values))[:top_k]
+            yield [(int(self.product_ids[c]), float(v)) for c, v in zip(columns[order], values[order])]
+
+
+def affected_products(changed, similarity):
+    """
+    Products whose neighbour lists can change when `changed` do: the products
+    themselves, everything similar to them now, and everything that listed
+    them before.
+    """
+    affected = set(changed) | similarity.neighbours(changed)
+    affected.update(RelatedProduct.objects.filter(related_id__in=list(changed)).values_list('product_id', flat=True))
+    return affected
+
+
+def changed_since(since):
+    """
+    New products and products in orders completed since `since`. Orders are
+    picked by completion time, not creation, because only completed orders
+    count as co-purchases and the webhook worker completes them later.
+    """
+    changed = set(Product.objects.filter(created_at__gte=since).values_list('pk', flat=True))
+    changed.update(
+        OrderLine.objects.filter(order__completed_at__gte=since, product__isnull=False).values_list('product_id', flat=True)
+    )
+    return changed
+
+
+def build(changed=None, top_k=TOP_K, chunk_size=CHUNK_SIZE):
+    """
+    Recompute neighbour lists for every product, or only for those affected by
+    the `changed` product ids. Returns (products refreshed, rows written).
+    Each chunk of products is replaced in its own transaction.
+    """
+    similarity = Similarity.load()
+    if changed is None:
+        rows = np.arange(len(similarity.product_ids))
+    else:
+        rows = similarity.rows(affected_products(changed, similarity))
+
+    table = Table(RelatedProduct, ['product', 'related', 'rank', 'score'])
+    refreshed = written = 0
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        product_ids = similarity.product_ids[chunk].tolist()
+        for product_id, related in zip(product_ids, similarity.top_related(chunk, top_k)):
+            for rank, (other, score) in enumerate(related):
+                table.add(product_id, other, rank, round(score, 6))
+        with transaction.atomic(), connection.cursor() as cursor:
+            RelatedProduct.objects.filter(product_id__in=product_ids).delete()
+            written += table.flush(cursor)
+        refreshed += len(product_ids)
+    return refreshed, written
+
+
+def related_products(product):
+    return (
+        Product.objects.catalog()
+        .filter(related_to__product=product)
+        .order_by('related_to__rank')
+    )
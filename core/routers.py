@@ -0,0 +1,38 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+# Models served on catalog pages; reads of anything else stay on the primary.
+CATALOG_MODELS = {
+    ('core', 'product'), ('core', 'image'), ('core', 'category'), ('core', 'color'),
+    ('core', 'size'), ('core', 'review'), ('core', 'slideshow'), ('core', 'productfacet'),
+    ('core', 'facetcount'), ('core', 'tagpopularity'),
+    ('taggit', 'tag'), ('taggit', 'taggeditem'),
+}
+
+
+class PrimaryReplicaRouter:
+    """
+    Route catalog reads to the replica alias and everything else, writes
+    included, to the primary. Reads made inside a transaction on the primary
+    stay there so they see that transaction's own uncommitted writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if REPLICA_DB_ALIAS not in connections.settings:
+            return None
+        if (model._meta.app_label, model._meta.model_name) not in CATALOG_MODELS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
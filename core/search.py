@@ -0,0 +1,157 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Product
+from .pagination import PREVIOUS, keyset_paginate, paginate_rows
+
+SEARCH_RESULTS_PER_PAGE = 12
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def product_document(product):
+    return (
+        product.pk,
+        product.title,
+        product.description,
+        product.additional_information or '',
+        ' '.join(tag.name for tag in product.tags.all()),
+    )
+
+
+class SearchBackend:
+    def index(self, products):
+        self.index_documents([product_document(product) for product in products])
+
+    def index_documents(self, rows):
+        """Index (id, title, description, additional_information, tags) tuples."""
+        raise NotImplementedError
+
+    def remove(self, product_ids):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def page(self, query, cursor=None, per_page=SEARCH_RESULTS_PER_PAGE):
+        """Return a KeysetPage of matching product ids, best match first."""
+        raise NotImplementedError
+
+    def index_ids(self, product_ids):
+        products = Product.objects.filter(pk__in=product_ids).prefetch_related('tags')
+        found = list(products)
+        self.index(found)
+        missing = set(product_ids) - {product.pk for product in found}
+        if missing:
+            self.remove(missing)
+
+
+class SQLiteFTSBackend(SearchBackend):
+    table = 'core_product_fts'
+    # bm25() column weights: title, description, additional_information, tags
+    weights = (10.0, 1.0, 0.5, 5.0)
+
+    def match_expression(self, query):
+        tokens = TOKEN_RE.findall(query.lower())
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def index_documents(self, rows):
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, title, description, additional_information, tags) '
+                'VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def page(self, query, cursor=None, per_page=SEARCH_RESULTS_PER_PAGE):
+        match = self.match_expression(query)
+        weights = ', '.join(str(weight) for weight in self.weights)
+        ranked = (
+            f'SELECT rowid AS id, bm25({self.table}, {weights}) AS score '
+            f'FROM {self.table} WHERE {self.table} MATCH %s'
+        )
+
+        def fetch(direction, values, limit):
+            if not match:
+                return []
+            if values is None:
+                sql, params = f'{ranked} ORDER BY score, id LIMIT %s', [match, limit]
+            else:
+                score, pk = float(values[0]), int(values[1])
+                op, order = ('<', 'DESC') if direction == PREVIOUS else ('>', 'ASC')
+                sql = (
+                    f'SELECT id, score FROM ({ranked}) '
+                    f'WHERE score {op} %s OR (score = %s AND id {op} %s) '
+                    f'ORDER BY score {order}, id {order} LIMIT %s'
+                )
+                params = [match, score, score, pk, limit]
+            with connection.cursor() as db_cursor:
+                db_cursor.execute(sql, params)
+                return db_cursor.fetchall()
+
+        def key(row):
+            return [row[1], row[0]]
+
+        try:
+            page = paginate_rows(fetch, key, cursor, per_page)
+        except (TypeError, ValueError):
+            page = paginate_rows(fetch, key, None, per_page)
+        page.object_list = [row[0] for row in page.object_list]
+        return page
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """Unindexed fallback for database engines without a full-text backend."""
+
+    def index_documents(self, rows):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def filter(self, query):
+        products = Product.objects.all()
+        for token in TOKEN_RE.findall(query):
+            products = products.filter(
+                Q(title__icontains=token) | Q(description__icontains=token)
+                | Q(additional_information__icontains=token) | Q(tags__name__iexact=token)
+            )
+        return products.distinct()
+
+    def page(self, query, cursor=None, per_page=SEARCH_RESULTS_PER_PAGE):
+        page = keyset_paginate(self.filter(query).only('id', 'created_at'), cursor, per_page)
+        page.object_list = [product.pk for product in page.object_list]
+        return page
+
+
+def get_backend():
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSBackend()
+    return DatabaseSearchBackend()
+
+
+def search_products(query, cursor=None, per_page=SEARCH_RESULTS_PER_PAGE):
+    page = get_backend().page(query, cursor, per_page)
+    products = Product.objects.catalog().in_bulk(page.object_list)
+    page.object_list = [products[pk] for pk in page.object_list if pk in products]
+    return page
@@ -0,0 +1,328 @@
+"""
+Fast, deterministic synthetic data for scale testing.
+
+Rows are generated as plain tuples with precomputed primary keys and written
+with one executemany() per table and batch, M2M through tables included, so
+nothing goes through Model.save(), bulk_create() or signals. Facet rows and
+search documents are derived from the same tuples while they are in memory.
+
+Popularity follows a Zipf-like curve: a few sellers, categories, tags and
+products account for most listings, reviews, carts and orders.
+"""
+import random
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+from taggit.models import Tag, TaggedItem
+
+from . import facets, tags
+from .models import (
+    CartItem, Category, Color, Image, Order, OrderLine, Product, ProductFacet, Review, Size, UserProfile,
+)
+from .search import get_backend
+
+ADJECTIVES = ('Classic', 'Modern', 'Vintage', 'Slim', 'Relaxed', 'Everyday', 'Premium', 'Light', 'Heavy', 'Soft', 'Bold', 'Urban')
+MATERIALS = ('Cotton', 'Linen', 'Leather', 'Denim', 'Wool', 'Silk', 'Canvas', 'Suede', 'Knit', 'Fleece')
+NOUNS = ('Shirt', 'Jacket', 'Dress', 'Bag', 'Boots', 'Scarf', 'Hat', 'Belt', 'Sweater', 'Jeans', 'Skirt', 'Wallet')
+TITLES = tuple(f'{a} {m} {n}' for a in ADJECTIVES for m in MATERIALS for n in NOUNS)
+WORDS = tuple(sorted({word.lower() for word in ADJECTIVES + MATERIALS + NOUNS} | {
+    'comfortable', 'durable', 'handmade', 'stitched', 'breathable', 'fit', 'season', 'pocket', 'lined', 'washable',
+}))
+COLORS = ('Red', 'Blue', 'Black', 'White', 'Green', 'Grey', 'Navy', 'Beige')
+SIZES = ('XS', 'S', 'M', 'L', 'XL', 'XXL')
+# Share of 1..5 star ratings; reviews lean positive.
+RATING_WEIGHTS = (4, 6, 12, 30, 48)
+UNUSABLE_PASSWORD = '!seeded'
+# Seeded timestamps count back from this instant, moved a day per seed, so a
+# seed writes the same rows whenever it runs.
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+# Products are spread over this many days, oldest first.
+CATALOG_AGE_DAYS = 730
+# Multiplier used to scatter popularity ranks across the id range.
+SCATTER = 1_000_003
+# Field types whose Python values need converting before they reach the driver.
+PREPARED_TYPES = {'DateTimeField', 'DateField', 'JSONField', 'DecimalField'}
+
+
+def skewed(rng, n):
+    """Index in [0, n) with density proportional to 1/(index + 1)."""
+    return min(n - 1, int(n ** rng.random()) - 1)
+
+
+def scatter(rank, n):
+    """Map a popularity rank onto an id offset so popular rows are not all old ones."""
+    return (rank * SCATTER) % n if n % SCATTER else rank
+
+
+def bits(mask):
+    return [bit for bit in range(8) if mask & (1 << bit)]
+
+
+def next_id(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+def field_default(field):
+    if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+        return timezone.now()
+    return field.get_default()
+
+
+class Table:
+    """
+    Buffered INSERTs into one model's table. Rows give values for `fields`
+    in order; every other concrete column gets the field's default.
+    """
+
+    def __init__(self, model, fields):
+        opts = model._meta
+        given = [opts.get_field(name) for name in fields]
+        rest = [field for field in opts.concrete_fields if field not in given and not field.primary_key]
+        self.label = opts.label
+        self.defaults = tuple(field.get_db_prep_save(field_default(field), connection) for field in rest)
+        self.prepare = [
+            (index, field.get_db_prep_save) for index, field in enumerate(given)
+            if field.get_internal_type() in PREPARED_TYPES
+        ]
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.column) for field in given + rest)
+        placeholders = ', '.join(['%s'] * (len(given) + len(rest)))
+        self.sql = f'INSERT INTO {quote(opts.db_table)} ({columns}) VALUES ({placeholders})'
+        self.rows = []
+
+    def add(self, *values):
+        self.rows.append(values)
+
+    def flush(self, cursor):
+        rows, self.rows = self.rows, []
+        if not rows:
+            return 0
+        if self.prepare:
+            rows = [list(row) for row in rows]
+            for row in rows:
+                for index, prepare in self.prepare:
+                    row[index] = prepare(row[index], connection)
+        cursor.executemany(self.sql, [tuple(row) + self.defaults for row in rows])
+        return len(rows)
+
+
+class Seeder:
+    def __init__(self, seed=0, batch_size=5000, log=None, now=None):
+        self.rng = random.Random(seed)
+        self.prefix = f'seed{seed}'
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.rows = Counter()
+        self.elapsed = 0.0
+        self.now = now or EPOCH + timedelta(days=seed)
+
+    def write(self, *tables):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table in tables:
+                self.rows[table.label] += table.flush(cursor)
+
+    def stage(self, name, function, *args):
+        started = time.perf_counter()
+        before = sum(self.rows.values())
+        function(*args)
+        seconds = time.perf_counter() - started
+        self.elapsed += seconds
+        written = sum(self.rows.values()) - before
+        self.log(f'{name:<10} {written:>10} rows {seconds:>8.1f}s {written / seconds if seconds else 0:>10.0f} rows/s')
+
+    def run(self, products=10000, users=2000, sellers=50, categories=40, tag_count=400,
+            reviews=3.0, carts=None, orders=None, derived=True):
+        if User.objects.filter(username__startswith=f'{self.prefix}-').exists():
+            raise ValueError(f'This database was already seeded with {self.prefix!r}; pick another seed.')
+        self.derived = derived
+        self.stage('taxonomy', self.seed_taxonomy, categories, tag_count)
+        self.stage('users', self.seed_users, users)
+        self.sellers = self.profile_ids[:max(1, min(sellers, users))]
+        self.stage('products', self.seed_products, products, reviews)
+        self.stage('carts', self.seed_carts, users // 5 if carts is None else carts)
+        self.stage('orders', self.seed_orders, products // 2 if orders is None else orders)
+        if derived:
+            self.stage('tag counts', tags.reconcile)
+        return self.rows
+
+    def seed_taxonomy(self, categories, tag_count):
+        palette = {}
+        for model, names in ((Color, COLORS), (Size, SIZES)):
+            existing = {}
+            for pk, name in model.objects.filter(name__in=names).order_by('pk').values_list('pk', 'name'):
+                existing.setdefault(name, pk)
+            missing = [name for name in names if name not in existing]
+            model.objects.bulk_create([model(name=name) for name in missing])
+            self.rows[model._meta.label] += len(missing)
+            existing.update(model.objects.filter(name__in=missing).values_list('name', 'pk'))
+            palette[model] = [existing[name] for name in names]
+        self.color_ids, self.size_ids = palette[Color], palette[Size]
+
+        first = next_id(Category)
+        self.category_ids = list(range(first, first + categories))
+        table = Table(Category, ['id', 'name'])
+        for pk in self.category_ids:
+            table.add(pk, f'{self.rng.choice(MATERIALS)} {self.rng.choice(NOUNS)}s {pk}')
+
+        first = next_id(Tag)
+        self.tag_ids = list(range(first, first + tag_count))
+        self.tag_names = {}
+        tag_table = Table(Tag, ['id', 'name', 'slug'])
+        for pk in self.tag_ids:
+            name = f'{self.prefix}-{self.rng.choice(WORDS)}-{pk - first}'
+            self.tag_names[pk] = name
+            tag_table.add(pk, name, slugify(name))
+        self.write(table, tag_table)
+
+    def seed_users(self, count):
+        first_user, first_profile = next_id(User), next_id(UserProfile)
+        users = Table(User, ['id', 'username', 'email', 'password', 'date_joined'])
+        profiles = Table(UserProfile, ['id', 'user_id'])
+        for start in range(0, count, self.batch_size):
+            for i in range(start, min(count, start + self.batch_size)):
+                users.add(first_user + i, f'{self.prefix}-user{i}', f'user{i}@{self.prefix}.example.com', UNUSABLE_PASSWORD, self.now)
+                profiles.add(first_profile + i, first_user + i)
+            self.write(users, profiles)
+        self.profile_ids = range(first_profile, first_profile + count)
+
+    def seed_products(self, count, mean_reviews):
+        rng = self.rng
+        self.first_product = first = next_id(Product)
+        self.product_count = count
+        # Compact per-product facts reused by carts and orders.
+        self.prices = array('l')
+        self.titles = array('H')
+        self.color_masks = array('B')
+        self.size_masks = array('B')
+        self.facet_counts = Counter()
+
+        products = Table(Product, [
+            'id', 'slug', 'title', 'price', 'user_id', 'category_id', 'description', 'is_clothing', 'created_at',
+            'review_count', 'rating_sum', 'rating_average', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+        ])
+        images = Table(Image, ['product_id', 'images'])
+        reviews = Table(Review, ['product_id', 'user_id', 'rating', 'content', 'created_at'])
+        colors = Table(Product.color.through, ['product_id', 'color_id'])
+        sizes = Table(Product.sizes.through, ['product_id', 'size_id'])
+        tagged = Table(TaggedItem, ['content_type_id', 'object_id', 'tag_id'])
+        product_facets = Table(ProductFacet, ['product_id', 'facet', 'value'])
+        content_type = ContentType.objects.get_for_model(Product).pk
+        backend = get_backend()
+        max_reviews = len(self.profile_ids) // 2
+        age = timedelta(days=CATALOG_AGE_DAYS)
+
+        for start in range(0, count, self.batch_size):
+            documents = []
+            for offset in range(start, min(count, start + self.batch_size)):
+                pk = first + offset
+                title = rng.randrange(len(TITLES))
+                price = max(1, min(9999, int(rng.lognormvariate(3.3, 0.8))))
+                category = self.category_ids[skewed(rng, len(self.category_ids))]
+                color_mask = sum(1 << bit for bit in rng.sample(range(len(self.color_ids)), rng.randint(1, 3)))
+                is_clothing = rng.random() < 0.4
+                size_mask = sum(1 << bit for bit in rng.sample(range(len(self.size_ids)), rng.randint(2, 4))) if is_clothing else 0
+                tag_ids = sorted({self.tag_ids[skewed(rng, len(self.tag_ids))] for _ in range(rng.randint(2, 5))})
+                description = ' '.join(rng.choices(WORDS, k=rng.randint(20, 60))).capitalize() + '.'
+                created_at = self.now - age * (1 - offset / count) + timedelta(seconds=rng.randrange(3600))
+                self.prices.append(price)
+                self.titles.append(title)
+                self.color_masks.append(color_mask)
+                self.size_masks.append(size_mask)
+
+                n_reviews = min(max_reviews, int((rng.paretovariate(1.5) - 1) * mean_reviews / 2))
+                reviewers = set()
+                while len(reviewers) < n_reviews:
+                    reviewers.add(self.profile_ids[skewed(rng, len(self.profile_ids))])
+                ratings = rng.choices(range(1, 6), weights=RATING_WEIGHTS, k=n_reviews)
+                stars = Counter(ratings)
+                products.add(
+                    pk, f'{slugify(TITLES[title])}-{pk}', TITLES[title], price,
+                    self.sellers[skewed(rng, len(self.sellers))], category, description, is_clothing, created_at,
+                    n_reviews, sum(ratings), sum(ratings) / n_reviews if n_reviews else 0,
+                    *(stars[star] for star in range(1, 6)),
+                )
+                for user_id, rating in zip(sorted(reviewers), ratings):
+                    reviews.add(
+                        pk, user_id, rating, ' '.join(rng.choices(WORDS, k=8)).capitalize(),
+                        min(self.now, created_at + timedelta(days=rng.randint(1, 300))),
+                    )
+                for n in range(rng.randint(1, 3)):
+                    images.add(pk, f'product-images/{self.prefix}/{pk}-{n}.jpg')
+                for bit in bits(color_mask):
+                    colors.add(pk, self.color_ids[bit])
+                for bit in bits(size_mask):
+                    sizes.add(pk, self.size_ids[bit])
+                for tag_id in tag_ids:
+                    tagged.add(content_type, pk, tag_id)
+
+                if self.derived:
+                    values = {(ProductFacet.PRICE, facets.price_bucket(price)), (ProductFacet.CATEGORY, str(category))}
+                    values.update((ProductFacet.COLOR, str(self.color_ids[bit])) for bit in bits(color_mask))
+                    values.update((ProductFacet.SIZE, str(self.size_ids[bit])) for bit in bits(size_mask))
+                    values.update((ProductFacet.TAG, str(tag_id)) for tag_id in tag_ids)
+                    for facet, value in sorted(values):
+                        product_facets.add(pk, facet, value)
+                    self.facet_counts.update(values)
+                    documents.append((pk, TITLES[title], description, '', ' '.join(self.tag_names[t] for t in tag_ids)))
+
+            self.write(products, reviews, images, colors, sizes, tagged, product_facets)
+            if documents:
+                with transaction.atomic():
+                    backend.index_documents(documents)
+            self.log(f'  products {min(count, start + self.batch_size)}/{count}')
+        if self.derived:
+            facets.adjust_counts(self.facet_counts)
+
+    def popular_product(self):
+        """Offset of a product, drawn with Zipf-like popularity."""
+        return scatter(skewed(self.rng, self.product_count), self.product_count)
+
+    def line(self, offset):
+        """Product id, colour id and size id for a cart or order line."""
+        colors, sizes = bits(self.color_masks[offset]), bits(self.size_masks[offset])
+        return (
+            self.first_product + offset,
+            self.color_ids[self.rng.choice(colors)],
+            self.size_ids[self.rng.choice(sizes)] if sizes else None,
+        )
+
+    def basket(self, largest):
+        return sorted({self.popular_product() for _ in range(self.rng.randint(1, largest))})
+
+    def seed_carts(self, count):
+        if not self.product_count:
+            return
+        shoppers = sorted(self.rng.sample(self.profile_ids, min(count, len(self.profile_ids))))
+        items = Table(CartItem, ['user_id', 'product_id', 'color_id', 'size_id', 'quantity'])
+        for start in range(0, len(shoppers), self.batch_size):
+            for user_id in shoppers[start:start + self.batch_size]:
+                for offset in self.basket(6):
+                    items.add(user_id, *self.line(offset), self.rng.randint(1, 3))
+            self.write(items)
+
+    def seed_orders(self, count):
+        if not self.product_count:
+            return
+        first = next_id(Order)
+        orders = Table(Order, ['id', 'user_id', 'total_price', 'order_status', 'created_at', 'completed_at'])
+        lines = Table(OrderLine, ['order_id', 'product_id', 'color_id', 'size_id', 'title', 'unit_price', 'quantity'])
+        for start in range(0, count, self.batch_size):
+            for pk in range(first + start, first + min(count, start + self.batch_size)):
+                total = 0
+                for offset in self.basket(4):
+                    quantity = self.rng.randint(1, 3)
+                    total += self.prices[offset] * quantity
+                    lines.add(pk, *self.line(offset), TITLES[self.titles[offset]], self.prices[offset], quantity)
+                user_id = self.profile_ids[skewed(self.rng, len(self.profile_ids))]
+                status = 'Completed' if self.rng.random() < 0.85 else 'Pending'
+                created_at = self.now - timedelta(minutes=self.rng.randrange(365 * 24 * 60))
+                orders.add(pk, user_id, total, status, created_at, created_at if status == 'Completed' else None)
+            self.write(orders, lines)
@@ -0,0 +1,143 @@
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from taggit.models import Tag, TaggedItem
+
+from . import cart, facets, images
+from .cache import invalidate_catalog
+from .instrumentation import install_query_hook
+from .models import CartItem, Product, ProductFacet, Image, Slideshow, Category, Color, Size, Review, UserProfile
+from .ratings import apply_review, recompute
+from .search import get_backend
+from .tags import increment_tag_count, decrement_tag_count
+
+connection_created.connect(install_query_hook)
+
+CATALOG_MODELS = (Product, Image, Slideshow, Category, Review, Tag, TaggedItem)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_catalog_pages(sender, **kwargs):
+    if sender in CATALOG_MODELS:
+        invalidate_catalog()
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_summary(sender, instance, **kwargs):
+    cart.invalidate_summaries([instance.user_id])
+
+
+@receiver(post_save, sender=Product)
+def invalidate_carts_with_product(sender, instance, created, raw=False, **kwargs):
+    # The price may have changed; new products are in nobody's cart yet.
+    if not created and not raw:
+        cart.invalidate_summaries(CartItem.objects.filter(product=instance).values_list('user_id', flat=True))
+
+
+@receiver(user_logged_in)
+def merge_session_cart(sender, request, user, **kwargs):
+    if request is not None and cart.session_lines(getattr(request, 'session', {})):
+        cart.merge_session_cart(user.userprofile, request.session)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_backend().index([instance])
+    facets.reindex_product(instance.pk)
+
+
+@receiver(pre_delete, sender=Product)
+def remove_product_facets(sender, instance, **kwargs):
+    facets.remove_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def reindex_tagged_product(sender, instance, origin=None, **kwargs):
+    # Tags removed by a product's own cascade delete need no reindex.
+    if isinstance(origin, Product) or getattr(origin, 'model', None) is Product:
+        return
+    if instance.content_type_id == ContentType.objects.get_for_model(Product).id:
+        get_backend().index_ids([instance.object_id])
+        facets.reindex_product(instance.object_id)
+
+
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, created, **kwargs):
+    if created:
+        apply_review(instance.product_id, instance.rating, 1)
+    else:
+        recompute([instance.product_id])
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    apply_review(instance.product_id, instance.rating, -1)
+
+
+@receiver(post_save, sender=TaggedItem)
+def count_tag_use(sender, instance, created, **kwargs):
+    if created:
+        increment_tag_count(instance.tag_id)
+
+
+@receiver(post_delete, sender=TaggedItem)
+def uncount_tag_use(sender, instance, **kwargs):
+    decrement_tag_count(instance.tag_id)
+
+
+@receiver(m2m_changed, sender=Product.color.through)
+@receiver(m2m_changed, sender=Product.sizes.through)
+def reindex_product_options(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    product_ids = (pk_set or []) if reverse else [instance.pk]
+    for product_id in product_ids:
+        facets.reindex_product(product_id)
+    invalidate_catalog()
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Color)
+@receiver(post_delete, sender=Size)
+@receiver(post_delete, sender=Tag)
+def remove_facet_value(sender, instance, **kwargs):
+    facet = {Category: ProductFacet.CATEGORY, Color: ProductFacet.COLOR, Size: ProductFacet.SIZE, Tag: ProductFacet.TAG}[sender]
+    facets.remove_value(facet, str(instance.pk))
+
+
+@receiver(post_save, sender=Tag)
+def reindex_renamed_tag(sender, instance, created, **kwargs):
+    if not created:
+        product_ids = TaggedItem.objects.filter(
+            tag=instance, content_type=ContentType.objects.get_for_model(Product),
+        ).values_list('object_id', flat=True)
+        get_backend().index_ids(list(product_ids))
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=Slideshow)
+@receiver(post_save, sender=UserProfile)
+def generate_image_variants(sender, instance, raw=False, **kwargs):
+    # Resizing is left to the process_image_variants worker so uploads never
+    # wait on Pillow.
+    if not raw and not images.is_current(instance):
+        images.enqueue(instance)
+
+
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=Slideshow)
+@receiver(post_delete, sender=UserProfile)
+def delete_image_variants(sender, instance, **kwargs):
+    if instance.variants:
+        transaction.on_commit(lambda: images.release(sender, instance.variants))
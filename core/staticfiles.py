@@ -0,0 +1,87 @@
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml',
+    '.ttf', '.otf', '.eot', '.ico',
+}
+MIN_SIZE = 256
+# Keep a compressed copy only if it saves at least this much.
+MIN_RATIO = 0.95
+
+
+def is_compressible(name):
+    return os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def encoders():
+    yield '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality=11)
+
+
+def compress_file(path):
+    """Write .gz (and .br when brotli is installed) siblings of `path`."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = []
+    if len(data) < MIN_SIZE:
+        return written
+    for extension, compress in encoders():
+        compressed = compress(data)
+        if len(compressed) < len(data) * MIN_RATIO:
+            with open(path + extension, 'wb') as f:
+                f.write(compressed)
+            written.append(path + extension)
+        elif os.path.exists(path + extension):
+            os.remove(path + extension)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also precompresses every text asset, hashed and
+    original name alike, so the static middleware can serve the smallest
+    encoding the client accepts.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run=dry_run, **options):
+            if isinstance(hashed_name, str):
+                names.update((name, hashed_name))
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        files = [self.path(name) for name in sorted(names) if is_compressible(name) and self.exists(name)]
+        # zlib and brotli release the GIL, so threads compress in parallel.
+        with ThreadPoolExecutor() as pool:
+            list(pool.map(compress_file, files))
+
+    def hashed_name(self, name, content=None, filename=None):
+        # A few vendored stylesheets reference images that are not shipped;
+        # leave those URLs as they are instead of aborting collectstatic.
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            if content is not None:
+                raise
+            return name
+
+
+def unhashed_storages():
+    """
+    STORAGES with plain static file storage, for runs where collectstatic has
+    not written a manifest (tests, benchmarks). Production keeps the strict
+    manifest so a missing entry fails loudly instead of serving an unhashed URL.
+    """
+    return {**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
@@ -0,0 +1,35 @@
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+from .uploads import content_hash
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Name files after the SHA-256 of their content, keeping the upload_to
+    directory and extension: product-images/ab/ab12...ef.jpg. Identical
+    uploads map to one file, which is written once and never overwritten.
+    """
+
+    def hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = content_hash(content)
+        return os.path.join(directory, digest[:2], f'{digest}{extension}').replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+upload_storage = ContentAddressedStorage()
@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models import Count, F
+from taggit.models import Tag
+
+from .models import TagPopularity
+
+
+def increment_tag_count(tag_id):
+    TagPopularity.objects.get_or_create(tag_id=tag_id)
+    TagPopularity.objects.filter(tag_id=tag_id).update(count=F('count') + 1)
+
+
+def decrement_tag_count(tag_id):
+    TagPopularity.objects.filter(tag_id=tag_id, count__gt=0).update(count=F('count') - 1)
+
+
+def popular_tags(limit=5):
+    return [entry.tag for entry in TagPopularity.objects.top(limit)]
+
+
+def reconcile(batch_size=1000):
+    """Recount tag usage from the tagged-item table and return the number of rows fixed."""
+    actual = dict(Tag.objects.annotate(n=Count('taggit_taggeditem_items')).values_list('id', 'n'))
+    stored = dict(TagPopularity.objects.values_list('tag_id', 'count'))
+    missing = [TagPopularity(tag_id=tag_id, count=n) for tag_id, n in actual.items() if tag_id not in stored]
+    drifted = [TagPopularity(tag_id=tag_id, count=n) for tag_id, n in actual.items() if tag_id in stored and stored[tag_id] != n]
+    with transaction.atomic():
+        TagPopularity.objects.bulk_create(missing, batch_size=batch_size)
+        TagPopularity.objects.bulk_update(drifted, ['count'], batch_size=batch_size)
+    return len(missing) + len(drifted)
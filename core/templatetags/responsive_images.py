@@ -0,0 +1,59 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from core.images import VARIANT_SPECS
+
+register = template.Library()
+
+
+def image_field(instance):
+    field_name, _ = VARIANT_SPECS[type(instance)]
+    return getattr(instance, field_name)
+
+
+def current_variants(instance):
+    field = image_field(instance)
+    variants = instance.variants or {}
+    return variants if field and variants.get('source') == field.name else {}
+
+
+def build_srcset(instance, image_format):
+    storage = image_field(instance).storage
+    return ', '.join(f'{storage.url(name)} {width}w' for width, name in current_variants(instance).get(image_format, ()))
+
+
+@register.filter
+def srcset(instance, image_format='webp'):
+    """{{ image|srcset }} or {{ image|srcset:"jpeg" }}"""
+    if not instance:
+        return ''
+    return build_srcset(instance, image_format)
+
+
+@register.simple_tag
+def picture(instance, sizes='100vw', **attrs):
+    """
+    Render a <picture> with WebP and JPEG sources for an Image, Slideshow or
+    UserProfile, falling back to the original upload if no variants exist.
+    """
+    if not instance or not image_field(instance):
+        return ''
+    variants = current_variants(instance)
+    attrs.setdefault('alt', '')
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    if not variants:
+        return format_html('<img src="{}"{}>', image_field(instance).url, flatatt(attrs))
+
+    jpeg = variants['jpeg']
+    attrs.update({
+        'srcset': build_srcset(instance, 'jpeg'),
+        'sizes': sizes,
+        'width': variants['width'],
+        'height': variants['height'],
+    })
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}"><img src="{}"{}></picture>',
+        build_srcset(instance, 'webp'), sizes, image_field(instance).storage.url(jpeg[-1][1]), flatatt(attrs),
+    )
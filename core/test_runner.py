@@ -0,0 +1,21 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .staticfiles import unhashed_storages
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Tests run with DEBUG off but without collectstatic, so templates resolve
+    {% static %} without the manifest. StaticAssetTests switch the manifest
+    storage back on for themselves.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.static_storage = override_settings(STORAGES=unhashed_storages())
+        self.static_storage.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.static_storage.disable()
+        super().teardown_test_environment(**kwargs)
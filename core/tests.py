@@ -1,3 +1,1604 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO, StringIO
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIHandler
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.db import IntegrityError, connection, connections, transaction
+from django.http import HttpResponseRedirect, QueryDict
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+from taggit.models import Tag, TaggedItem
+
+from . import cart, loadtest, payments, queryplans, recommendations, throttle
+from .backends import EmailOrUsernameBackend, ProfileBackend, aauthenticate
+from .checkout import create_order
+from .facets import facet_counts, faceted_search
+from .forms import OutboxPasswordResetForm
+from .images import backfill, process_pending as process_image_variants
+from .instrumentation import RequestMetrics, registry
+from .models import *
+from .outbox import MAX_ATTEMPTS, backoff, enqueue, send_pending
+from .pagination import keyset_paginate
+from .payment_stub import start_in_thread
+from .ratings import recompute
+from .seeding import Seeder
+from .routers import PrimaryReplicaRouter
+from .search import get_backend, search_products
+from .tags import popular_tags, reconcile
+from .urls import urlpatterns
+from .uploads import HashingFileUploadHandler, image_dimensions
+from .webhooks import process_pending
+
+
+class CatalogMixin:
+    @classmethod
+    def create_catalog(cls, owner, size, prefix='item'):
+        category = Category.objects.create(name=f'{prefix}-category')
+        color = Color.objects.first() or Color.objects.create(name='Red')
+        tag, _ = Tag.objects.get_or_create(name=f'{prefix}-tag')
+        products = []
+        for i in range(size):
+            product = Product.objects.create(
+                user=owner, title=f'{prefix} {i}', price=10 + i,
+                description=f'{prefix} description', category=category,
+            )
+            product.color.add(color)
+            product.tags.add(tag)
+            Image.objects.create(product=product, images=f'product-images/{prefix}-{i}.jpg')
+            Review.objects.create(product=product, user=owner, content='Nice', rating=4)
+            products.append(product)
+        return products
+
+
+class QueryBudgetTests(CatalogMixin, TestCase):
+    # Routes that never touch catalog tables or hit the payment provider
+    # directly are exempt; every other route in core/urls.py must be listed.
+    EXEMPT = {
+        'login_register', 'logout', 'password_reset', 'password_reset_done',
+        'password_reset_confirm', 'password_reset_complete', 'payment', 'success', 'cancel',
+        'stripe-webhook', 'metrics',
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pass1234!')
+        self.profile = self.user.userprofile
+        self.client.force_login(self.user)
+
+    def route_kwargs(self):
+        product = Product.objects.order_by('id').first()
+        CartItem.objects.get_or_create(user=self.profile, product=product)
+        return {
+            'home': {},
+            'products': {},
+            'product_list': {},
+            'create-product': {},
+            'product-details': {'product_slug': product.slug},
+            'edit-product': {'product_slug': product.slug},
+            'view-cart': {},
+            'add-to-cart': {'product_slug': product.slug},
+            'checkout': {},
+            'search': {'query': {'q': 'item'}},
+        }
+
+    def fill_cart(self):
+        for product in Product.objects.all():
+            CartItem.objects.get_or_create(user=self.profile, product=product)
+
+    def count_queries(self, name, kwargs):
+        kwargs = dict(kwargs)
+        query = kwargs.pop('query', {})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(f'core:{name}', kwargs=kwargs), query)
+        self.assertLess(response.status_code, 400, name)
+        return len(ctx)
+
+    def assertQueryBudget(self, name, small, large):
+        self.assertEqual(
+            small, large,
+            f'core:{name} query count grew with catalog size ({small} -> {large})',
+        )
+
+    def test_every_route_is_budgeted(self):
+        names = {pattern.name for pattern in urlpatterns}
+        self.create_catalog(self.profile, 1)
+        self.assertEqual(names - self.EXEMPT, set(self.route_kwargs()))
+
+    def test_query_count_is_independent_of_catalog_size(self):
+        self.create_catalog(self.profile, 2)
+        self.fill_cart()
+        routes = self.route_kwargs()
+        small = {name: self.count_queries(name, kwargs) for name, kwargs in routes.items()}
+
+        self.create_catalog(self.profile, 15, prefix='more')
+        self.fill_cart()
+        for name, kwargs in routes.items():
+            self.assertQueryBudget(name, small[name], self.count_queries(name, kwargs))
+
+
+class PageCacheTests(CatalogMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'pass1234!')
+        self.create_catalog(self.user.userprofile, 2)
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        for name in ('core:home', 'core:products'):
+            self.client.get(reverse(name))
+            with self.assertNumQueries(0):
+                self.client.get(reverse(name))
+
+    def test_query_string_is_part_of_the_key(self):
+        self.client.get(reverse('core:products'))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('core:products'), {'price_range': '0-50'})
+        self.assertGreater(len(ctx), 0)
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.get(reverse('core:home'))
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('core:home'))
+        self.assertGreater(len(ctx), 0)
+
+    def test_catalog_changes_invalidate_cached_pages(self):
+        self.client.get(reverse('core:products'))
+        Product.objects.create(user=self.user.userprofile, title='Fresh arrival', price=5, description='New')
+        response = self.client.get(reverse('core:products'))
+        self.assertContains(response, 'Fresh arrival')
+
+    def test_tag_changes_invalidate_cached_pages(self):
+        self.client.get(reverse('core:home'))
+        Product.objects.first().tags.add('clearance')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('core:home'))
+        self.assertGreater(len(ctx), 0)
+
+
+class SearchTests(CatalogMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'pass1234!')
+        self.owner = self.user.userprofile
+
+    def create_product(self, title, description='Plain', **kwargs):
+        return Product.objects.create(user=self.owner, title=title, price=10, description=description, **kwargs)
+
+    def result_titles(self, query):
+        return [product.title for product in search_products(query)]
+
+    def test_title_matches_rank_above_description_matches(self):
+        self.create_product('Everyday tote', description='Fits a linen shirt')
+        self.create_product('Linen shirt')
+        self.assertEqual(self.result_titles('linen'), ['Linen shirt', 'Everyday tote'])
+
+    def test_tags_and_additional_information_are_indexed(self):
+        tagged = self.create_product('Cap')
+        tagged.tags.add('summer')
+        self.create_product('Scarf', additional_information='Hand woven wool')
+        self.assertEqual(self.result_titles('summer'), ['Cap'])
+        self.assertEqual(self.result_titles('woven'), ['Scarf'])
+
+    def test_index_follows_updates_and_deletes(self):
+        product = self.create_product('Denim jacket')
+        product.title = 'Leather jacket'
+        product.save()
+        self.assertEqual(self.result_titles('denim'), [])
+        self.assertEqual(self.result_titles('leather'), ['Leather jacket'])
+        product.delete()
+        self.assertEqual(self.result_titles('jacket'), [])
+
+    def test_results_are_cursor_paginated_in_rank_order(self):
+        self.create_product('Sock sock sock')
+        for i in range(14):
+            self.create_product(f'Sock {i}')
+        first = search_products('sock', per_page=10)
+        second = search_products('sock', first.next_cursor, per_page=10)
+        self.assertEqual(first[0].title, 'Sock sock sock')
+        self.assertEqual(len(second), 5)
+        self.assertFalse(second.has_next)
+        self.assertEqual(
+            [p.pk for p in search_products('sock', second.previous_cursor, per_page=10)],
+            [p.pk for p in first],
+        )
+
+    def test_rebuild_command_restores_index(self):
+        self.create_product('Wool beanie').tags.add('winter')
+        get_backend().clear()
+        self.assertEqual(self.result_titles('beanie'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.result_titles('winter'), ['Wool beanie'])
+
+    def test_search_view_renders_ranked_page(self):
+        self.create_product('Canvas sneaker')
+        response = self.client.get(reverse('core:search'), {'q': 'sneak'})
+        self.assertContains(response, 'Canvas sneaker')
+
+
+class KeysetPaginationTests(CatalogMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('seller', 'seller@example.com', 'pass1234!')
+        self.products = self.create_catalog(self.user.userprofile, 7)
+        # Identical timestamps force the id tiebreaker to do the work.
+        Product.objects.filter(pk__in=[p.pk for p in self.products[2:5]]).update(
+            created_at=self.products[2].created_at,
+        )
+
+    def walk(self, per_page):
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(Product.objects.all(), cursor, per_page)
+            pages.append([p.pk for p in page])
+            if not page.has_next:
+                return pages, page
+            cursor = page.next_cursor
+
+    def test_forward_walk_visits_every_product_once(self):
+        pages, _ = self.walk(3)
+        seen = [pk for page in pages for pk in page]
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_previous_cursor_returns_the_prior_page(self):
+        first = keyset_paginate(Product.objects.all(), None, 3)
+        second = keyset_paginate(Product.objects.all(), first.next_cursor, 3)
+        back = keyset_paginate(Product.objects.all(), second.previous_cursor, 3)
+        self.assertEqual([p.pk for p in back], [p.pk for p in first])
+        self.assertFalse(back.has_previous)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        page = keyset_paginate(Product.objects.all(), 'not-a-cursor', 3)
+        self.assertFalse(page.has_previous)
+        self.assertEqual(len(page), 3)
+
+    def test_deep_pages_do_not_use_offset(self):
+        first = keyset_paginate(Product.objects.all(), None, 3)
+        with CaptureQueriesContext(connection) as ctx:
+            list(keyset_paginate(Product.objects.all(), first.next_cursor, 3))
+        self.assertNotIn('OFFSET', ctx.captured_queries[0]['sql'])
+
+    def test_shop_links_to_next_page(self):
+        cache.clear()
+        self.create_catalog(self.user.userprofile, 6, prefix='extra')
+        response = self.client.get(reverse('core:products'))
+        self.assertContains(response, 'cursor=')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('seller', 'seller@example.com', 'pass1234!').userprofile
+        self.shoes = Category.objects.create(name='Shoes')
+        self.hats = Category.objects.create(name='Hats')
+        self.red = Color.objects.create(name='Red')
+        self.blue = Color.objects.create(name='Blue')
+
+    def create_product(self, title, price, category, colors=(), tags=()):
+        product = Product.objects.create(user=self.owner, title=title, price=price, description='d', category=category)
+        product.color.add(*colors)
+        product.tags.add(*tags)
+        return product
+
+    def stored_counts(self):
+        return set(FacetCount.objects.filter(count__gt=0).values_list('facet', 'value', 'count'))
+
+    def test_counts_follow_product_changes(self):
+        boot = self.create_product('Boot', 45, self.shoes, [self.red], ['winter'])
+        self.create_product('Cap', 5, self.hats, [self.red, self.blue])
+        counts = facet_counts({})
+        self.assertEqual(counts[ProductFacet.COLOR], {str(self.red.pk): 2, str(self.blue.pk): 1})
+        self.assertEqual(counts[ProductFacet.PRICE], {'40-50': 1, '0-10': 1})
+
+        boot.price = 60
+        boot.save()
+        boot.color.remove(self.red)
+        boot.tags.clear()
+        counts = facet_counts({})
+        self.assertEqual(counts[ProductFacet.PRICE], {'50-': 1, '0-10': 1})
+        self.assertEqual(counts[ProductFacet.COLOR], {str(self.red.pk): 1, str(self.blue.pk): 1})
+        self.assertEqual(counts[ProductFacet.TAG], {})
+
+        boot.delete()
+        self.assertEqual(facet_counts({})[ProductFacet.CATEGORY], {str(self.hats.pk): 1})
+
+    def test_incremental_counts_match_rebuild(self):
+        product = self.create_product('Boot', 45, self.shoes, [self.red, self.blue], ['winter', 'sale'])
+        self.create_product('Sandal', 15, self.shoes, [self.blue], ['sale'])
+        product.tags.remove('winter')
+        incremental = self.stored_counts()
+        call_command('rebuild_facets', stdout=StringIO())
+        self.assertEqual(self.stored_counts(), incremental)
+
+    def test_filters_combine_across_facets(self):
+        self.create_product('Boot', 45, self.shoes, [self.red])
+        self.create_product('Sandal', 15, self.shoes, [self.blue])
+        self.create_product('Cap', 5, self.hats, [self.red])
+        params = QueryDict(f'category={self.shoes.pk}&color={self.red.pk}&color={self.blue.pk}')
+        result = faceted_search(Product.objects.all(), params)
+        self.assertEqual(sorted(result.queryset.values_list('title', flat=True)), ['Boot', 'Sandal'])
+        # Counts within a facet ignore that facet's own selection.
+        self.assertEqual(result.counts[ProductFacet.CATEGORY], {str(self.shoes.pk): 2, str(self.hats.pk): 1})
+
+    def test_selected_counts_are_cached_until_the_facet_index_changes(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            boot = self.create_product('Boot', 45, self.shoes, [self.red])
+        selection = {ProductFacet.COLOR: [str(self.red.pk), str(self.blue.pk)]}
+        counts = facet_counts(selection)
+        with self.captureOnCommitCallbacks(execute=True):
+            boot.description = 'Waterproof'
+            boot.save()
+            reviewer = User.objects.create_user('reviewer', password='pass1234!').userprofile
+            Review.objects.create(product=boot, user=reviewer, content='ok', rating=5)
+        with self.assertNumQueries(0):
+            self.assertEqual(facet_counts({ProductFacet.COLOR: [str(self.blue.pk), str(self.red.pk)]}), counts)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_product('Sandal', 15, self.shoes, [self.blue])
+        self.assertEqual(facet_counts(selection)[ProductFacet.CATEGORY], {str(self.shoes.pk): 2})
+
+    def test_shop_filters_by_price_range(self):
+        cache.clear()
+        self.create_product('Boot', 45, self.shoes)
+        self.create_product('Cap', 5, self.hats)
+        response = self.client.get(reverse('core:products'), {'price_range': '0-10'})
+        self.assertEqual([p.title for p in response.context['products']], ['Cap'])
+        self.assertContains(response, 'Less than $10 (1)')
+
+
+class TagPopularityTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('seller', 'seller@example.com', 'pass1234!').userprofile
+
+    def create_product(self, title, tags):
+        product = Product.objects.create(user=self.owner, title=title, price=10, description='d')
+        product.tags.add(*tags)
+        return product
+
+    def test_counts_follow_tag_changes(self):
+        first = self.create_product('Boot', ['winter', 'sale'])
+        self.create_product('Scarf', ['winter'])
+        self.assertEqual([tag.name for tag in popular_tags(5)], ['winter', 'sale'])
+        first.tags.remove('winter')
+        first.delete()
+        counts = dict(TagPopularity.objects.values_list('tag__name', 'count'))
+        self.assertEqual(counts, {'winter': 1, 'sale': 0})
+
+    def test_top_tags_is_a_single_query(self):
+        self.create_product('Boot', ['winter', 'sale', 'leather'])
+        with self.assertNumQueries(1):
+            popular_tags(5)
+
+    def test_reconcile_fixes_drift(self):
+        self.create_product('Boot', ['winter'])
+        TagPopularity.objects.update(count=7)
+        call_command('reconcile_tag_counts', stdout=StringIO())
+        self.assertEqual(TagPopularity.objects.get().count, 1)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('seller', 'seller@example.com', 'pass1234!').userprofile
+        self.product = Product.objects.create(user=self.owner, title='Boot', price=10, description='d')
+
+    def review(self, rating, product=None):
+        user = User.objects.create_user(f'reviewer{Review.objects.count()}', password='pass1234!').userprofile
+        return Review.objects.create(product=product or self.product, user=user, content='ok', rating=rating)
+
+    def test_reviews_update_aggregates(self):
+        self.review(5)
+        low = self.review(2)
+        self.review(5)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (3, 12))
+        self.assertAlmostEqual(self.product.rating_average, 4.0)
+        self.assertEqual((self.product.rating_5, self.product.rating_2), (2, 1))
+
+        low.delete()
+        self.product.refresh_from_db()
+        self.assertAlmostEqual(self.product.rating_average, 5.0)
+        self.assertEqual(self.product.rating_2, 0)
+
+    def test_last_review_deleted_resets_average(self):
+        self.review(3).delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_average), (0, 0))
+
+    def test_stale_product_save_keeps_aggregates(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.review(4)
+        stale.title = 'Leather boot'
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 1)
+
+    def test_recompute_matches_incremental(self):
+        for rating in (1, 3, 3, 5):
+            self.review(rating)
+        self.product.refresh_from_db()
+        incremental = [getattr(self.product, name) for name in Product.RATING_FIELDS]
+        Product.objects.update(review_count=0, rating_sum=0, rating_average=0)
+        recompute()
+        self.product.refresh_from_db()
+        self.assertEqual([getattr(self.product, name) for name in Product.RATING_FIELDS], incremental)
+
+    def test_shop_sorts_by_rating(self):
+        cache.clear()
+        other = Product.objects.create(user=self.owner, title='Cap', price=10, description='d')
+        self.review(2)
+        self.review(5, product=other)
+        response = self.client.get(reverse('core:products'), {'sort': 'rating'})
+        self.assertEqual([p.title for p in response.context['products']], ['Cap', 'Boot'])
+
+
+class SlugAllocationTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('seller', 'seller@example.com', 'pass1234!').userprofile
+
+    def create_product(self, title):
+        return Product.objects.create(user=self.owner, title=title, price=10, description='d')
+
+    def test_duplicates_get_increasing_suffixes(self):
+        slugs = [self.create_product('T-Shirt').slug for _ in range(12)]
+        self.assertEqual(slugs[:3], ['t-shirt', 't-shirt-1', 't-shirt-2'])
+        self.assertEqual(slugs[-1], 't-shirt-11')
+
+    def test_similar_slugs_are_not_mistaken_for_duplicates(self):
+        self.create_product('T-Shirt Blue')
+        self.assertEqual(self.create_product('T-Shirt').slug, 't-shirt')
+
+    def test_lookup_cost_does_not_grow_with_collisions(self):
+        for _ in range(25):
+            self.create_product('Mug')
+        with CaptureQueriesContext(connection) as ctx:
+            Product.next_free_slug('mug')
+        self.assertEqual(len(ctx), 1)
+        self.assertEqual(Product.next_free_slug('mug'), 'mug-25')
+
+    def test_conflicting_concurrent_save_retries(self):
+        self.create_product('Lamp')
+        original = Product.next_free_slug
+        stale = iter(['lamp'])
+
+        def racing_lookup(base_slug):
+            # First lookup returns a slug another request already took.
+            return next(stale, None) or original(base_slug)
+
+        with mock.patch.object(Product, 'next_free_slug', side_effect=racing_lookup):
+            product = self.create_product('Lamp')
+        self.assertEqual(product.slug, 'lamp-1')
+
+    def test_database_enforces_unique_slugs(self):
+        self.create_product('Vase')
+        with self.assertRaises(IntegrityError):
+            Product.objects.bulk_create([Product(user=self.owner, title='Vase', price=1, description='d', slug='vase')])
+
+
+class CartServiceTests(CatalogMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pass1234!')
+        self.profile = self.user.userprofile
+        self.products = self.create_catalog(self.profile, 3)
+        self.items = [CartItem.objects.create(user=self.profile, product=p, quantity=1) for p in self.products]
+        self.client.force_login(self.user)
+
+    def post_update(self, quantities):
+        data = {'update-cart': '', 'item_id': [str(pk) for pk in quantities]}
+        data.update({f'quantity[{pk}]': str(qty) for pk, qty in quantities.items()})
+        return self.client.post(reverse('core:view-cart'), data)
+
+    def test_update_is_a_single_bulk_write(self):
+        quantities = {item.id: 3 for item in self.items}
+        with CaptureQueriesContext(connection) as ctx:
+            cart.update_quantities(self.profile, quantities)
+        writes = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(set(CartItem.objects.values_list('quantity', flat=True)), {3})
+
+    def test_foreign_items_reject_the_whole_update(self):
+        stranger = User.objects.create_user('stranger', password='pass1234!').userprofile
+        foreign = CartItem.objects.create(user=stranger, product=self.products[0], quantity=1)
+        response = self.post_update({self.items[0].id: 5, foreign.id: 9})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(CartItem.objects.get(pk=self.items[0].id).quantity, 1)
+        self.assertEqual(CartItem.objects.get(pk=foreign.id).quantity, 1)
+
+    def test_invalid_quantity_is_rejected(self):
+        self.post_update({self.items[0].id: 0})
+        self.assertEqual(CartItem.objects.get(pk=self.items[0].id).quantity, 1)
+
+    def test_total_is_a_database_aggregate(self):
+        cart.update_quantities(self.profile, {self.items[0].id: 2})
+        expected = sum(item.product.price * (2 if item == self.items[0] else 1) for item in self.items)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.cart_total(self.profile), expected)
+
+    def test_remove_only_touches_own_items(self):
+        stranger = User.objects.create_user('stranger', password='pass1234!').userprofile
+        foreign = CartItem.objects.create(user=stranger, product=self.products[0])
+        response = self.client.post(reverse('core:view-cart'), {'remove-cart': foreign.id})
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(CartItem.objects.filter(pk=foreign.id).exists())
+
+
+class CartSummaryTests(CatalogMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pass1234!')
+        self.profile = self.user.userprofile
+        self.products = self.create_catalog(self.profile, 3)
+        self.color = Color.objects.first()
+        self.item = CartItem.objects.create(user=self.profile, product=self.products[0], color=self.color, quantity=2)
+
+    def cart_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in ctx.captured_queries if 'FROM "core_cartitem"' in q['sql']]
+
+    def test_pages_show_the_cart_from_the_cache(self):
+        self.client.force_login(self.user)
+        url = reverse('core:product_list')
+        response, queries = self.cart_queries(url)
+        self.assertContains(response, '<span class="cart-count">2</span>', html=True)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.cart_queries(url)
+        self.assertContains(response, '<span class="cart-count">2</span>', html=True)
+        self.assertEqual(queries, [])
+
+    def test_cart_writes_refresh_the_summary(self):
+        price = self.products[0].price
+        self.assertEqual(cart.cached_summary(self.profile), {'count': 1, 'items': 2, 'total': 2 * price})
+        cart.add_item(self.profile, self.products[0], self.color, quantity=1)
+        self.assertEqual(cart.cached_summary(self.profile)['items'], 3)
+        cart.update_quantities(self.profile, {self.item.pk: 5})
+        self.assertEqual(cart.cached_summary(self.profile)['items'], 5)
+        cart.remove_item(self.profile, self.item.pk)
+        self.assertEqual(cart.cached_summary(self.profile), {'count': 0, 'items': 0, 'total': 0})
+
+    def test_price_change_refreshes_carts_holding_the_product(self):
+        cart.cached_summary(self.profile)
+        self.products[0].price = 99
+        self.products[0].save()
+        self.assertEqual(cart.cached_summary(self.profile)['total'], 2 * 99)
+
+    def test_anonymous_cart_lives_in_the_session(self):
+        url = reverse('core:add-to-cart', kwargs={'product_slug': self.products[1].slug})
+        response = self.client.post(url, {'quantity': 3, 'color': self.color.pk})
+        self.assertRedirects(
+            response, reverse('core:product-details', kwargs={'product_slug': self.products[1].slug}),
+            fetch_redirect_response=False,
+        )
+        self.assertFalse(CartItem.objects.filter(product=self.products[1]).exists())
+        # The anonymous page cache is bypassed so the badge stays accurate.
+        with self.assertNumQueries(0):
+            summary = cart.session_summary(self.client.session)
+        self.assertEqual(summary, {'count': 1, 'items': 3, 'total': 3 * self.products[1].price})
+        self.assertContains(self.client.get(reverse('core:home')), '<span class="cart-count">3</span>', html=True)
+
+    def test_login_merges_the_session_cart(self):
+        session = self.client.session
+        cart.add_session_item(session, self.products[0], self.color, quantity=4)
+        cart.add_session_item(session, self.products[1], self.color, quantity=1)
+        other_color = Color.objects.create(name='Teal')
+        cart.add_session_item(session, self.products[2], other_color, quantity=1)
+        session.save()
+        cart.cached_summary(self.profile)
+
+        response = self.client.post(
+            reverse('core:login_register'), {'login': '', 'email_or_username': 'shopper', 'password': 'pass1234!'},
+        )
+        self.assertEqual(response.status_code, 302)
+        quantities = dict(CartItem.objects.filter(user=self.profile).values_list('product_id', 'quantity'))
+        # Same product and colour add up in the existing row; a colour the
+        # product is not offered in is dropped.
+        self.assertEqual(quantities, {self.products[0].pk: 6, self.products[1].pk: 1})
+        self.assertNotIn(cart.SESSION_KEY, self.client.session)
+        self.assertEqual(cart.cached_summary(self.profile)['items'], 7)
+
+    def test_merge_is_constant_in_queries(self):
+        session = {}
+        for product in self.products:
+            cart.add_session_item(session, product, self.color, quantity=2)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(cart.merge_session_cart(self.profile, session), 3)
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(statements, ['SELECT', 'SELECT', 'UPDATE', 'INSERT'])
+        self.assertEqual(CartItem.objects.filter(user=self.profile).count(), 3)
+
+
+class CheckoutTests(CatalogMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pass1234!')
+        self.profile = self.user.userprofile
+        self.products = self.create_catalog(self.profile, 3)
+        for quantity, product in enumerate(self.products, start=1):
+            CartItem.objects.create(user=self.profile, product=product, quantity=quantity)
+        self.client.force_login(self.user)
+
+    def place_order(self):
+        return self.client.post(reverse('core:checkout'), {
+            'street_address': '1 Main St', 'zip_code': '12345', 'country': 'US',
+            'payment_method': 'CreditCard',
+        })
+
+    def test_checkout_creates_one_order_for_the_whole_cart(self):
+        response = self.place_order()
+        order = Order.objects.get()
+        self.assertRedirects(
+            response, reverse('core:payment', kwargs={'payment_method': 'card', 'order_id': order.id}),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(order.lines.count(), 3)
+        self.assertEqual(order.total_price, sum(p.price * q for q, p in enumerate(self.products, start=1)))
+
+    def test_empty_cart_cannot_check_out(self):
+        CartItem.objects.all().delete()
+        response = self.client.get(reverse('core:checkout'))
+        self.assertRedirects(response, reverse('core:view-cart'))
+
+    @mock.patch('core.payments.create_session')
+    def test_payment_creates_one_session_with_every_line(self, create_session):
+        create_session.return_value = mock.Mock(id='cs_test_1', url='https://pay.example.com/cs_test_1')
+        self.place_order()
+        order = Order.objects.get()
+        response = self.client.get(reverse('core:payment', kwargs={'payment_method': 'card', 'order_id': order.id}))
+        self.assertRedirects(response, 'https://pay.example.com/cs_test_1', fetch_redirect_response=False)
+        create_session.assert_called_once()
+        self.assertEqual(len(create_session.call_args.args[0]['line_items']), 3)
+        order.refresh_from_db()
+        self.assertEqual(order.payment_session_id, 'cs_test_1')
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class WebhookTests(CatalogMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pass1234!')
+        self.profile = self.user.userprofile
+        self.products = self.create_catalog(self.profile, 2)
+        for product in self.products:
+            CartItem.objects.create(user=self.profile, product=product, quantity=2)
+        self.order = create_order(self.profile)
+        Order.objects.filter(pk=self.order.pk).update(payment_session_id='cs_test_1')
+
+    def deliver(self, event_id='evt_1', event_type='checkout.session.completed', secret='whsec_test', **session):
+        session = {
+            'id': 'cs_test_1', 'payment_status': 'paid',
+            'metadata': {'order_id': str(self.order.id)},
+            'customer_details': {'email': 'buyer@example.com'},
+            **session,
+        }
+        payload = json.dumps({'id': event_id, 'type': event_type, 'data': {'object': session}})
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            reverse('core:stripe-webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def test_endpoint_only_stores_the_event(self):
+        response = self.deliver()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PaymentEvent.objects.get().status, PaymentEvent.PENDING)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.order_status, 'Pending')
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_bad_signature_is_rejected(self):
+        response = self.deliver(secret='whsec_wrong')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_worker_completes_order(self):
+        late = CartItem.objects.create(user=self.profile, product=self.products[0], quantity=1)
+        self.deliver()
+        self.assertEqual(process_pending(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.order_status, 'Completed')
+        self.assertIsNotNone(self.order.completed_at)
+        self.assertEqual(self.order.payment.payment_amount, self.order.total_price)
+        self.assertEqual(list(CartItem.objects.values_list('id', flat=True)), [late.id])
+        self.assertEqual(PaymentEvent.objects.get().status, PaymentEvent.PROCESSED)
+        self.assertEqual(OutboundEmail.objects.get().to, ['buyer@example.com'])
+
+    def test_replays_and_duplicates_are_no_ops(self):
+        self.deliver()
+        self.deliver()
+        self.deliver(event_id='evt_2', event_type='checkout.session.async_payment_succeeded')
+        self.assertEqual(PaymentEvent.objects.count(), 2)
+        process_pending()
+        process_pending()
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_batch_runs_in_constant_queries(self):
+        self.deliver(event_id='evt_1')
+        with CaptureQueriesContext(connection) as small:
+            process_pending()
+        for n in range(2, 12):
+            self.deliver(event_id=f'evt_{n}', event_type='checkout.session.expired')
+        self.deliver(event_id='evt_paid', event_type='checkout.session.completed')
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(process_pending(), 11)
+        self.assertLessEqual(len(large), len(small))
+        self.assertEqual(PaymentEvent.objects.filter(status=PaymentEvent.IGNORED).count(), 10)
+
+    def test_unknown_order_is_not_completed(self):
+        self.deliver(metadata={'order_id': '999'})
+        process_pending()
+        event = PaymentEvent.objects.get()
+        self.assertEqual(event.status, PaymentEvent.IGNORED)
+        self.assertEqual(CartItem.objects.count(), 2)
+
+
+class OutboxTests(TestCase):
+    def queue(self, count):
+        return [enqueue(f'Subject {n}', 'Body', [f'user{n}@example.com']) for n in range(count)]
+
+    def test_password_reset_is_queued_not_sent(self):
+        User.objects.create_user('forgetful', 'forgetful@example.com', 'pass1234!')
+        form = OutboxPasswordResetForm({'email': 'forgetful@example.com'})
+        self.assertTrue(form.is_valid())
+        form.save(domain_override='shop.example.com', email_template_name='accounts/password_reset_email.html')
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(OutboundEmail.objects.get().to, ['forgetful@example.com'])
+        self.assertEqual(send_pending(), 1)
+        self.assertIn('shop.example.com', mail.outbox[0].body)
+
+    def test_batch_reuses_one_connection(self):
+        self.queue(5)
+        with mock.patch('core.outbox.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(send_pending(batch_size=10), 5)
+        connect.assert_called_once()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_failed_send_backs_off_then_retries(self):
+        email, = self.queue(1)
+        now = timezone.now()
+        with mock.patch.object(LocmemBackend, 'send_messages', side_effect=SMTPException('down')):
+            self.assertEqual(send_pending(now=now), 0)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.PENDING, 1))
+        self.assertEqual(email.next_attempt_at, now + backoff(1))
+        self.assertEqual(send_pending(now=now), 0)
+        self.assertEqual(send_pending(now=now + backoff(1)), 1)
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.SENT)
+
+    def test_gives_up_after_max_attempts(self):
+        email, = self.queue(1)
+        email.attempts = MAX_ATTEMPTS - 1
+        email.save()
+        with mock.patch.object(LocmemBackend, 'send_messages', side_effect=SMTPException('down')):
+            send_pending()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+
+
+def jpeg_upload(name='photo.jpg', size=(700, 900)):
+    buffer = BytesIO()
+    PILImage.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageVariantTests(CatalogMixin, TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.profile = User.objects.create_user('seller', password='pass1234!').userprofile
+        self.product, = self.create_catalog(self.profile, 1)
+        # The fixture's images point at files that were never written.
+        ImageVariantJob.objects.all().delete()
+
+    def add_image(self):
+        image = Image.objects.create(product=self.product, images=jpeg_upload())
+        process_image_variants()
+        image.refresh_from_db()
+        return image
+
+    def test_upload_only_queues_the_work(self):
+        with mock.patch('core.images.generate') as generate:
+            image = Image.objects.create(product=self.product, images=jpeg_upload())
+        generate.assert_not_called()
+        image.refresh_from_db()
+        self.assertEqual(image.variants, {})
+        job = ImageVariantJob.objects.get(object_id=image.pk)
+        self.assertEqual((job.content_type.model_class(), job.status), (Image, ImageVariantJob.PENDING))
+        self.assertEqual(process_image_variants(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageVariantJob.PROCESSED)
+        self.assertEqual(process_image_variants(), 0)
+
+    def test_failed_jobs_are_retried_then_given_up(self):
+        image = Image.objects.create(product=self.product, images=jpeg_upload())
+        now = timezone.now()
+        with mock.patch('core.images.generate', side_effect=OSError('broken file')), self.assertLogs('core.images', 'ERROR'):
+            for attempt in range(5):
+                process_image_variants(now=now + timedelta(hours=attempt))
+        job = ImageVariantJob.objects.get(object_id=image.pk)
+        self.assertEqual((job.status, job.attempts), (ImageVariantJob.FAILED, 5))
+        self.assertIn('broken file', job.last_error)
+
+    def test_upload_generates_webp_and_jpeg_widths(self):
+        image = self.add_image()
+        self.assertEqual(image.variants['source'], image.images.name)
+        self.assertEqual([width for width, _ in image.variants['webp']], [160, 320, 480, 640])
+        for width, name in image.variants['jpeg']:
+            self.assertTrue(default_storage.exists(name))
+            with default_storage.open(name) as f:
+                self.assertEqual(PILImage.open(f).width, width)
+
+    def test_picture_tag_renders_srcset(self):
+        image = self.add_image()
+        html = Template('{% load responsive_images %}{% picture image sizes="50vw" class="product-image" %}').render(
+            Context({'image': image})
+        )
+        self.assertIn('<source type="image/webp" srcset="/media/variants/product-images/', html)
+        self.assertIn(' 640w"', html)
+        self.assertIn('sizes="50vw"', html)
+        self.assertIn('width="700"', html)
+        self.assertEqual(Template('{% load responsive_images %}{% picture image %}').render(Context({'image': None})), '')
+
+    def test_picture_tag_falls_back_to_the_original(self):
+        image = self.add_image()
+        Image.objects.filter(pk=image.pk).update(variants={})
+        image.refresh_from_db()
+        html = Template('{% load responsive_images %}{% picture image %}').render(Context({'image': image}))
+        self.assertEqual(html, f'<img src="{image.images.url}" alt="" decoding="async" loading="lazy">')
+
+    def test_backfill_regenerates_missing_variants(self):
+        image = self.add_image()
+        Image.objects.exclude(pk=image.pk).delete()
+        Image.objects.filter(pk=image.pk).update(variants={})
+        updated, errors = backfill(Image, workers=1)
+        self.assertEqual((updated, errors), (1, []))
+        image.refresh_from_db()
+        self.assertEqual(image.variants['source'], image.images.name)
+        self.assertEqual(backfill(Image, workers=1), (0, []))
+
+    def test_delete_removes_variant_files(self):
+        image = self.add_image()
+        names = [name for _, name in image.variants['webp']]
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+
+class UploadStorageTests(CatalogMixin, TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.profile = User.objects.create_user('seller', password='pass1234!').userprofile
+        self.product, = self.create_catalog(self.profile, 1)
+        # The fixture's images point at files that were never written.
+        ImageVariantJob.objects.all().delete()
+
+    def test_identical_uploads_are_stored_once(self):
+        upload = jpeg_upload()
+        digest = hashlib.sha256(upload.read()).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Image.objects.create(product=self.product, images=jpeg_upload('a.jpg'))
+            second = Image.objects.create(product=self.product, images=jpeg_upload('b.JPG'))
+        self.assertEqual(first.images.name, f'product-images/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(second.images.name, first.images.name)
+        self.assertEqual(default_storage.listdir(f'product-images/{digest[:2]}')[1], [f'{digest}.jpg'])
+
+    def test_shared_file_keeps_its_variants_until_the_last_reference(self):
+        first = Image.objects.create(product=self.product, images=jpeg_upload())
+        process_image_variants()
+        second = Image.objects.create(product=self.product, images=jpeg_upload())
+        with mock.patch('core.images.generate') as generate:
+            process_image_variants()
+        generate.assert_not_called()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.variants, first.variants)
+        names = [name for _, name in first.variants['webp']]
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_dimensions_come_from_the_header(self):
+        data = jpeg_upload(size=(1920, 600)).read()
+        truncated = SimpleUploadedFile('cut.jpg', data[:len(data) // 3])
+        self.assertEqual(image_dimensions(truncated), (1920, 600))
+        with mock.patch('PIL.ImageFile.ImageFile.load') as load:
+            validate_slideshow_image_dimensions(truncated)
+            with self.assertRaises(ValidationError):
+                validate_product_image_dimensions(truncated)
+        load.assert_not_called()
+        self.assertEqual(truncated.tell(), 0)
+
+    def test_upload_handler_hashes_while_streaming(self):
+        data = jpeg_upload().read()
+        handler = HashingFileUploadHandler()
+        handler.new_file('images', 'photo.jpg', 'image/jpeg', len(data))
+        for start in range(0, len(data), 1024):
+            handler.receive_data_chunk(data[start:start + 1024], start)
+        upload = handler.file_complete(len(data))
+        self.addCleanup(upload.close)
+        self.assertEqual(upload.content_hash, hashlib.sha256(data).hexdigest())
+        self.assertTrue(os.path.exists(upload.temporary_file_path()))
+
+
+class StaticAssetTests(TestCase):
+    CSS = 'body { background: url("../img/dot.png"); }\n' + '.rule { color: #123456; margin: 0 auto; }\n' * 200
+
+    def setUp(self):
+        source, root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for directory in (source, root):
+            self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        os.makedirs(os.path.join(source, 'css'))
+        os.makedirs(os.path.join(source, 'img'))
+        with open(os.path.join(source, 'css', 'site.css'), 'w') as f:
+            f.write(self.CSS)
+        with open(os.path.join(source, 'img', 'dot.png'), 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n' + bytes(64))
+        self.root = root
+        self.enterContext(override_settings(
+            STATICFILES_DIRS=[source], STATIC_ROOT=root,
+            STORAGES={**settings.STORAGES, 'staticfiles': {'BACKEND': 'core.staticfiles.CompressedManifestStaticFilesStorage'}},
+        ))
+        call_command('collectstatic', '--noinput', verbosity=0)
+        self.hashed = staticfiles_storage.stored_name('css/site.css')
+
+    def get(self, name, **headers):
+        return self.client.get(f'/static/{name}', **headers)
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        self.assertRegex(self.hashed, r'^css/site\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.root, self.hashed + '.gz')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'css/site.css.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'img/dot.png.gz')))
+
+    def test_hashed_asset_is_immutable_and_compressed(self):
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertIn(staticfiles_storage.stored_name('img/dot.png'), body)
+
+    def test_identity_when_compression_is_not_accepted(self):
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(int(response['Content-Length']), os.path.getsize(os.path.join(self.root, self.hashed)))
+
+    def test_unhashed_name_revalidates(self):
+        response = self.get('css/site.css')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        again = self.get('css/site.css', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_missing_and_escaping_paths_fall_through(self):
+        self.assertEqual(self.get('css/missing.css').status_code, 404)
+        self.assertEqual(self.get('../settings.py').status_code, 404)
+
+    async def test_async_requests_stream_assets(self):
+        response = await self.async_client.get(f'/static/{self.hashed}', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertIn('.rule', gzip.decompress(body).decode())
+
+    def test_middleware_stack_runs_natively_under_asgi(self):
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            ASGIHandler()
+            logging.getLogger('django.request').debug('loaded')
+        self.assertFalse([line for line in logs.output if 'adapted for middleware' in line])
+
+    def test_missing_manifest_entry_raises(self):
+        with self.assertRaises(ValueError):
+            staticfiles_storage.stored_name('css/never-collected.css')
+
+    def test_size_report(self):
+        out = StringIO()
+        call_command('static_size_report', limit=0, stdout=out)
+        self.assertIn(self.hashed, out.getvalue())
+        self.assertIn('saved', out.getvalue())
+
+
+class SessionAuthTests(CatalogMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('regular', 'regular@example.com', 'pass1234!')
+        self.create_catalog(self.user.userprofile, 3)
+        CartItem.objects.create(user=self.user.userprofile, product=Product.objects.first())
+        self.client.force_login(self.user)
+
+    def test_backend_loads_profile_with_the_user(self):
+        with self.assertNumQueries(1):
+            user = ProfileBackend().get_user(self.user.pk)
+            self.assertEqual(user.userprofile.pk, self.user.userprofile.pk)
+
+    def test_authenticated_pages_skip_session_and_profile_queries(self):
+        for name in ('core:view-cart', 'core:products', 'core:checkout'):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse(name))
+            sql = [query['sql'] for query in ctx.captured_queries]
+            self.assertFalse([q for q in sql if '"django_session"' in q], name)
+            self.assertFalse([q for q in sql if q.startswith('SELECT') and 'FROM "core_userprofile"' in q], name)
+
+    def test_benchmark_reports_every_configuration(self):
+        out = StringIO()
+        call_command('benchmark_sessions', requests=1, stdout=out)
+        for name in ('db sessions, plain auth', 'cached_db + locmem', 'cached_db + file'):
+            self.assertIn(name, out.getvalue())
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pass1234!')
+        self.url = reverse('core:login_register')
+
+    def attempt(self, identifier, password, ip='10.0.0.1', **headers):
+        return self.client.post(
+            self.url, {'login': '', 'email_or_username': identifier, 'password': password}, REMOTE_ADDR=ip,
+            headers=headers,
+        )
+
+    def test_username_or_email_resolve_in_one_query(self):
+        for identifier in ('shopper', 'shopper@example.com'):
+            self.client.logout()
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.attempt(identifier, 'pass1234!')
+            self.assertRedirects(response, reverse('core:home'), fetch_redirect_response=False)
+            lookups = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and 'FROM "auth_user"' in q['sql']]
+            self.assertEqual(len(lookups), 1, identifier)
+
+    def test_username_match_wins_over_email(self):
+        other = User.objects.create_user('shopper@example.com', 'other@example.com', 'other-pass!')
+        user = EmailOrUsernameBackend().authenticate(None, username='shopper@example.com', password='other-pass!')
+        self.assertEqual(user, other)
+
+    def test_invalid_credentials_show_one_message(self):
+        for identifier, password in (('shopper', 'wrong'), ('nobody', 'pass1234!')):
+            response = self.attempt(identifier, password)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['error_message'], 'Invalid username or password.')
+
+    @override_settings(LOGIN_THROTTLE_PER_ACCOUNT=(2, 300))
+    def test_account_throttle_skips_hashing(self):
+        self.attempt('shopper', 'wrong', ip='10.0.0.1')
+        self.attempt('Shopper', 'wrong', ip='10.0.0.2')
+        with mock.patch('core.backends.verify_password') as verify, mock.patch('core.backends.make_password') as make:
+            response = self.attempt('shopper', 'pass1234!', ip='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Too many login attempts', response.context['error_message'])
+        verify.assert_not_called()
+        make.assert_not_called()
+
+    @override_settings(LOGIN_THROTTLE_PER_IP=(3, 60))
+    def test_ip_throttle_spans_accounts(self):
+        for identifier in ('a', 'b', 'c'):
+            self.assertEqual(self.attempt(identifier, 'wrong').status_code, 200)
+        self.assertEqual(self.attempt('shopper', 'pass1234!').status_code, 429)
+        self.assertEqual(self.attempt('shopper', 'pass1234!', ip='10.0.0.9').status_code, 302)
+
+    @override_settings(LOGIN_THROTTLE_PER_IP=(2, 60), LOGIN_THROTTLE_IP_HEADER='X-Forwarded-For')
+    def test_ip_throttle_reads_the_client_behind_a_proxy(self):
+        proxy = '10.0.0.254'
+        for identifier in ('a', 'b'):
+            self.attempt(identifier, 'wrong', ip=proxy, x_forwarded_for='203.0.113.7')
+        self.assertEqual(self.attempt('shopper', 'pass1234!', ip=proxy, x_forwarded_for='203.0.113.7').status_code, 429)
+        # A forged leftmost entry does not buy a fresh bucket.
+        forged = self.attempt('shopper', 'pass1234!', ip=proxy, x_forwarded_for='198.51.100.1, 203.0.113.7')
+        self.assertEqual(forged.status_code, 429)
+        self.assertEqual(self.attempt('shopper', 'pass1234!', ip=proxy, x_forwarded_for='203.0.113.8').status_code, 302)
+
+    @override_settings(LOGIN_THROTTLE_PER_ACCOUNT=(2, 300))
+    def test_successful_login_refills_the_account_bucket(self):
+        self.attempt('shopper', 'wrong')
+        self.assertEqual(self.attempt('shopper', 'pass1234!').status_code, 302)
+        self.client.logout()
+        self.attempt('shopper', 'wrong')
+        self.assertEqual(self.attempt('shopper', 'pass1234!').status_code, 302)
+
+    def test_registration_creates_profile_and_logs_in(self):
+        response = self.client.post(self.url, {
+            'register': '', 'username': 'newcomer', 'email': 'new@example.com',
+            'password1': 'a-Long-pass-123', 'password2': 'a-Long-pass-123',
+        })
+        self.assertRedirects(response, reverse('core:home'), fetch_redirect_response=False)
+        user = User.objects.get(username='newcomer')
+        self.assertTrue(user.check_password('a-Long-pass-123'))
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.pk)
+
+    def test_bucket_refills_over_time(self):
+        state = None
+        for _ in range(2):
+            allowed, state = throttle.spend(state, 2, 60, now=0)
+            self.assertTrue(allowed)
+        self.assertFalse(throttle.spend(state, 2, 60, now=10)[0])
+        allowed, state = throttle.spend(state, 2, 60, now=30)
+        self.assertTrue(allowed)
+        self.assertAlmostEqual(state[0], 0)
+        self.assertEqual(throttle.spend(None, 2, 60, now=0)[1], (1, 0))
+
+    def test_async_login_hashes_off_the_event_loop(self):
+        def verify(password, encoded):
+            with self.assertRaises(RuntimeError):
+                asyncio.get_running_loop()
+            return True, False
+
+        request = mock.Mock(META={'REMOTE_ADDR': '10.0.0.1'})
+        with mock.patch('core.backends.verify_password', side_effect=verify) as patched:
+            user = async_to_sync(aauthenticate)(request, username='shopper@example.com', password='anything')
+        patched.assert_called_once()
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.backend, 'core.backends.EmailOrUsernameBackend')
+
+
+class DatabaseRoutingTests(TestCase):
+    router = PrimaryReplicaRouter()
+
+    def test_catalog_reads_go_to_the_replica(self):
+        with mock.patch.object(connections['default'], 'in_atomic_block', False):
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.assertEqual(self.router.db_for_read(Tag), 'replica')
+            self.assertEqual(self.router.db_for_read(CartItem), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_reads_inside_a_primary_transaction_stay_on_the_primary(self):
+        self.assertTrue(connections['default'].in_atomic_block)
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_writes_and_migrations_use_the_primary(self):
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'core'))
+        self.assertFalse(self.router.allow_migrate('replica', 'core'))
+
+    def test_sqlite_is_configured_for_concurrency(self):
+        options = settings.DATABASES['default']['OPTIONS']
+        self.assertIn('journal_mode=WAL', options['init_command'])
+        self.assertEqual(options['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('query_only=ON', settings.DATABASES['replica']['OPTIONS']['init_command'])
+
+    def test_concurrency_benchmark_runs(self):
+        out = StringIO()
+        call_command('benchmark_sqlite_concurrency', readers=2, writers=1, duration=0.2, products=50, stdout=out)
+        self.assertIn('rollback journal', out.getvalue())
+        self.assertIn('WAL + tuned pragmas', out.getvalue())
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # Outside TestCase's wrapping transaction, so the router's replica path runs for real.
+    databases = {'default', 'replica'}
+
+    def test_catalog_reads_outside_a_transaction_use_the_replica(self):
+        owner = User.objects.create_user('seller').userprofile
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['replica']) as replica:
+            product = Product.objects.create(user=owner, title='Boot', price=10, description='d')
+            self.assertEqual(list(Product.objects.values_list('title', flat=True)), ['Boot'])
+            self.assertFalse(CartItem.objects.filter(user=owner).exists())
+        replica_sql = [query['sql'] for query in replica.captured_queries]
+        primary_sql = [query['sql'] for query in primary.captured_queries]
+        self.assertTrue(any(sql.startswith('SELECT') and '"core_product"' in sql for sql in replica_sql))
+        self.assertFalse([sql for sql in replica_sql if not sql.startswith('SELECT')])
+        self.assertTrue(any(sql.startswith('INSERT INTO "core_product"') for sql in primary_sql))
+        self.assertTrue(any('"core_cartitem"' in sql for sql in primary_sql))
+        self.assertEqual(Product.objects.get(pk=product.pk)._state.db, 'replica')
+        with transaction.atomic():
+            self.assertEqual(Product.objects.get(pk=product.pk)._state.db, 'default')
+
+
+class InstrumentationTests(CatalogMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.create_catalog(User.objects.create_user('seller').userprofile, 3)
+
+    def timings(self, response):
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            entries[name] = dict(param.split('=', 1) for param in params)
+        return entries
+
+    def test_server_timing_reports_queries_and_templates(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('core:products'))
+        timing = self.timings(response)
+        self.assertEqual(timing['db']['desc'], f'"{len(ctx)} queries"')
+        self.assertGreater(float(timing['tpl']['dur']), 0)
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['view']['dur']))
+
+    def test_structured_request_log(self):
+        with self.assertLogs('core.requests', 'INFO') as logs:
+            self.client.get(reverse('core:products'))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'core:products')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+
+    def test_duplicate_and_similar_queries_are_counted(self):
+        metrics = RequestMetrics()
+        for params in ((1,), (1,), (2,), (3,)):
+            metrics.add_query('default', 'SELECT * FROM core_product WHERE id = %s', params, 0.001)
+        self.assertEqual(metrics.duplicate_queries, 1)
+        self.assertEqual(metrics.similar_queries, 2)
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged(self):
+        with self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('core:products'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['event'], record['view']), ('slow_query', 'core:products'))
+
+    def adapted_middleware(self):
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            ASGIHandler()
+            logging.getLogger('django.request').debug('loaded')
+        return [line for line in logs.output if 'adapted for middleware core.' in line]
+
+    def test_metrics_middleware_runs_natively_under_asgi(self):
+        self.assertFalse([line for line in self.adapted_middleware() if 'RequestMetricsMiddleware' in line])
+
+    async def test_async_requests_are_measured(self):
+        response = await self.async_client.get(reverse('core:products'))
+        timing = self.timings(response)
+        self.assertNotEqual(timing['db']['desc'], '"0 queries"')
+        self.assertIn('core:products', registry.histograms)
+
+    def test_metrics_endpoint_exports_histograms_per_view(self):
+        self.client.get(reverse('core:products'))
+        self.client.get(reverse('core:products'))
+        with self.settings(METRICS_TOKEN='scrape-me'):
+            response = self.client.get(reverse('core:metrics'), headers={'Authorization': 'Bearer scrape-me'})
+        body = response.content.decode()
+        self.assertIn('core_request_duration_seconds_bucket{view="core:products",le="+Inf"} 2', body)
+        self.assertIn('core_request_queries_count{view="core:products"} 2', body)
+        self.assertIn('core_responses_total{view="core:products",status="200"} 2', body)
+        self.assertNotIn('view="core:metrics"', body)
+
+    def test_metrics_endpoint_needs_the_token_or_staff(self):
+        url = reverse('core:metrics')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.settings(METRICS_TOKEN='scrape-me'):
+            self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer wrong'}).status_code, 404)
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer '}).status_code, 404)
+        self.client.force_login(User.objects.create_user('ops', 'ops@example.com', 'pass1234!', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class PaymentClientTests(CatalogMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = start_in_thread(latency=0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.shutdown()
+        cls.stub.server_close()
+        payments.reset_client()
+        super().tearDownClass()
+
+    def setUp(self):
+        payments.reset_client()
+        self.user = User.objects.create_user('payer', 'payer@example.com', 'pass1234!')
+        self.profile = self.user.userprofile
+        for product in self.create_catalog(self.profile, 2):
+            CartItem.objects.create(user=self.profile, product=product, quantity=2)
+        self.client.force_login(self.user)
+
+    def test_checkout_round_trip_through_the_provider(self):
+        with self.settings(STRIPE_API_BASE=self.stub.base_url):
+            self.client.post(reverse('core:checkout'), {
+                'street_address': '1 Main St', 'zip_code': '12345', 'country': 'US',
+                'payment_method': 'CreditCard',
+            })
+            order = Order.objects.get()
+            response = self.client.get(reverse('core:payment', kwargs={'payment_method': 'card', 'order_id': order.id}))
+            order.refresh_from_db()
+            self.assertTrue(order.payment_session_id.startswith('cs_stub_'))
+            self.assertTrue(response['Location'].endswith(order.payment_session_id))
+            session = self.stub.sessions[order.payment_session_id]
+            self.assertEqual(session['amount_total'], order.total_price * 100)
+            self.assertEqual(session['metadata']['order_id'], str(order.id))
+
+    def test_provider_calls_share_one_client(self):
+        with self.settings(STRIPE_API_BASE=self.stub.base_url):
+            self.assertIs(payments.get_client(), payments.get_client())
+
+    def test_concurrent_calls_do_not_serialize(self):
+        async def create_many():
+            calls = [payments.acreate_session({'mode': 'payment', 'metadata': {'order_id': str(n)}}) for n in range(5)]
+            return await asyncio.gather(*calls)
+
+        with self.settings(STRIPE_API_BASE=self.stub.base_url, STRIPE_MAX_NETWORK_RETRIES=0):
+            started = time.monotonic()
+            sessions = async_to_sync(create_many)()
+            elapsed = time.monotonic() - started
+        self.assertEqual(len({session.id for session in sessions}), 5)
+        self.assertLess(elapsed, 5 * self.stub.latency)
+
+
+class QueryPlanTests(CatalogMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', 'shopper@example.com', 'pass1234!')
+        self.profile = self.user.userprofile
+        self.product = self.create_catalog(self.profile, 1)[0]
+
+    def test_hot_queries_use_an_index(self):
+        scans = {name: tables for name, _, tables in queryplans.check() if tables}
+        self.assertEqual(scans, {})
+
+    def test_category_rows_are_read_in_order_from_the_index(self):
+        plan = Product.objects.filter(category_id=self.product.category_id).order_by('-created_at', '-id')[:12].explain()
+        self.assertIn('product_category_newest_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_category_products_are_limited_per_category(self):
+        self.create_catalog(self.profile, 15, prefix='big')
+        with CaptureQueriesContext(connection) as ctx:
+            categories = Category.objects.with_newest_products(12)
+        self.assertEqual([len(category.catalog_products) for category in categories], [1, 12])
+        big = categories[1].catalog_products
+        self.assertEqual(big, sorted(big, key=lambda p: (p.created_at, p.id), reverse=True))
+        product_queries = [q['sql'] for q in ctx.captured_queries if 'FROM "core_product"' in q['sql'] and 'core_image' not in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertNotIn('ROW_NUMBER', product_queries[0])
+
+    def test_more_categories_than_a_compound_select_allows(self):
+        Category.objects.bulk_create(Category(name=f'extra {n}') for n in range(MAX_COMPOUND_SELECT + 10))
+        last = Category.objects.order_by('pk').last()
+        Product.objects.filter(pk=self.product.pk).update(category=last)
+        with CaptureQueriesContext(connection) as ctx:
+            categories = Category.objects.with_newest_products(12)
+        self.assertEqual(len(categories), MAX_COMPOUND_SELECT + 11)
+        self.assertEqual([p.pk for p in categories[-1].catalog_products], [self.product.pk])
+        self.assertEqual(sum(len(category.catalog_products) for category in categories), 1)
+        self.assertEqual(len([q for q in ctx.captured_queries if 'UNION ALL' in q['sql']]), 2)
+
+    def test_full_scans_are_detected(self):
+        plan = '2 0 0 SCAN auth_user\n8 0 0 SCAN core_product USING INDEX product_newest_idx\n9 0 0 SCAN CONSTANT ROW'
+        self.assertEqual(queryplans.full_scans(plan, limited=True), ['auth_user'])
+        # Without a LIMIT, or with a sort in front of it, the index is read to the end.
+        self.assertEqual(queryplans.full_scans(plan), ['auth_user', 'core_product'])
+        sorted_plan = '3 0 0 SCAN core_product USING COVERING INDEX sqlite_autoindex_core_product_1\n9 0 0 USE TEMP B-TREE FOR ORDER BY'
+        self.assertEqual(queryplans.full_scans(sorted_plan, limited=True), ['core_product'])
+        self.assertEqual(queryplans.full_scans('Seq Scan on core_review  (cost=0.00..1.01 rows=1)'), ['core_review'])
+
+    def test_command_fails_on_a_full_scan(self):
+        slow = (('unindexed', lambda: Product.objects.filter(description='x')),)
+        with mock.patch.object(queryplans, 'HOT_QUERIES', slow), self.assertRaises(CommandError):
+            call_command('check_query_plans', stdout=StringIO())
+
+    def test_cart_item_is_unique_per_product_and_colour(self):
+        color = self.product.color.get()
+        CartItem.objects.create(user=self.profile, product=self.product, color=color)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(user=self.profile, product=self.product, color=color)
+
+    def test_one_review_per_user_and_product(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Review.objects.create(product=self.product, user=self.profile, content='Again', rating=5)
+        self.client.force_login(self.user)
+        url = reverse('core:product-details', kwargs={'product_slug': self.product.slug})
+        response = self.client.post(url, {'content': 'Again', 'rating': 5})
+        self.assertRedirects(response, url)
+        self.assertEqual(Review.objects.filter(product=self.product).count(), 1)
+
+    def test_new_checkout_address_replaces_the_default(self):
+        Address.objects.create(user=self.profile, street_address='Old St', zip_code='1', country='US', default=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Address.objects.create(user=self.profile, street_address='Other St', zip_code='2', country='US', default=True)
+        CartItem.objects.create(user=self.profile, product=self.product)
+        self.client.force_login(self.user)
+        self.client.post(reverse('core:checkout'), {
+            'street_address': 'New St', 'zip_code': '3', 'country': 'US', 'payment_method': 'CreditCard',
+        })
+        self.assertEqual(Address.objects.get(user=self.profile, default=True).street_address, 'New St')
+        self.assertEqual(Address.objects.filter(user=self.profile).count(), 2)
+
+
+class RelatedProductTests(CatalogMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('seller', 'seller@example.com', 'pass1234!').userprofile
+        self.products = self.create_catalog(self.owner, 6)
+        for product, tags in zip(self.products, (['wool', 'winter'], ['wool', 'winter'], ['wool'], ['denim'], ['denim'], ['linen'])):
+            product.tags.add(*tags)
+
+    def buy_together(self, *products):
+        order = Order.objects.create(user=self.owner, order_status='Completed', completed_at=timezone.now())
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, product=p, title=p.title, unit_price=p.price, quantity=1) for p in products
+        )
+
+    def neighbours(self, product):
+        return list(RelatedProduct.objects.filter(product=product).order_by('rank').values_list('related_id', flat=True))
+
+    def test_shared_tags_rank_first(self):
+        recommendations.build(top_k=3)
+        first, second, third = self.products[:3]
+        self.assertEqual(self.neighbours(first)[:2], [second.pk, third.pk])
+        self.assertEqual(self.neighbours(self.products[3])[0], self.products[4].pk)
+        self.assertNotIn(first.pk, self.neighbours(first))
+        self.assertTrue(all(len(self.neighbours(p)) <= 3 for p in self.products))
+
+    def test_co_purchases_lift_a_product(self):
+        self.buy_together(self.products[0], self.products[5])
+        self.buy_together(self.products[0], self.products[5])
+        recommendations.build()
+        self.assertEqual(self.neighbours(self.products[0])[0], self.products[5].pk)
+        self.assertIn(self.products[0].pk, self.neighbours(self.products[5]))
+
+    def test_incremental_refresh_only_touches_affected_products(self):
+        recommendations.build()
+        untouched = list(RelatedProduct.objects.filter(product=self.products[5]).values_list('pk', flat=True))
+        newcomer = Product.objects.create(user=self.owner, title='Denim jacket', price=40, description='Denim')
+        newcomer.tags.add('denim')
+        refreshed, _ = recommendations.build(changed={newcomer.pk})
+        # The new product plus the two it shares a tag with.
+        self.assertEqual(refreshed, 3)
+        self.assertIn(newcomer.pk, self.neighbours(self.products[3]))
+        self.assertEqual(list(RelatedProduct.objects.filter(product=self.products[5]).values_list('pk', flat=True)), untouched)
+
+    def test_orders_count_from_when_they_complete(self):
+        first, last = self.products[0], self.products[5]
+        order = Order.objects.create(user=self.owner)
+        OrderLine.objects.create(order=order, product=first, title=first.title, unit_price=first.price, quantity=1)
+        OrderLine.objects.create(order=order, product=last, title=last.title, unit_price=last.price, quantity=1)
+        since = timezone.now()
+        self.assertEqual(recommendations.changed_since(since), set())
+        Order.objects.filter(pk=order.pk).update(created_at=since - timedelta(days=1))
+        order.refresh_from_db()
+        order.order_status, order.completed_at = 'Completed', since + timedelta(seconds=1)
+        order.save()
+        self.assertEqual(recommendations.changed_since(since), {first.pk, last.pk})
+
+    def test_detail_page_reads_neighbours_in_one_query(self):
+        recommendations.build()
+        url = reverse('core:product-details', kwargs={'product_slug': self.products[0].slug})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        related = [q['sql'] for q in ctx.captured_queries if '"core_relatedproduct"' in q['sql']]
+        self.assertEqual(len(related), 1)
+        self.assertEqual([p.pk for p in response.context['related_products']], self.neighbours(self.products[0]))
+        self.assertContains(response, self.products[1].title[:20])
+
+    def test_command_refreshes_since_a_time(self):
+        out = StringIO()
+        call_command('build_related_products', since='2000-01-01T00:00:00Z', stdout=out)
+        self.assertIn('for 6 products', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('build_related_products', since='yesterday')
+
+
+class SeedingTests(TestCase):
+    def snapshot(self, seeder):
+        first = seeder.first_product
+        return {
+            'products': list(Product.objects.order_by('pk').values_list(
+                'slug', 'price', 'category_id', 'user_id', 'review_count', 'created_at',
+            )),
+            'reviews': list(Review.objects.order_by('product_id', 'user_id').values_list('product_id', 'user_id', 'rating', 'created_at')),
+            'colors': list(Product.color.through.objects.order_by('product_id', 'color_id').values_list('product_id', 'color_id')),
+            'tags': sorted(TaggedItem.objects.filter(object_id__gte=first).values_list('object_id', 'tag__name')),
+            'carts': sorted(CartItem.objects.values_list('user_id', 'product_id', 'color_id', 'quantity')),
+            'orders': list(Order.objects.order_by('pk').values_list(
+                'pk', 'user_id', 'total_price', 'order_status', 'created_at', 'completed_at',
+            )),
+            'users': list(User.objects.filter(username__startswith=seeder.prefix).order_by('pk').values_list('username', 'date_joined')),
+        }
+
+    def seed(self, seed=7, **options):
+        seeder = Seeder(seed, batch_size=40)
+        seeder.run(**{'products': 120, 'users': 30, 'sellers': 5, 'categories': 6, 'tag_count': 20, **options})
+        return seeder
+
+    def test_same_seed_writes_the_same_rows(self):
+        with transaction.atomic():
+            first = self.snapshot(self.seed())
+            transaction.set_rollback(True)
+        self.assertEqual(self.snapshot(self.seed()), first)
+        with self.assertRaises(ValueError):
+            self.seed()
+
+    def test_derived_tables_match_the_seeded_rows(self):
+        seeder = self.seed()
+        self.assertEqual(Product.objects.count(), 120)
+        ratings = list(Product.objects.order_by('pk').values_list(*Product.RATING_FIELDS))
+        recompute()
+        self.assertEqual(list(Product.objects.order_by('pk').values_list(*Product.RATING_FIELDS)), ratings)
+        self.assertEqual(reconcile(), 0)
+        self.assertTrue(CartItem.objects.exists())
+        self.assertEqual(
+            list(Order.objects.order_by('pk').values_list('total_price', flat=True)),
+            [sum(line.line_total for line in order.lines.all()) for order in Order.objects.order_by('pk').prefetch_related('lines')],
+        )
+        stored = {(row.facet, row.value): row.count for row in FacetCount.objects.all()}
+        counted = Counter(ProductFacet.objects.values_list('facet', 'value'))
+        self.assertEqual(stored, dict(counted))
+        product = Product.objects.get(pk=seeder.first_product)
+        self.assertIn(product, search_products(product.title).object_list)
+
+    def test_one_insert_per_table_and_batch(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.seed(derived=False)
+        inserts = Counter(
+            match.group(1) for query in ctx.captured_queries
+            if (match := re.search(r'INSERT INTO "(\w+)"', query['sql']))
+        )
+        self.assertGreater(Review.objects.count(), 3)
+        for table in ('core_product', 'core_review', 'core_image', 'core_product_color', 'taggit_taggeditem'):
+            self.assertEqual(inserts[table], 3, table)
+
+
+class LoadBenchmarkTests(TestCase):
+    def journey_routes(self):
+        products = list(Product.objects.prefetch_related('color'))
+        response = HttpResponseRedirect('/payment/card/1')
+        routes = set()
+        for journey in (loadtest.shopper_journey, loadtest.visitor_journey):
+            steps = journey(products, random.Random(0))
+            step = next(steps)
+            while True:
+                routes.add(step[0])
+                try:
+                    step = steps.send(response)
+                except StopIteration:
+                    break
+        return routes
+
+    def test_every_route_is_benchmarked_or_explained(self):
+        loadtest.seed_catalog(products=2, shoppers=1)
+        names = {pattern.name for pattern in urlpatterns}
+        self.assertEqual(self.journey_routes() | set(loadtest.UNMEASURED), names)
+
+    def test_run_reports_latency_and_queries_per_route(self):
+        users = loadtest.seed_catalog(products=5, shoppers=2)
+        with loadtest.payment_stub(), loadtest.quiet_request_logs():
+            result = loadtest.run(users, concurrency=1, iterations=2, warmup=0)
+        payment = result['routes']['GET payment']
+        self.assertEqual((payment['requests'], payment['errors']), (2, 0))
+        self.assertTrue(Order.objects.exclude(payment_session_id='').exists())
+        shop = result['routes']['GET products']
+        self.assertGreater(shop['queries'], 0)
+        self.assertLessEqual(shop['p50'], shop['p95'])
+        self.assertLessEqual(shop['p95'], shop['p99'])
+        self.assertEqual(result['requests'], sum(route['requests'] for route in result['routes'].values()))
+
+    def test_compare_flags_slower_routes_and_extra_queries(self):
+        baseline = {'throughput': 100, 'routes': {'GET home': {'p50': 10, 'p95': 20, 'p99': 30, 'queries': 5}}}
+        result = {'throughput': 95, 'routes': {'GET home': {'p50': 11, 'p95': 30, 'p99': 31, 'queries': 6}}}
+        regressed = {(label, metric) for label, metric, _, _, bad in loadtest.compare(result, baseline) if bad}
+        self.assertEqual(regressed, {('GET home', 'p95'), ('GET home', 'queries')})
@@ -0,0 +1,40 @@
+"""
+Token buckets kept in the cache. A bucket holds up to `capacity` tokens and
+refills at `capacity / period` tokens per second; each attempt spends one.
+Reads and writes are not atomic, so concurrent attempts can occasionally
+slip an extra token through. That is fine for slowing down bursts.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def spend(state, capacity, period, now):
+    """Return (allowed, new_state) for one attempt against `state`."""
+    tokens, updated = state if state else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * capacity / period)
+    if tokens < 1:
+        return False, (tokens, now)
+    return True, (tokens - 1, now)
+
+
+def consume(key, capacity, period, now=None):
+    now = time.time() if now is None else now
+    allowed, state = spend(cache.get(key), capacity, period, now)
+    cache.set(key, state, period)
+    return allowed
+
+
+async def aconsume(key, capacity, period, now=None):
+    now = time.time() if now is None else now
+    allowed, state = spend(await cache.aget(key), capacity, period, now)
+    await cache.aset(key, state, period)
+    return allowed
+
+
+def reset(key):
+    cache.delete(key)
+
+
+async def areset(key):
+    await cache.adelete(key)
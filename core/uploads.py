@@ -0,0 +1,52 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image as PILImage, UnidentifiedImageError
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream every upload to a temporary file chunk by chunk, hashing it on the
+    way so storage can name it by content without reading it again.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.content_hash = self.hasher.hexdigest()
+        return file
+
+
+def content_hash(file, chunk_size=64 * 1024):
+    digest = getattr(file, 'content_hash', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    for chunk in file.chunks(chunk_size):
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def image_dimensions(file):
+    """Return (width, height) from the image header without decoding any pixels."""
+    position = file.tell()
+    file.seek(0)
+    try:
+        # Image.open only parses the header; pixel data is read lazily on load().
+        with PILImage.open(file) as image:
+            return image.size
+    except (UnidentifiedImageError, OSError):
+        raise ValidationError('Upload a valid image.')
+    finally:
+        file.seek(position)
@@ -2,10 +2,9 @@ from django.urls import path
 from .views import *
 
 app_name = 'core'
-# whsec_51862af21b9750fc96326363db5e1fb0da34fda49444c65aff06ddef4244796c
 urlpatterns = [
     path('', home, name="home"),
-    # path('stripe-webhook/', stripe_webhook, name="stripe-webhook"),
+    path('stripe-webhook/', stripe_webhook, name="stripe-webhook"),
     path('login/', login_register_view, name="login_register"),
     path('logout/', logout_view, name="logout"),
     path('reset-password/', CustomPasswordResetView.as_view(), name='password_reset'),
@@ -19,10 +18,11 @@ urlpatterns = [
     path('edit-product/<slug:product_slug>/', edit_product, name="edit-product"),
     path('cart/', view_cart, name='view-cart'),
     path('add-to-cart/<slug:product_slug>/', add_to_cart, name='add-to-cart'),
-    path('checkout/<int:item_id>', checkout, name='checkout'),
-    path('payment/<str:payment_method>/<int:item_id>', payment, name='payment'),
+    path('checkout/', checkout, name='checkout'),
+    path('payment/<str:payment_method>/<int:order_id>', payment, name='payment'),
     path('success/', checkout_success, name='success'),
     path('cancel/', checkout_cancel, name='cancel'),
     path('search/', search_view, name='search'),
+    path('metrics/', metrics_view, name='metrics'),
 
 ]
@@ -1,33 +1,49 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import authenticate, login, logout
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.contrib.auth import alogin, logout
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.views import (
     PasswordResetView, PasswordResetDoneView, PasswordResetConfirmView, PasswordResetCompleteView)
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.urls import reverse_lazy
 from .forms import *
 from .models import *
+from django.db import transaction
 from django.db.models import Q
 from django.urls import reverse
-from taggit.models import Tag
-from django.db.models import Count
-from django.db.models.functions import Coalesce
 from django.contrib.auth.decorators import login_required
 import stripe
 from django.conf import settings
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib import messages
 import logging
-from django.core.mail import send_mail
+from . import cart, payments
+from .backends import EMAIL_OR_USERNAME_BACKEND, aauthenticate
+from .cache import cache_anonymous_page
+from .checkout import EmptyCartError, create_order, payment_session_params
+from .facets import faceted_search
+from .instrumentation import registry
+from .pagination import paginate_request
+from .recommendations import related_products
+from .search import search_products
+from .tags import popular_tags as get_popular_tags
+from .webhooks import record_event
+
+logger = logging.getLogger(__name__)
 
 
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
+@cache_anonymous_page('home')
 def home(request):
     slides = Slideshow.objects.all()
-    reviews = Review.objects.all()
-    products = Product.objects.all()
-    categories = Category.objects.all()
+    reviews = Review.objects.with_authors()
+    products = Product.objects.catalog().order_by('-created_at', '-id')[:12]
+    categories = Category.objects.with_newest_products(12)
     searchform = SearchForm(request.GET)
     context = {
         'slides': slides,
@@ -46,74 +62,64 @@ def search_view(request):
         form = SearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['q']
-            results = Product.objects.filter(title__icontains=query)
+            results = search_products(query, request.GET.get('cursor'))
+            results.params = request.GET.copy()
 
     return render(request, 'search_results.html', {'results': results, 'query': query})
 
-def login_register_view(request):
+async def login_register_view(request):
     login_form = CustomAuthenticationForm()
     registration_form = CustomUserCreationForm()
+    status = 200
 
-    if request.user.is_authenticated:
+    if (await request.auser()).is_authenticated:
         return redirect('core:home')
 
+    context = {}
     if request.method == 'POST':
 
         if 'login' in request.POST:
             login_form = CustomAuthenticationForm(request.POST)
             if login_form.is_valid():
-                email_or_username = login_form.cleaned_data['email_or_username']
-                password = login_form.cleaned_data['password']
-                users = User.objects.filter(Q(username=email_or_username) | Q(email=email_or_username))
-                if users.exists():
-                    user = authenticate(request, username=users[0].username, password=password)
-                    if user is not None:
-                        login(request, user)
-                        return redirect('core:home')
-                    else:
-                        error_message = 'Invalid username or password.'
-                        context = {
-                            'login_form': login_form,
-                            'registration_form': registration_form,
-                            'error_message': error_message,
-                        }
-                        return render(request, 'accounts/login_register.html', context)
-
-            else:
-                return render(request, 'accounts/login_register.html', {
-                    'login_form': login_form,
-                    'registration_form': registration_form
-                })
+                user = await aauthenticate(
+                    request,
+                    username=login_form.cleaned_data['email_or_username'],
+                    password=login_form.cleaned_data['password'],
+                )
+                if user is not None:
+                    await alogin(request, user)
+                    return redirect('core:home')
+                if getattr(request, 'login_throttled', False):
+                    context['error_message'] = 'Too many login attempts. Please wait a few minutes and try again.'
+                    status = 429
+                else:
+                    context['error_message'] = 'Invalid username or password.'
 
         elif 'register' in request.POST:
             registration_form = CustomUserCreationForm(request.POST)
-            if registration_form.is_valid():
-                user = User.objects.create_user(
-                    username=registration_form.cleaned_data['username'],
-                    email=registration_form.cleaned_data['email'],
-                    password=registration_form.cleaned_data['password1']
+            # Validation checks the database and runs the password validators.
+            if await sync_to_async(registration_form.is_valid)():
+                password = await sync_to_async(make_password, thread_sensitive=False)(
+                    registration_form.cleaned_data['password1'])
+                user = await User.objects.acreate(
+                    username=User.normalize_username(registration_form.cleaned_data['username']),
+                    email=User.objects.normalize_email(registration_form.cleaned_data['email']),
+                    password=password,
                 )
-                user.save()
-                login(request, user)
+                await alogin(request, user, backend=EMAIL_OR_USERNAME_BACKEND)
                 return redirect('core:home')
 
-            else:
-                return render(request, 'accounts/login_register.html', {
-                    'login_form': login_form,
-                    'registration_form': registration_form
-                })
-
-    context = {
+    context.update({
         'login_form': login_form,
         'registration_form': registration_form,
-    }
-
-    return render(request, 'accounts/login_register.html', context)
+    })
+    return await sync_to_async(render)(request, 'accounts/login_register.html', context, status=status)
 
 
 class CustomPasswordResetView(PasswordResetView):
     template_name = 'accounts/password_reset_form.html'
     email_template_name = 'accounts/password_reset_email.html'
+    form_class = OutboxPasswordResetForm
     success_url = reverse_lazy('core:password_reset_done')
 
     def form_valid(self, form):
@@ -179,32 +185,40 @@ def create_product(request):
     context = {'p_form': p_form, 'i_form': i_form, 'errors': errors}
     return render(request, 'create-product.html', context)
 
+SHOP_ORDERINGS = {
+    'newest': ('created_at', 'id'),
+    'rating': ('rating_average', 'id'),
+}
+
+@cache_anonymous_page('shop')
 def products(request):
-    price_range = request.GET.get('price_range')
     slides = Slideshow.objects.all()
-    products = Product.objects.all()
-    categories = Category.objects.all()
-    popular_tags = Tag.objects.annotate(num_times=Coalesce(Count('taggit_taggeditem_items'), 0)).order_by('-num_times')[:5]
-    if price_range:
-        min_price, max_price = map(int, price_range.split('-'))
-        filtered_products = products.filter(price__gte=min_price, price__lt=max_price)
-
-        if not filtered_products.exists():
-            products = Product.objects.all()
-       
+    categories = Category.objects.with_newest_products(12)
+    popular_tags = get_popular_tags(5)
+    filtered = faceted_search(Product.objects.catalog(), request.GET)
+    sort = request.GET.get('sort') if request.GET.get('sort') in SHOP_ORDERINGS else 'newest'
+    products = paginate_request(request, filtered.queryset, order=SHOP_ORDERINGS[sort])
+    sort_options = []
+    for key, label in (('newest', 'Newest'), ('rating', 'Top rated')):
+        params = request.GET.copy()
+        params.pop('cursor', None)
+        params['sort'] = key
+        sort_options.append({'label': label, 'query': params.urlencode(), 'selected': key == sort})
 
     context = {
         'slides': slides,
         'products': products,
         'categories': categories,
         'popular_tags': popular_tags,
+        'facets': filtered.facets,
+        'sort_options': sort_options,
     }
     return render(request, 'shop.html', context)
 
 def product_details(request, product_slug):
-    product = get_object_or_404(Product, slug=product_slug)
+    product = get_object_or_404(Product.objects.detail(), slug=product_slug)
     images = product.image_set.all()
-    reviews = Review.objects.filter(product=product)
+    reviews = Review.objects.with_authors().filter(product=product)
     user_already_reviewed = False
     product_owner_reviewing = False
 
@@ -219,6 +233,8 @@ def product_details(request, product_slug):
     cart_item_form = CartItemForm(product=product)
 
     if request.method == 'POST':
+        if user_already_reviewed:
+            return redirect('core:product-details', product_slug=product_slug)
         review_form = ReviewForm(request.POST)
         if review_form.is_valid():
             new_review = review_form.save(commit=False)
@@ -231,16 +247,12 @@ def product_details(request, product_slug):
             return redirect('core:product-details', product_slug=product_slug)
 
         else:
-            print("Not valid form")
+            logger.info('Invalid review for %s: %s', product_slug, review_form.errors.as_json())
             active_tab = 'reviews'
             return render(request, 'single-product.html', {'review_form': review_form, 'active_tab': active_tab})
     else:
         review_form = ReviewForm()
 
-    for review in reviews:
-        review.star_ratings = range(review.rating)
-        review.empty_star_ratings = range(5 - review.rating)
-
     context = {
         'product': product,
         'images': images,
@@ -250,41 +262,35 @@ def product_details(request, product_slug):
         'user_already_reviewed': user_already_reviewed,
         'product_owner_reviewing': product_owner_reviewing,
         'cart_item_form': cart_item_form,
+        'related_products': related_products(product),
     }
     return render(request, 'single-product.html', context)
 
 @login_required(login_url='core:login_register')
 def view_cart(request):
     user_profile = request.user.userprofile
-    cart_items = CartItem.objects.filter(user=user_profile)
-    total_price = sum(item.calculate_item_price() for item in cart_items)
     if request.method == 'POST':
         if 'update-cart' in request.POST:
             item_ids = request.POST.getlist('item_id')
-            for item in item_ids:
-                quantity = request.POST.get(f'quantity[{item}]', 1)
-                cart_item = get_object_or_404(CartItem, id=item, user=request.user.userprofile)
-                cart_item.quantity = quantity
-                cart_item.save()
+            quantities = {item: request.POST.get(f'quantity[{item}]', 1) for item in item_ids}
+            try:
+                cart.update_quantities(user_profile, quantities)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
 
             return redirect('core:view-cart')
         if 'remove-cart' in request.POST:
-            item_id = request.POST.get('remove-cart')
-            cart_item = get_object_or_404(CartItem, id=item_id, user=request.user.userprofile)
-
-            if cart_item.user == request.user.userprofile:
-                cart_item.delete()
+            cart.remove_item(user_profile, request.POST.get('remove-cart'))
 
             return redirect('core:view-cart')
-        
+
     context = {
-        'cart_items': cart_items,
-        'total_price': total_price,
+        'cart_items': cart.cart_items(user_profile),
+        'total_price': cart.cart_total(user_profile),
     }
 
     return render(request, 'cart.html', context)
 
-@login_required(login_url='core:login_register')
 def add_to_cart(request, product_slug):
     product = get_object_or_404(Product, slug=product_slug)
 
@@ -293,23 +299,14 @@ def add_to_cart(request, product_slug):
     if request.method == 'POST' and cart_item_form.is_valid():
         quantity = cart_item_form.cleaned_data['quantity'] or 1
         color = cart_item_form.cleaned_data['color']
-        size = cart_item_form.cleaned_data['size'] if hasattr(product, 'size') else None
-        cart_item, created = CartItem.objects.get_or_create(
-            user=request.user.userprofile,
-            product=product,
-            color=color,
-        )
-        if size is not None:
-            cart_item.size = size
-
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        size = cart_item_form.cleaned_data.get('size')
+        if not request.user.is_authenticated:
+            # Kept in the session and merged into the account cart at login.
+            cart.add_session_item(request.session, product, color, size, quantity)
+            messages.success(request, f'{product.title} was added to your cart. Log in to check out.')
+            return redirect('core:product-details', product_slug=product.slug)
 
-        else:
-            cart_item.quantity = quantity
-
-        cart_item.save()
+        cart.add_item(request.user.userprofile, product, color, size, quantity)
 
         return redirect(reverse('core:view-cart'))
 
@@ -349,7 +346,7 @@ def edit_product(request, product_slug):
 
 @login_required
 def product_list(request):
-    products = Product.objects.filter(user=request.user.userprofile)
+    products = paginate_request(request, Product.objects.catalog().filter(user=request.user.userprofile))
 
     if 'delete_product' in request.POST:
         product_id = request.POST.get('delete_product')
@@ -360,23 +357,23 @@ def product_list(request):
     return render(request, 'product_list.html', {'products': products})
 
 @login_required(login_url='core:login_register')
-def checkout(request, item_id):
+def checkout(request):
     user_profile = request.user.userprofile
-    cart = get_object_or_404(CartItem, id=item_id, user=user_profile)
-    total_price = cart.calculate_item_price()
-    has_existing_billing_address = Address.objects.filter(user=user_profile).exists()
+    summary = cart.cached_summary(user_profile)
+    if not summary['count']:
+        messages.warning(request, 'Your cart is empty.')
+        return redirect('core:view-cart')
     billing_address_instance = Address.objects.filter(user=user_profile, default=True).first()
+    has_existing_billing_address = billing_address_instance is not None or Address.objects.filter(user=user_profile).exists()
     form = CheckoutForm(request.POST or None)
 
     if request.method == 'POST' and form.is_valid():
-        order, _ = Order.objects.get_or_create(user=user_profile, cart=cart)
         default_billing_address = form.cleaned_data['use_default_billing_address']
 
         if default_billing_address:
-            billing_address = Address.objects.filter(user=user_profile, default=True).first()
-            order.billing_address = billing_address
+            billing_address = billing_address_instance
         else:
-            new_billing_address = Address(
+            billing_address = Address(
                 user=user_profile,
                 street_address=form.cleaned_data['street_address'],
                 apartment_address=form.cleaned_data['apartment_address'],
@@ -384,21 +381,23 @@ def checkout(request, item_id):
                 country=form.cleaned_data['country'],
                 default=True
             )
-            new_billing_address.save()
-            order.billing_address = new_billing_address
+            # Only one default address per user; the new one replaces it.
+            with transaction.atomic():
+                Address.objects.filter(user=user_profile, default=True).update(default=False)
+                billing_address.save()
 
-        if form.cleaned_data['order_notes']:
-            order.order_note = form.cleaned_data['order_notes']
+        try:
+            order = create_order(user_profile, billing_address, form.cleaned_data['order_notes'] or None)
+        except EmptyCartError:
+            messages.warning(request, 'Your cart is empty.')
+            return redirect('core:view-cart')
 
-        order.save()
         payment_method = form.cleaned_data.get('payment_method')
 
         if payment_method:
-            return redirect('core:payment', payment_method='card', item_id=item_id)
-    else:
-        print(form.errors)
+            return redirect('core:payment', payment_method='card', order_id=order.id)
     context = {
-        'total_price': total_price,
+        'total_price': summary['total'],
         'form': form,
         'has_existing_billing_address': has_existing_billing_address,
         'billing_address_instance': billing_address_instance,
@@ -406,119 +405,52 @@ def checkout(request, item_id):
     return render(request, 'checkout.html', context)
 
 @login_required(login_url='core:login_register')
-def payment(request, payment_method, item_id):
-    user_profile = request.user.userprofile
-    cart = get_object_or_404(CartItem, id=item_id, user=user_profile)
-    total_price = cart.calculate_item_price()
-    billing_address_exists = Address.objects.filter(user=user_profile).exists()
-    context = {'total_price': total_price, 'stripe_public_key': settings.STRIPE_PUBLISHABLE_KEY}
-    print(request.user.email)
+async def payment(request, payment_method, order_id):
+    user = await request.auser()
+    order = await aget_object_or_404(Order, id=order_id, user__user=user, order_status='Pending')
 
-    if billing_address_exists:
+    if order.billing_address_id:
+        params = await sync_to_async(payment_session_params)(request, order, payment_method)
         try:
-            payment_session = stripe.checkout.Session.create(
-                payment_method_types=[payment_method],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'usd',
-                        'product_data': {
-                            'name': cart.product.title,
-                        },
-                        'unit_amount': int(cart.product.price * 100),
-                    },
-                    'quantity': cart.quantity,
-                }],
-                customer_email=f'{request.user.email}',
-                mode='payment',
-                metadata={
-                    'item_id': cart.id,
-                    'item_name': cart.product.title,
-                    'user_id': user_profile.id,
-                    'userprofile': user_profile,
-                    'payment_method': payment_method,
-                },
-                success_url=request.build_absolute_uri(reverse('core:success')) + '?session_id={CHECKOUT_SESSION_ID}',
-                cancel_url=request.build_absolute_uri(reverse('core:cancel')),
-            )
-
-            context['session_id'] = payment_session.id
-
+            payment_session = await payments.acreate_session(params)
         except stripe.error.StripeError as e:
             messages.error(request, str(e))
+            return redirect('core:checkout')
 
+        order.payment_session_id = payment_session.id
+        await order.asave(update_fields=['payment_session_id'])
         return redirect(payment_session.url, code=303)
             
     else:
         messages.warning(request, 'Please add a billing address before proceeding to payment.')
-        return redirect('core:checkout', item_id=item_id)
-
-def remove_cart_items(session):
-    CartItem.objects.filter(id=session['metadata']['item_id'], user__id=session['metadata']['user_id']).delete()
-
-
-# @csrf_exempt
-# def stripe_webhook(request):
-#     payload = request.body
-#     sig_header = request.META['HTTP_STRIPE_SIGNATURE']
-#     event = None
-
-#     try:
-#         event = stripe.Webhook.construct_event(
-#         payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
-#     )
-#     except ValueError as e: 
-#         return HttpResponse(status=400)
-#     except stripe.error.SignatureVerificationError as e:
-#         return HttpResponse(status=400)
-
-#     if event['type'] == 'checkout.session.completed':
-#         session = stripe.checkout.Session.retrieve(event['data']['object']['id'])
-#         customer_email = session['customer_details']['email']
-#         customer_product = session['metadata']['item_name']
-#         user_id = session['metadata']['user_id']
-#         username = session['metadata']['userprofile']
-#         user_profile = get_object_or_404(UserProfile, user__username=username)
-#         cart_item = get_object_or_404(CartItem, id=session['metadata']['item_id'], user__id=user_id)
-        
-#         order = Order.objects.get(user__id=user_id, cart=cart_item)
-#         order.order_status = 'Completed'
-#         order.save()
-#         print(user_profile)
+        return redirect('core:checkout')
 
-#         payment = Payment.objects.create(user=user_profile, payment_method='CreditCard', payment_amount=cart_item.calculate_item_price())
-#         payment.payment_bool = True
-#         payment.save()
-
-
-#         remove_cart_items(session=session)
-
-#         subject = f'Payment Successful for {customer_product}'
-#         message = f'Thank you for your purchase. Your payment for {customer_product} was successful.'
-#         from_email = settings.DEFAULT_FROM_EMAIL
-#         recipient_list = [customer_email]
-
-#         send_mail(subject, message, from_email, recipient_list)
-
-#     return HttpResponse(status=200)
-
-
-def checkout_success(request):
-    session_id = request.GET.get('session_id')
-    if not session_id:
-        return redirect('core:cancel')
 
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    # Acknowledge as soon as the event is verified and stored; the order is
+    # completed by `python manage.py process_payment_events`.
     try:
-        payment_session = stripe.checkout.Session.retrieve(session_id)
-        item_id = payment_session.metadata.get('item_id')
-
-        CartItem.objects.filter(id=item_id, user=request.user.userprofile).delete()
+        record_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+    except (ValueError, KeyError, stripe.error.SignatureVerificationError):
+        return HttpResponse(status=400)
+    return HttpResponse(status=200)
 
-        return render(request, 'success.html')
-    except stripe.error.StripeError as e:
-        return redirect('core:cancel')
 
+def checkout_success(request):
+    return render(request, 'success.html')
 
 
 def checkout_cancel(request):
     return render(request, 'cancel.html')
 
+
+def metrics_view(request):
+    # Behind a proxy every request comes from the proxy's address, so scrapers
+    # send METRICS_TOKEN as a bearer token instead; staff can read it logged in.
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or (token and constant_time_compare(authorization, f'Bearer {token}'))):
+        raise Http404
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,134 @@
+import json
+import logging
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CartItem, Order, Payment, PaymentEvent
+from .outbox import build, enqueue_many
+
+logger = logging.getLogger(__name__)
+
+PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+MAX_ATTEMPTS = 5
+
+
+def record_event(payload, signature):
+    """
+    Verify a webhook delivery and store it keyed by the provider's event id.
+    Raises ValueError or stripe.SignatureVerificationError for bad requests.
+    Returns True when the event is new, False for a redelivery.
+    """
+    stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+    event = json.loads(payload)
+    _, created = PaymentEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={'event_type': event['type'], 'payload': event},
+    )
+    return created
+
+
+def session_of(event):
+    return event.payload['data']['object']
+
+
+def is_paid(event):
+    if event.event_type not in PAID_EVENTS:
+        return False
+    return session_of(event).get('payment_status') != 'unpaid'
+
+
+def order_confirmation(order, email):
+    return build(
+        f'Payment Successful for Order #{order.id}',
+        f'Thank you for your purchase. Your payment of ${order.total_price} for order #{order.id} was successful.',
+        [email],
+    )
+
+
+def complete_orders(events):
+    """
+    Complete the orders paid for by a batch of events in a fixed number of
+    queries. Orders that are already complete are left alone, so replays and
+    duplicate events for the same session are no-ops.
+    """
+    paid = {event.pk: event for event in events if is_paid(event)}
+    order_ids = {session_of(event).get('metadata', {}).get('order_id') for event in paid.values()}
+    orders = Order.objects.select_related('user__user').in_bulk(
+        [int(order_id) for order_id in order_ids if order_id]
+    )
+
+    now = timezone.now()
+    completed = {}
+    for event in events:
+        event.status = PaymentEvent.IGNORED
+        if event.pk not in paid:
+            continue
+        session = session_of(event)
+        order = orders.get(int(session.get('metadata', {}).get('order_id') or 0))
+        if order is None or order.payment_session_id not in ('', session['id']):
+            event.last_error = 'No matching order.'
+            continue
+        event.status = PaymentEvent.PROCESSED
+        if order.order_status == 'Pending' and order.pk not in completed:
+            email = (session.get('customer_details') or {}).get('email') or order.user.user.email
+            completed[order.pk] = (order, email)
+
+    if completed:
+        payments = Payment.objects.bulk_create(
+            Payment(user_id=order.user_id, payment_method='Stripe', payment_bool=True, payment_amount=order.total_price)
+            for order, _ in completed.values()
+        )
+        for (order, _), payment in zip(completed.values(), payments):
+            order.payment = payment
+            order.order_status = 'Completed'
+            order.completed_at = now
+        Order.objects.bulk_update([order for order, _ in completed.values()], ['payment', 'order_status', 'completed_at'])
+        CartItem.objects.filter(orderline__order__in=list(completed)).delete()
+        enqueue_many([order_confirmation(order, email) for order, email in completed.values() if email])
+
+    for event in events:
+        event.attempts += 1
+        event.processed_at = now
+    PaymentEvent.objects.bulk_update(events, ['status', 'attempts', 'last_error', 'processed_at'])
+    return len(completed)
+
+
+def fail_event(event, error):
+    event.refresh_from_db(fields=['status', 'attempts'])
+    event.attempts += 1
+    event.last_error = error
+    if event.attempts >= MAX_ATTEMPTS:
+        event.status = PaymentEvent.FAILED
+    event.save(update_fields=['status', 'attempts', 'last_error'])
+
+
+def process_pending(batch_size=100):
+    """Drain pending events in batches; returns the number of events handled."""
+    handled = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                PaymentEvent.objects.select_for_update(skip_locked=True)
+                .filter(status=PaymentEvent.PENDING, id__gt=last_id)
+                .order_by('id')[:batch_size]
+            )
+            if not batch:
+                return handled
+            last_id = batch[-1].id
+            try:
+                with transaction.atomic():
+                    complete_orders(batch)
+            except Exception:
+                logger.exception('Payment event batch failed; retrying events one at a time.')
+                batch = [event for event in PaymentEvent.objects.filter(pk__in=[e.pk for e in batch]).order_by('id')]
+                for event in batch:
+                    try:
+                        with transaction.atomic():
+                            complete_orders([event])
+                    except Exception as e:
+                        fail_event(event, repr(e))
+        handled += len(batch)
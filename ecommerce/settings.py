@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +49,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.StaticAssetMiddleware',
+    'core.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.sites.middleware.CurrentSiteMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,7 +64,7 @@ ROOT_URLCONF = 'ecommerce.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -69,6 +73,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.cart_summary',
             ],
         },
     },
@@ -82,13 +87,98 @@ WSGI_APPLICATION = 'ecommerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# WAL lets catalog reads run while cart and checkout write; synchronous=NORMAL
+# is safe under WAL and skips an fsync per commit.
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA cache_size=-20000;'
+    'PRAGMA mmap_size=134217728;'
+    'PRAGMA temp_store=MEMORY;'
+)
+
+# Under ASGI each request's queries run on a pool thread and a persistent
+# connection stays open per thread, so connections are closed after every
+# request unless DB_CONN_MAX_AGE says otherwise. Under WSGI, e.g. 600 reuses
+# them across requests.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 0))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS,
+            # Take the write lock when the transaction starts instead of failing
+            # with "database is locked" when a read upgrades to a write.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    },
+    # Read-only connections to the same file. Under WAL these never block
+    # or wait on the writer. Point NAME at a copy kept in sync (e.g. with
+    # Litestream) to move reads off the primary file entirely.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS + 'PRAGMA query_only=ON;',
+            'timeout': 20,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Swap in 'django.core.cache.backends.filebased.FileBasedCache' with a LOCATION
+# directory to share cached pages between worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecommerce',
     }
 }
 
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Facet counts for a filtered listing are cached per selection and dropped
+# with the catalog version, like cached pages.
+FACET_COUNTS_TIMEOUT = 60 * 10
+
+# Cart summaries are dropped on every cart or price change; the timeout only
+# bounds how long an idle cart's entry lingers.
+CART_SUMMARY_TIMEOUT = 60 * 60 * 24
+
+# Sessions are read from the cache and only written through to the database
+# when they change. With several server processes, point CACHES at a shared
+# backend (file or memcached) so every process sees the same sessions.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+AUTHENTICATION_BACKENDS = ['core.backends.EmailOrUsernameBackend']
+
+# Login token buckets as (attempts, seconds to refill them). Each attempt
+# spends one token from the client IP's bucket and one from the account's.
+LOGIN_THROTTLE_PER_IP = (20, 60)
+LOGIN_THROTTLE_PER_ACCOUNT = (5, 300)
+# Behind a reverse proxy REMOTE_ADDR is the proxy, so every visitor would
+# share one IP bucket. Name the header the proxies append the client address
+# to and how many proxies sit in front of the app, e.g. 'X-Forwarded-For' and
+# 1 for a single load balancer. Entries further left are client-supplied and
+# ignored.
+LOGIN_THROTTLE_IP_HEADER = None
+LOGIN_THROTTLE_TRUSTED_PROXIES = 1
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -123,7 +213,6 @@ USE_TZ = True
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
-import os
 STATIC_URL = '/static/'
 
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -133,9 +222,25 @@ STATICFILES_DIRS = (
     os.path.join(BASE_DIR, 'static'),
 )
 
+# collectstatic writes content-hashed copies plus .gz/.br siblings to
+# STATIC_ROOT; core.middleware.StaticAssetMiddleware serves them.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'core.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Stream every upload to a temporary file in chunks, hashing it as it arrives.
+FILE_UPLOAD_HANDLERS = ['core.uploads.HashingFileUploadHandler']
+
 from django.core.mail.backends import console
 
 DEFAULT_FROM_EMAIL = '##########'
@@ -154,4 +259,40 @@ STRIPE_PUBLISHABLE_KEY = "#####"
 STRIPE_SECRET_KEY = "#######"
 STRIPE_WEBHOOK_SECRET = "#####"
 
+# Point this at `python manage.py run_payment_stub` to exercise checkout offline.
+STRIPE_API_BASE = None
+STRIPE_TIMEOUT = 10
+STRIPE_MAX_NETWORK_RETRIES = 2
+STRIPE_POOL_SIZE = 20
+
+
+# Request instrumentation (core.middleware.RequestMetricsMiddleware)
+SLOW_QUERY_MS = 100
+SLOW_REQUEST_MS = 500
+# /metrics/ answers staff users and requests with 'Authorization: Bearer <token>'.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
 
+TESTING = sys.argv[1:2] == ['test']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # One JSON line per request; slow requests are logged as warnings.
+        'core.requests': {
+            'handlers': ['console'],
+            'level': 'WARNING' if TESTING else 'INFO',
+            'propagate': False,
+        },
+        'core.slow_queries': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}